@@ -0,0 +1,241 @@
+"""
+Сводка по всем пользователям для администраторов (/admin_report).
+
+Каждый шард читается одним запросом: один проход по sessions (с группировкой по дню, пользователю
+и задаче) плюс готовые итоги daily_totals за старые дни. Если аналитический снимок свежий - читается он,
+основной файл не трогается вовсе; иначе чтение идет из основной БД (WAL не блокирует запись).
+"""
+import os
+import sqlite3
+import time
+from datetime import datetime, timedelta, timezone
+from config import ADMIN_REPORT_DAYS, ADMIN_REPORT_TOP_TASKS, COMPACTION_HORIZON_DAYS
+from database import get_db_connections, get_shard_path, get_archive_path, fan_out, _get_daily_totals_until
+from analytics_snapshot import get_snapshot_path, get_shard_snapshot_time, connect_shard_snapshot
+from dashboard import _encode_figure, new_figure
+import matplotlib.pyplot as plt
+
+
+#Функция подключения к шарду для отчета: снимок, если он свежий, иначе основная БД
+def _connect(shard: int):
+    if get_shard_snapshot_time(shard):
+        conn = connect_shard_snapshot(shard)
+        conn.row_factory = sqlite3.Row
+        return conn, True
+    return get_db_connections(shard=shard), False
+
+
+#Функция размера файла в байтах (0, если файла нет)
+def _file_size(path: str):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+#Сводка шарда одним запросом: сессии читаются один раз в CTE recent (SQLite материализует CTE,
+#на который ссылаются несколько раз), остальное считается по нему и по готовым итогам daily_totals
+SHARD_REPORT_QUERY = """
+    WITH recent AS (
+        SELECT DATE(start_time) AS day, user_id, task_id, COUNT(*) AS sessions,
+               SUM(strftime('%s', end_time) - strftime('%s', start_time)) AS seconds
+        FROM sessions
+        WHERE start_time >= :scan_from
+        GROUP BY day, user_id, task_id
+    )
+    SELECT 'day' AS kind, day AS key, COUNT(DISTINCT user_id) AS users, SUM(sessions) AS sessions,
+           COALESCE(SUM(seconds), 0) AS seconds
+    FROM recent WHERE day >= :since GROUP BY day
+    UNION ALL
+    SELECT 'active', 1, COUNT(DISTINCT user_id), NULL, NULL FROM recent WHERE day >= :active_1
+    UNION ALL
+    SELECT 'active', 7, COUNT(DISTINCT user_id), NULL, NULL FROM recent WHERE day >= :active_7
+    UNION ALL
+    SELECT 'active', 30, COUNT(DISTINCT user_id), NULL, NULL FROM recent WHERE day >= :active_30
+    UNION ALL
+    SELECT 'task', task_id, NULL, NULL, COALESCE(SUM(seconds), 0) FROM (
+        SELECT task_id, seconds FROM recent WHERE day >= :until
+        UNION ALL
+        SELECT task_id, seconds FROM daily_totals WHERE day < :until
+    )
+    GROUP BY task_id
+"""
+
+
+#Функция сбора сводки по одному шарду
+def _shard_report(shard: int, since: str, today: str):
+    conn, from_snapshot = _connect(shard)
+    cursor = conn.cursor()
+    until = _get_daily_totals_until(cursor)
+    params = {'scan_from': min(since, until), 'since': since, 'until': until}
+    for period in (1, 7, 30):
+        params[f'active_{period}'] = (datetime.fromisoformat(today) - timedelta(days=period - 1)).date().isoformat()
+
+    daily = {}  # день -> [пользователей, сессий, секунд]
+    active = {}
+    task_seconds = {}
+    cursor.execute(SHARD_REPORT_QUERY, params)
+    for kind, key, users, sessions, seconds in cursor:
+        if kind == 'day':
+            daily[key] = [users, sessions, seconds]
+        elif kind == 'active':
+            active[key] = users
+        else:
+            task_seconds[key] = seconds
+
+    # Задачи: пользователи, новые пользователи и время по названиям (LOWER в SQLite не знает кириллицу)
+    first_seen = {}
+    names = {}
+    cursor.execute('SELECT id, user_id, name, created_at FROM tasks WHERE deleted_at IS NULL')
+    for task_id, user_id, name, created_at in cursor:
+        if user_id not in first_seen or created_at < first_seen[user_id]:
+            first_seen[user_id] = created_at
+        entry = names.setdefault(name.strip().lower(), [name.strip(), set(), 0])
+        entry[1].add(user_id)
+        entry[2] += task_seconds.get(task_id, 0)
+
+    cursor.execute('SELECT COUNT(*) FROM sessions')
+    sessions_total = cursor.fetchone()[0]
+    conn.close()
+
+    path = get_shard_path(shard)
+    return {
+        'from_snapshot': from_snapshot,
+        'users': len(first_seen),
+        'new_users': sum(created_at >= since for created_at in first_seen.values()),
+        'active': active,
+        'daily': daily,
+        'names': {key: [display, len(users), seconds] for key, (display, users, seconds) in names.items()},
+        'sessions_total': sessions_total,
+        'files': {
+            'db': _file_size(path),
+            'wal': _file_size(f"{path}-wal"),
+            'archive': _file_size(get_archive_path(shard)),
+            'snapshot': _file_size(get_snapshot_path(shard)),
+        },
+    }
+
+
+#Функция сбора сводки по всем шардам (запускать вне цикла событий: asyncio.to_thread)
+def build_report(days: int = ADMIN_REPORT_DAYS):
+    """
+    Пользователи живут ровно в одном шарде, поэтому счетчики шардов просто складываются.
+    Окно не больше горизонта сжатия: сессии старше него уже свернуты в итоги.
+    """
+    started = time.perf_counter()
+    days = max(1, min(days, max(COMPACTION_HORIZON_DAYS, 30)))
+    now = datetime.now(timezone.utc)
+    today = now.date().isoformat()
+    since = (now.date() - timedelta(days=days - 1)).isoformat()
+
+    report = {
+        'days': days, 'since': since, 'today': today, 'snapshot_shards': 0, 'users': 0, 'new_users': 0,
+        'active': {1: 0, 7: 0, 30: 0}, 'daily': {}, 'names': {}, 'sessions_total': 0,
+        'files': {'db': 0, 'wal': 0, 'archive': 0, 'snapshot': 0},
+    }
+    for shard in fan_out(lambda shard: _shard_report(shard, since, today)):
+        report['snapshot_shards'] += shard['from_snapshot']
+        report['users'] += shard['users']
+        report['new_users'] += shard['new_users']
+        report['sessions_total'] += shard['sessions_total']
+        for period, count in shard['active'].items():
+            report['active'][period] += count
+        for day, values in shard['daily'].items():
+            totals = report['daily'].setdefault(day, [0, 0, 0])
+            for i, value in enumerate(values):
+                totals[i] += value
+        for key, (display, users, seconds) in shard['names'].items():
+            entry = report['names'].setdefault(key, [display, 0, 0])
+            entry[1] += users
+            entry[2] += seconds
+        for name, size in shard['files'].items():
+            report['files'][name] += size
+
+    report['top_tasks'] = sorted(report['names'].values(), key=lambda entry: entry[2], reverse=True)[:ADMIN_REPORT_TOP_TASKS]
+    report['elapsed'] = time.perf_counter() - started
+    return report
+
+
+#Функция форматирования размера в мегабайтах
+def _mb(size: int):
+    return f"{size / 2**20:.1f} МБ"
+
+
+#Функция текста сводки
+def format_report(report: dict):
+    days = report['days']
+    sessions = sum(values[1] for values in report['daily'].values())
+    hours = sum(values[2] for values in report['daily'].values()) / 3600
+    today = report['daily'].get(report['today'], [0, 0, 0])
+    files = report['files']
+    source = "аналитический снимок" if report['snapshot_shards'] else "основная БД"
+
+    lines = [
+        f"📈 Сводка за {days} дн. (источник: {source})",
+        "",
+        f"Пользователи: {report['users']}, новых за {days} дн.: {report['new_users']}",
+        f"Активные: сегодня {report['active'][1]}, за 7 дн. {report['active'][7]}, за 30 дн. {report['active'][30]}",
+        f"Сессий за {days} дн.: {sessions} (в среднем {sessions / days:.0f} в день), {hours:.0f} ч",
+        f"Сегодня: сессий {today[1]}, {today[2] / 3600:.0f} ч",
+        "",
+        "Топ задач по времени:",
+    ]
+    for i, (name, users, seconds) in enumerate(report['top_tasks'], start=1):
+        lines.append(f"{i}. {name} - {seconds / 3600:.0f} ч, пользователей: {users}")
+
+    # Прирост оцениваем по среднему размеру сессии в основном файле
+    bytes_per_session = files['db'] / report['sessions_total'] if report['sessions_total'] else 0
+    lines += [
+        "",
+        f"БД: {_mb(files['db'])} (WAL {_mb(files['wal'])}), архив {_mb(files['archive'])}, "
+        f"снимок {_mb(files['snapshot'])}",
+        f"Сессий в основной БД: {report['sessions_total']}, прирост ≈ {_mb(bytes_per_session * sessions / days * 30)} в месяц",
+        f"Сводка собрана за {report['elapsed']:.2f} с",
+    ]
+    return "\n".join(lines)
+
+
+#Функция текста о состоянии процесса бота: задержка цикла событий, зависания, фоновые задачи, отправка, повторы
+def format_runtime(loop_stats: dict, stalls, job_metrics: dict, outbound_stats: dict = None, dedup_stats: dict = None):
+    lines = [
+        "⚙️ Состояние бота",
+        f"Задержка цикла событий: p50 {loop_stats['p50'] * 1000:.0f} мс, p95 {loop_stats['p95'] * 1000:.0f} мс, "
+        f"p99 {loop_stats['p99'] * 1000:.0f} мс, max {loop_stats['max'] * 1000:.0f} мс",
+        f"Зависаний цикла: {loop_stats['stalls']}",
+    ]
+    for stall in stalls:
+        duration = f"{stall['duration']:.2f} с" if stall['duration'] is not None else "идет"
+        lines.append(f"- {stall['at']}: {duration}, {stall['where']} ({stall['update']})")
+    for name, metrics in job_metrics.items():
+        lines.append(f"{name}: запусков {metrics['runs']}, последний {metrics['last_duration']:.1f} с")
+    if outbound_stats:
+        lines.append("Исходящие запросы: " + ", ".join(f"{key} {value}" for key, value in outbound_stats.items()))
+    if dedup_stats:
+        lines.append("Повторы: " + ", ".join(f"{key} {value}" for key, value in dedup_stats.items()))
+    return "\n".join(lines)
+
+
+#Функция графика: сессии и активные пользователи по дням
+def render_report_chart(report: dict, profile: str):
+    days = sorted(report['daily'])
+    if not days:
+        return None
+    labels = [datetime.fromisoformat(day).strftime('%d.%m') for day in days]
+
+    with new_figure(figsize=(10, 4)) as (fig, ax):
+        ax.bar(labels, [report['daily'][day][1] for day in days], color='#4c72b0', label='Сессий')
+        ax.set_ylabel('Сессий')
+        ax.tick_params(axis='x', rotation=90, labelsize=8)
+        users_ax = ax.twinx()
+        users_ax.plot(labels, [report['daily'][day][0] for day in days], color='#dd8452', marker='o', label='Активных пользователей')
+        users_ax.set_ylabel('Активных пользователей')
+        users_ax.set_ylim(bottom=0)
+        users_ax.grid(False)
+        ax.set_title(f"Сессии и активные пользователи за {report['days']} дн.", loc='left')
+        # Общая легенда двух осей - справа над графиком, чтобы не закрывать столбцы
+        handles = ax.get_legend_handles_labels()[0] + users_ax.get_legend_handles_labels()[0]
+        ax.legend(handles=handles, loc='lower right', bbox_to_anchor=(1, 1), ncol=2, frameon=False)
+        plt.tight_layout()
+
+        img_bytes = _encode_figure(fig, profile)
+    return img_bytes
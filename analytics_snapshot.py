@@ -0,0 +1,72 @@
+import os
+import sqlite3
+import logging
+import time
+from datetime import datetime, timezone
+from config import ANALYTICS_MAX_STALENESS
+from database import get_db_connections, get_shard_path, get_user_shard, fan_out
+
+
+#Путь к файлу снимка для шарда
+def get_snapshot_path(shard: int):
+    base, ext = os.path.splitext(get_shard_path(shard))
+    return f"{base}.analytics{ext}"
+
+
+#Функция обновления снимка одного шарда через sqlite3 backup API
+def _refresh_shard_snapshot(shard: int):
+    """
+    Копия пишется во временный файл и атомарно подменяет старый снимок: те, кто
+    сейчас читает снимок, дочитывают старую версию. В режиме WAL копирование идет
+    внутри читающей транзакции и не блокирует запись сессий.
+    """
+    path = get_snapshot_path(shard)
+    tmp_path = f"{path}.tmp"
+
+    source = get_db_connections(shard=shard)
+    target = sqlite3.connect(tmp_path)
+    try:
+        source.backup(target)
+        target.execute('PRAGMA journal_mode = DELETE')
+    finally:
+        target.close()
+        source.close()
+    os.replace(tmp_path, path)
+
+
+#Функция обновления снимков всех шардов (запускается JobQueue по расписанию)
+def refresh_snapshots():
+    started = time.perf_counter()
+    fan_out(_refresh_shard_snapshot)
+    elapsed = time.perf_counter() - started
+    logging.info(f"Аналитический снимок обновлен за {elapsed:.2f} с")
+    return elapsed
+
+
+#Функция получения времени снимка шарда пользователя
+def get_snapshot_time(user_id: int):
+    """
+    Время снимка в UTC или None, если снимка нет или он старше ANALYTICS_MAX_STALENESS -
+    тогда аналитика читается из основной БД.
+    """
+    return get_shard_snapshot_time(get_user_shard(user_id))
+
+
+def get_shard_snapshot_time(shard: int):
+    try:
+        taken_at = os.path.getmtime(get_snapshot_path(shard))
+    except OSError:
+        return None
+
+    if time.time() - taken_at > ANALYTICS_MAX_STALENESS:
+        return None
+    return datetime.fromtimestamp(taken_at, timezone.utc)
+
+
+#Функция открытия снимка шарда пользователя только для чтения
+def connect_snapshot(user_id: int):
+    return connect_shard_snapshot(get_user_shard(user_id))
+
+
+def connect_shard_snapshot(shard: int):
+    return sqlite3.connect(f"file:{get_snapshot_path(shard)}?mode=ro", uri=True)
@@ -1,4 +1,105 @@
 import os
 
 #Токен хранится в секрете
-BOT_TOKEN = os.getenv("BOT_TOKEN")
\ No newline at end of file
+BOT_TOKEN = os.getenv("BOT_TOKEN")
+
+#Путь к файлу БД
+DB_PATH = os.getenv("DB_PATH", "/data/time_tracker.db")
+
+#Хранилище задач и сессий: sqlite - файлы DB_PATH, memory - в памяти процесса (тесты и бенчмарки, данные не сохраняются)
+STORAGE_ENGINE = os.getenv("STORAGE_ENGINE", "sqlite")
+
+#Шардирование: пользователи распределяются по DB_SHARDS файлам по хешу user_id (1 - один файл DB_PATH)
+DB_SHARDS = int(os.getenv("DB_SHARDS", "1"))
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "4"))  # Свободных соединений на шард
+
+#Смещение часового пояса пользователей относительно UTC (МСК = +3)
+TZ_OFFSET_HOURS = int(os.getenv("TZ_OFFSET_HOURS", "3"))
+
+#Импорт истории из CSV
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "5000"))  # Сессий в одной транзакции
+IMPORT_MAX_FILE_SIZE = 20 * 1024 * 1024  # Лимит Telegram на скачивание файла ботом
+
+#Удаление задач: задача скрывается сразу, ее сессии удаляются фоновой задачей небольшими порциями
+TASK_UNDO_MINUTES = int(os.getenv("TASK_UNDO_MINUTES", "10"))  # Сколько минут удаление можно отменить
+TASK_PURGE_INTERVAL = int(os.getenv("TASK_PURGE_INTERVAL", "300"))  # Как часто удалять сессии удаленных задач, сек
+TASK_PURGE_CHUNK_ROWS = int(os.getenv("TASK_PURGE_CHUNK_ROWS", "500"))  # Строк в одной транзакции
+
+#Количество задач на одной странице выбора задачи
+TASK_PICKER_PAGE_SIZE = int(os.getenv("TASK_PICKER_PAGE_SIZE", "8"))
+
+#Как часто (в секундах) сохранять состояния диалогов и user_data в БД
+PERSISTENCE_UPDATE_INTERVAL = float(os.getenv("PERSISTENCE_UPDATE_INTERVAL", "30"))
+
+#Кеш готовых дашбордов (сколько пользователей держим в памяти)
+DASHBOARD_CACHE_SIZE = int(os.getenv("DASHBOARD_CACHE_SIZE", "200"))
+
+#Фоновые задачи в тихие часы (по времени пользователей, см. TZ_OFFSET_HOURS)
+QUIET_HOURS_START = int(os.getenv("QUIET_HOURS_START", "3"))  # Час начала
+QUIET_HOURS_END = int(os.getenv("QUIET_HOURS_END", "6"))  # Час окончания, после него задачи прерываются
+PRERENDER_ACTIVE_DAYS = int(os.getenv("PRERENDER_ACTIVE_DAYS", "3"))  # Кому заранее рисовать дашборд
+BACKGROUND_CPU_SHARE = float(os.getenv("BACKGROUND_CPU_SHARE", "0.25"))  # Доля времени, которую занимают фоновые задачи
+if not 0 < BACKGROUND_CPU_SHARE <= 1:
+    raise ValueError(f"BACKGROUND_CPU_SHARE должна быть больше 0 и не больше 1, задано {BACKGROUND_CPU_SHARE}")
+
+#Автоостановка забытых сессий
+MAX_SESSION_HOURS = float(os.getenv("MAX_SESSION_HOURS", "12"))  # Лимит по умолчанию, 0 - без ограничения
+SESSION_REMINDER_MINUTES = int(os.getenv("SESSION_REMINDER_MINUTES", "30"))  # Напоминание до автоостановки
+
+#Аналитический снимок БД для дашборда (тяжелые запросы не читают основной файл)
+ANALYTICS_SNAPSHOT_INTERVAL = int(os.getenv("ANALYTICS_SNAPSHOT_INTERVAL", "300"))  # Как часто обновлять, сек
+ANALYTICS_MAX_STALENESS = int(os.getenv("ANALYTICS_MAX_STALENESS", "900"))  # Старше - читаем основную БД, сек
+
+#Сжатие старой истории: сессии старше горизонта сворачиваются в итоги и уходят в архивный файл
+COMPACTION_HORIZON_DAYS = int(os.getenv("COMPACTION_HORIZON_DAYS", "365"))  # Не меньше 30
+COMPACTION_CHUNK_DAYS = int(os.getenv("COMPACTION_CHUNK_DAYS", "30"))  # Дней в одной транзакции
+
+#Исходящие запросы к Bot API (лимиты Telegram: ~30 сообщений/с на бота, ~1 сообщение/с в чат)
+OUTBOUND_GLOBAL_RATE = float(os.getenv("OUTBOUND_GLOBAL_RATE", "25"))  # Запросов в секунду на бота
+OUTBOUND_CHAT_RATE = float(os.getenv("OUTBOUND_CHAT_RATE", "1"))  # Запросов в секунду в один чат
+OUTBOUND_CHAT_BURST = int(os.getenv("OUTBOUND_CHAT_BURST", "4"))  # Сколько запросов в чат можно отправить подряд
+OUTBOUND_MAX_RETRIES = int(os.getenv("OUTBOUND_MAX_RETRIES", "3"))  # Повторов после 429
+PLACEHOLDER_DELAY = float(os.getenv("PLACEHOLDER_DELAY", "0.3"))  # Через сколько секунд показывать "⏳ ..."
+
+#Профиль вывода дашборда по умолчанию: full, mobile, jpeg, webp (пользователь может выбрать свой: /dashboard_profile)
+DASHBOARD_PROFILE = os.getenv("DASHBOARD_PROFILE", "mobile")
+DASHBOARD_JPEG_QUALITY = int(os.getenv("DASHBOARD_JPEG_QUALITY", "80"))
+DASHBOARD_WEBP_QUALITY = int(os.getenv("DASHBOARD_WEBP_QUALITY", "80"))
+HEATMAP_TIME_BUDGET = float(os.getenv("HEATMAP_TIME_BUDGET", "1.0"))  # Секунд на календарь активности за год
+
+#Администраторы бота: user_id через запятую (доступ к /admin_report)
+ADMIN_IDS = {int(user_id) for user_id in os.getenv("ADMIN_IDS", "").split(",") if user_id.strip()}
+ADMIN_REPORT_DAYS = int(os.getenv("ADMIN_REPORT_DAYS", "30"))  # Окно сводки, дней (не больше горизонта сжатия)
+ADMIN_REPORT_TOP_TASKS = int(os.getenv("ADMIN_REPORT_TOP_TASKS", "10"))  # Сколько названий задач в топе
+
+#Контроль задержки цикла событий (блокирующие вызовы в обработчиках)
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.1"))  # Период пульса, сек
+LOOP_STALL_THRESHOLD = float(os.getenv("LOOP_STALL_THRESHOLD", "0.2"))  # Задержка, после которой снимается стек, сек
+LOOP_LAG_WINDOW = float(os.getenv("LOOP_LAG_WINDOW", "300"))  # За какое время считать перцентили, сек
+LOOP_LAG_REPORT_INTERVAL = int(os.getenv("LOOP_LAG_REPORT_INTERVAL", "300"))  # Как часто писать перцентили в лог, сек
+
+#Запуск и остановка (см. lifecycle.py)
+WARMUP_TIME_BUDGET = float(os.getenv("WARMUP_TIME_BUDGET", "10"))  # Сколько секунд при запуске прогревать данные недавних пользователей
+READY_FILE = os.getenv("READY_FILE", "")  # Файл создается, когда бот готов забирать обновления (проверка готовности контейнера)
+
+#Журнал: пишется через очередь в отдельном потоке (см. logging_setup.py)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")  # json - одна запись JSON на строку, text - как раньше
+LOG_FILE = os.getenv("LOG_FILE", "")  # Файл журнала с ротацией, пусто - только в консоль
+LOG_FILE_MAX_MB = float(os.getenv("LOG_FILE_MAX_MB", "20"))  # Размер файла до ротации
+LOG_FILE_BACKUPS = int(os.getenv("LOG_FILE_BACKUPS", "5"))  # Сколько старых файлов хранить
+LOG_INFO_PER_SECOND = int(os.getenv("LOG_INFO_PER_SECOND", "20"))  # INFO с одного места кода в секунду, 0 - без прореживания
+
+#Подавление повторов: двойное нажатие кнопки или повторное сообщение того же пользователя
+DEDUP_WINDOW = float(os.getenv("DEDUP_WINDOW", "1.0"))  # Повтор в течение стольких секунд после обработки отбрасывается
+DEDUP_MAX_KEYS = int(os.getenv("DEDUP_MAX_KEYS", "10000"))  # Сколько последних обновлений помнить
+
+#Процессы рисования картинок (перезапускаются, чтобы память бота не росла неделями)
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", "1"))  # Сколько процессов, 0 - рисовать в самом боте
+RENDER_MAX_TASKS = int(os.getenv("RENDER_MAX_TASKS", "200"))  # Картинок до перезапуска процесса
+RENDER_MAX_RSS_MB = float(os.getenv("RENDER_MAX_RSS_MB", "400"))  # Перезапуск, если процесс занял больше
+
+#Отчет о памяти для администраторов (/memory)
+MEMORY_TRACE_ON_START = os.getenv("MEMORY_TRACE_ON_START", "0") == "1"  # Включить tracemalloc сразу при запуске
+MEMORY_TRACE_FRAMES = int(os.getenv("MEMORY_TRACE_FRAMES", "1"))  # Глубина стека для каждого выделения
+MEMORY_REPORT_TOP = int(os.getenv("MEMORY_REPORT_TOP", "10"))  # Сколько строк кода показывать
@@ -1,4 +1,9 @@
-import sqlite3
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
 import matplotlib
 
 matplotlib.use('Agg')
@@ -6,20 +11,40 @@ import matplotlib.pyplot as plt
 import seaborn as sns
 from io import BytesIO
 import logging
+import numpy as np
 import pandas as pd
+from PIL import Image
+from matplotlib.colors import BoundaryNorm, ListedColormap
 from datetime import datetime, timedelta
-
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('dashboard.log'),
-        logging.StreamHandler()
-    ]
+from config import (
+    DASHBOARD_CACHE_SIZE, DASHBOARD_PROFILE, DASHBOARD_JPEG_QUALITY, DASHBOARD_WEBP_QUALITY, HEATMAP_TIME_BUDGET,
+    RENDER_WORKERS
 )
+from storage import storage
+from render_workers import render_workers
+
 logger = logging.getLogger(__name__)
 
+# Профили вывода: 16x12 дюймов при 80 dpi = 1280x960 - больше Telegram все равно не показывает (сжимает фото до 1280)
+DASHBOARD_PROFILES = {
+    'full': {'dpi': 120, 'format': 'PNG', 'title': 'PNG 1920px (как раньше)'},
+    'mobile': {'dpi': 80, 'format': 'PNG', 'colors': 256, 'title': 'PNG 1280px, 256 цветов (самый легкий)'},
+    'jpeg': {'dpi': 80, 'format': 'JPEG', 'quality': DASHBOARD_JPEG_QUALITY, 'title': 'JPEG 1280px'},
+    'webp': {'dpi': 80, 'format': 'WEBP', 'quality': DASHBOARD_WEBP_QUALITY, 'title': 'WebP 1280px'},
+}
+# Опечатка в настройке иначе всплыла бы только KeyError при первой отрисовке или прогреве
+if DASHBOARD_PROFILE not in DASHBOARD_PROFILES:
+    raise ValueError(f"DASHBOARD_PROFILE={DASHBOARD_PROFILE!r} не поддерживается, возможные значения: "
+                     f"{', '.join(DASHBOARD_PROFILES)}")
+
+# Кеш готовых картинок: (user_id, вид) -> (версия данных, байты изображения), вытесняются самые старые
+_dashboard_cache = OrderedDict()
+_cache_lock = threading.Lock()
+# Картинки, которые рисуются прямо сейчас: (user_id, вид, версия) -> Future. Одинаковый запрос
+# (двойное нажатие, запрос пользователя во время фоновой отрисовки) ждет ту же картинку, а не рисует вторую
+_inflight = {}
+_render_stats = {'rendered': 0, 'shared': 0}
+
 # Настройка стиля Seaborn
 sns.set_theme(
     style="whitegrid",
@@ -35,89 +60,14 @@ sns.set_theme(
 )
 
 
-def get_dashboard_data(user_id):
+def get_dashboard_data(user_id, from_snapshot=False):
     """Получаем все данные для дашборда с точным расчетом времени"""
-    conn = None
     try:
-        conn = sqlite3.connect('/data/time_tracker.db')
-
-        # 1. Данные по дням (последние 7 дней)
-        date_query = """
-        WITH RECURSIVE date_range AS (
-            SELECT date('now', '-6 days') AS date
-            UNION ALL
-            SELECT date(date, '+1 day')
-            FROM date_range
-            WHERE date < date('now')
-        )
-        SELECT 
-            date_range.date,
-            COALESCE(SUM(strftime('%s', sessions.end_time) - strftime('%s', sessions.start_time)), 0) AS seconds
-        FROM date_range
-        LEFT JOIN sessions ON date_range.date = date(sessions.start_time)
-                          AND sessions.user_id = ?
-                          AND sessions.end_time IS NOT NULL
-        GROUP BY date_range.date
-        ORDER BY date_range.date
-        """
-
-        # 2. Данные по задачам (все время)
-        task_query = """
-        SELECT 
-            tasks.name AS task_name,
-            SUM(strftime('%s', sessions.end_time) - strftime('%s', sessions.start_time)) AS seconds
-        FROM sessions
-        JOIN tasks ON sessions.task_id = tasks.id
-        WHERE sessions.user_id = ? AND sessions.end_time IS NOT NULL
-        GROUP BY tasks.name
-        ORDER BY seconds DESC
-        """
-
-        # 3. Точный расчет активности по часам
-        hour_query = """
-        WITH RECURSIVE hour_intervals AS (
-            SELECT 
-                sessions.rowid,
-                sessions.start_time,
-                sessions.end_time,
-                sessions.start_time AS interval_start,
-                CASE 
-                    WHEN datetime(sessions.start_time, 'start of hour', '+1 hour') < sessions.end_time THEN
-                        datetime(sessions.start_time, 'start of hour', '+1 hour')
-                    ELSE
-                        sessions.end_time
-                END AS interval_end
-            FROM sessions
-            WHERE sessions.user_id = ? AND sessions.end_time IS NOT NULL
-
-            UNION ALL
-
-            SELECT 
-                h.rowid,
-                h.start_time,
-                h.end_time,
-                h.interval_end AS interval_start,
-                CASE 
-                    WHEN datetime(h.interval_end, 'start of hour', '+1 hour') < h.end_time THEN
-                        datetime(h.interval_end, 'start of hour', '+1 hour')
-                    ELSE
-                        h.end_time
-                END AS interval_end
-            FROM hour_intervals h
-            WHERE h.interval_end < h.end_time
-        )
-        SELECT 
-            strftime('%H', interval_start) AS hour,
-            SUM(strftime('%s', interval_end) - strftime('%s', interval_start)) AS seconds
-        FROM hour_intervals
-        GROUP BY hour
-        ORDER BY hour
-        """
-
-        # Выполняем запросы
-        daily_data = pd.read_sql(date_query, conn, params=(user_id,))
-        task_data = pd.read_sql(task_query, conn, params=(user_id,))
-        hour_data = pd.read_sql(hour_query, conn, params=(user_id,))
+        # Тяжелые запросы по всей истории хранилище читает из аналитического снимка, чтобы не мешать записи сессий
+        daily_rows, task_rows, hour_rows = storage.get_dashboard_data(user_id, from_snapshot)
+        daily_data = pd.DataFrame(daily_rows, columns=['date', 'seconds'])
+        task_data = pd.DataFrame(task_rows, columns=['task_name', 'seconds'])
+        hour_data = pd.DataFrame(hour_rows, columns=['hour', 'seconds'])
 
         # Преобразование данных
         def safe_convert(df, col, convert_fn):
@@ -143,179 +93,462 @@ def get_dashboard_data(user_id):
     except Exception as e:
         logger.error(f"Ошибка получения данных: {str(e)}", exc_info=True)
         return pd.DataFrame(), pd.DataFrame(), pd.DataFrame()
-    finally:
-        if conn:
-            conn.close()
 
 
-def generate_dashboard(user_id):
-    """Генерация финального дашборда с 4 графиками"""
+#Функция выбора профиля вывода пользователя
+def get_user_profile(user_id):
+    profile = storage.get_dashboard_profile(user_id)
+    return profile if profile in DASHBOARD_PROFILES else DASHBOARD_PROFILE
+
+
+def _get_version(user_id):
+    """Версия для кеша: профиль + время снимка или (если снимок устарел) состояние основной БД"""
+    profile = get_user_profile(user_id)
+    snapshot_time = storage.get_snapshot_time(user_id)
+    if snapshot_time is not None:
+        return (profile, 'snapshot', snapshot_time), snapshot_time
+    return (profile, 'live', storage.get_dashboard_version(user_id)), None
+
+
+def _cached_render(user_id, view, target, *args, version=None):
+    """
+    Возвращает (изображение, время данных в UTC или None, если данные актуальные).
+    Картинка берется из кеша, если данные пользователя не менялись, иначе рисуется заново
+    в процессе-рисовальщике: target(*args, from_snapshot=..., profile=...).
+    version - результат _get_version, если его уже получили вместе с данными (графики дашборда).
+    """
+    key = (user_id, view)
+    version, data_time = version or _get_version(user_id)
+    with _cache_lock:
+        cached = _dashboard_cache.get(key)
+        if cached and cached[0] == version:
+            _dashboard_cache.move_to_end(key)
+            logger.info(f"{view} для user_id={user_id} взят из кеша")
+            return BytesIO(cached[1]), data_time
+
+        flight_key = (key, version)
+        future = _inflight.get(flight_key)
+        owner = future is None
+        if owner:
+            future = _inflight[flight_key] = Future()
+            _render_stats['rendered'] += 1
+        else:
+            _render_stats['shared'] += 1
+    if not owner:
+        logger.info(f"{view} для user_id={user_id} уже рисуется, ждем ту же картинку")
+        img_bytes = future.result()
+        return (BytesIO(img_bytes) if img_bytes else None), data_time
+
+    img_bytes = None
+    try:
+        img_bytes = render_workers.render(target, *args, from_snapshot=data_time is not None, profile=version[0])
+    finally:
+        with _cache_lock:
+            del _inflight[flight_key]
+            if img_bytes:
+                _dashboard_cache[key] = (version, img_bytes.getvalue())
+                _dashboard_cache.move_to_end(key)
+                while len(_dashboard_cache) > DASHBOARD_CACHE_SIZE:
+                    _dashboard_cache.popitem(last=False)
+        future.set_result(img_bytes.getvalue() if img_bytes else None)
+    return img_bytes, data_time
+
+
+def get_cache_stats():
+    """Размер кеша картинок: (записей, байт)"""
+    with _cache_lock:
+        return len(_dashboard_cache), sum(len(image) for _, image in _dashboard_cache.values())
+
+
+def get_render_stats():
+    """Счетчики отрисовок: сколько нарисовано и сколько запросов получили чужую, уже рисующуюся картинку"""
+    with _cache_lock:
+        return dict(_render_stats)
+
+
+def generate_heatmap(user_id, task_id=None):
+    """Активность за год по дням (task_id=None - по всем задачам): (изображение, время данных)"""
+    return _cached_render(user_id, ('heatmap', task_id), 'dashboard:_render_heatmap', user_id, task_id)
+
+
+def prerender_dashboard(user_id):
+    """Заранее рисует графики дашборда в кеш (фоновая задача). True - если пришлось рисовать"""
+    version = _get_version(user_id)[0]
+    with _cache_lock:
+        missing = [panel for panel in DASHBOARD_PANELS
+                   if (_dashboard_cache.get((user_id, ('dashboard', panel))) or (None,))[0] != version]
+    if not missing:
+        return False
+    prepared = prepare_dashboard(user_id)
+    missing = [panel for panel in dashboard_panels(prepared) if panel in missing]
+    for panel in missing:
+        generate_dashboard_panel(user_id, panel, prepared)
+    return bool(missing)
+
+
+@contextmanager
+def new_figure(*args, **kwargs):
+    """plt.subplots, фигура закрывается на любом выходе из блока - в том числе по исключению"""
+    fig, axes = plt.subplots(*args, **kwargs)
     try:
-        logger.info(f"Старт генерации дашборда для user_id={user_id}")
-
-        # Получаем данные
-        daily_data, task_data, hour_data = get_dashboard_data(user_id)
-
-        # Создаем фигуру с 4 subplots
-        fig, axes = plt.subplots(2, 2, figsize=(16, 12))
-        fig.suptitle(f'Дашборд активности', y=1.02)
-
-        # --- График 1: Активность по дням ---
-        if not daily_data.empty:
-            ax = sns.barplot(
-                ax=axes[0, 0],
-                x='date',
-                y='hours',
-                data=daily_data,
-                hue='date',
-                palette="viridis",
-                legend=False,
-                dodge=False
+        yield fig, axes
+    finally:
+        plt.close(fig)
+
+
+def _encode_figure(fig, profile):
+    """
+    Кодирование фигуры по профилю. Фигура рисуется один раз, поля обрезаются по
+    tight bbox прямо в буфере (savefig с bbox_inches='tight' рисует дважды).
+    """
+    settings = DASHBOARD_PROFILES[profile]
+    fig.canvas.draw()
+    width, height = fig.canvas.get_width_height()
+    bbox = fig.get_tightbbox(fig.canvas.get_renderer()).padded(0.1)
+    dpi = fig.dpi
+    box = (
+        max(0, int(bbox.x0 * dpi)), max(0, int(height - bbox.y1 * dpi)),
+        min(width, int(bbox.x1 * dpi) + 1), min(height, int(height - bbox.y0 * dpi) + 1),
+    )
+    image = Image.frombuffer('RGBA', (width, height), fig.canvas.buffer_rgba(), 'raw', 'RGBA', 0, 1)
+    image = image.crop(box).convert('RGB')
+
+    img_bytes = BytesIO()
+    if settings['format'] == 'PNG':
+        if 'colors' in settings:
+            image = image.quantize(settings['colors'], method=Image.Quantize.FASTOCTREE)
+        image.save(img_bytes, format='PNG', optimize=True)
+    else:
+        image.save(img_bytes, format=settings['format'], quality=settings['quality'])
+    img_bytes.seek(0)
+    return img_bytes
+
+
+def render_warmup(profile=DASHBOARD_PROFILE):
+    """Маленькая картинка для прогрева процесса рисования при запуске бота"""
+    with new_figure(figsize=(2, 1)) as (fig, ax):
+        ax.plot([0, 1], [0, 1])
+        ax.set_title('Прогрев')
+        return _encode_figure(fig, profile)
+
+
+def _draw_daily(ax, daily_data):
+    """График 1: активность по дням"""
+    if daily_data.empty:
+        return False
+    sns.barplot(
+        ax=ax,
+        x='date',
+        y='hours',
+        data=daily_data,
+        hue='date',
+        palette="viridis",
+        legend=False,
+        dodge=False
+    )
+
+    ax.set_title('Активность по дням (последние 7 дней)')
+    ax.set_xlabel('Дата')
+    ax.set_ylabel('Часы')
+
+    # Форматирование дат
+    ax.set_xticklabels(
+        [day.strftime('%d.%m') for day in daily_data['date']],
+        rotation=45,
+        ha='right'
+    )
+
+    # Добавляем значения на столбцах
+    for p in ax.patches:
+        if p.get_height() > 0:
+            ax.annotate(
+                f"{p.get_height():.1f}ч",
+                (p.get_x() + p.get_width() / 2., p.get_height()),
+                ha='center',
+                va='center',
+                xytext=(0, 5),
+                textcoords='offset points'
+            )
+    return True
+
+
+def _draw_tasks(ax, task_data):
+    """График 2: распределение по задачам"""
+    if task_data.empty or task_data['seconds'].sum() <= 0:
+        return False
+    # Фильтруем задачи с <1% времени
+    filtered_tasks = task_data[task_data['percentage'] >= 1].copy()
+    other_time = task_data[task_data['percentage'] < 1]['seconds'].sum()
+
+    if other_time > 0:
+        other_row = pd.DataFrame([{
+            'task_name': 'Другие',
+            'seconds': other_time,
+            'hours': other_time / 3600,
+            'percentage': other_time / task_data['seconds'].sum() * 100
+        }])
+        filtered_tasks = pd.concat([filtered_tasks, other_row])
+
+    # Круговая диаграмма
+    wedges, _, _ = ax.pie(
+        filtered_tasks['seconds'],
+        labels=None,
+        autopct=lambda p: f'{p:.1f}%' if p >= 3 else '',
+        startangle=90,
+        pctdistance=0.8,
+        colors=sns.color_palette("pastel", len(filtered_tasks)),
+        textprops={'fontsize': 9}
+    )
+
+    ax.set_title('Распределение времени по задачам')
+
+    # Легенда с часами
+    ax.legend(
+        wedges,
+        [f"{name} ({hours:.1f}ч)" for name, hours in zip(filtered_tasks['task_name'], filtered_tasks['hours'])],
+        title="Задачи",
+        loc="center left",
+        bbox_to_anchor=(1, 0.5),
+        fontsize=9
+    )
+    return True
+
+
+def _msk_hours(hour_data):
+    """Часы UTC -> МСК, все 24 часа (пустые - нулями)"""
+    hour_data = hour_data.assign(hour=(hour_data['hour'] + 3) % 24)
+    all_hours = pd.DataFrame({'hour': range(24)})
+    return pd.merge(all_hours, hour_data, on='hour', how='left').fillna({'hours': 0})
+
+
+def _draw_hours(ax, hour_data):
+    """График 3: активность по часам (МСК)"""
+    if hour_data.empty:
+        return False
+    sns.barplot(
+        ax=ax,
+        x='hour',
+        y='hours',
+        data=_msk_hours(hour_data),
+        hue='hour',
+        palette="rocket",
+        legend=False,
+        dodge=False
+    )
+
+    ax.set_title('Активность по часам (МСК)')
+    ax.set_xlabel('Час дня')
+    ax.set_ylabel('Часы')
+    ax.set_xticks(range(0, 24, 2))
+
+    # Подписи значений
+    for p in ax.patches:
+        if p.get_height() > 0.1:  # Показываем только >6 минут
+            ax.annotate(
+                f"{p.get_height():.1f}ч",
+                (p.get_x() + p.get_width() / 2., p.get_height()),
+                ha='center',
+                va='center',
+                xytext=(0, 5),
+                textcoords='offset points',
+                fontsize=8
+            )
+    return True
+
+
+def _draw_top(ax, task_data):
+    """График 4: топ задач за все время"""
+    if task_data.empty:
+        return False
+    top_tasks = task_data.head(10).copy()
+
+    sns.barplot(
+        ax=ax,
+        x='hours',
+        y='task_name',
+        data=top_tasks,
+        hue='task_name',
+        palette="viridis",
+        legend=False,
+        dodge=False
+    )
+
+    ax.set_title('Топ задач за все время')
+    ax.set_xlabel('Часы')
+    ax.set_ylabel('')
+
+    # Подписи справа от столбцов
+    for p in ax.patches:
+        if p.get_width() > 0.1:  # Показываем только >6 минут
+            ax.annotate(
+                f"{p.get_width():.1f}ч",
+                (p.get_width(), p.get_y() + p.get_height() / 2.),
+                ha='left',
+                va='center',
+                xytext=(5, 0),
+                textcoords='offset points',
+                fontsize=9
             )
 
-            axes[0, 0].set_title('Активность по дням (последние 7 дней)')
-            axes[0, 0].set_xlabel('Дата')
-            axes[0, 0].set_ylabel('Часы')
+    ax.tick_params(axis='y', labelsize=9)
+    return True
+
+
+# Графики дашборда в порядке показа: название -> (подпись, функция рисования, какие данные нужны: 0 - дни, 1 - задачи, 2 - часы)
+DASHBOARD_PANELS = {
+    'daily': ('Активность по дням', _draw_daily, 0),
+    'tasks': ('Распределение времени по задачам', _draw_tasks, 1),
+    'hours': ('Активность по часам (МСК)', _draw_hours, 2),
+    'top': ('Топ задач за все время', _draw_top, 1),
+}
+
+
+def prepare_dashboard(user_id):
+    """
+    Данные дашборда читаются один раз на все графики: ((версия для кеша, время данных), данные).
+    Версия берется до чтения данных - как в _cached_render.
+    """
+    version = _get_version(user_id)
+    return version, get_dashboard_data(user_id, from_snapshot=version[1] is not None)
+
+
+def format_dashboard_summary(data):
+    """Текстовая сводка дашборда - отправляется сразу, до графиков"""
+    daily_data, task_data, hour_data = data
+    week_hours = daily_data['hours'].sum() if not daily_data.empty else 0
+    lines = [f"⏱ За 7 дней: {week_hours:.1f} ч"]
+    if not task_data.empty and task_data['seconds'].sum() > 0:
+        top = task_data.iloc[0]
+        lines.append(f"🏆 Больше всего времени: {top['task_name']} ({top['hours']:.1f} ч, {top['percentage']:.0f}%)")
+    if not hour_data.empty and hour_data['seconds'].sum() > 0:
+        hours = _msk_hours(hour_data)
+        peak = int(hours.loc[hours['hours'].idxmax(), 'hour'])
+        lines.append(f"⏰ Самый активный час: {peak:02}:00-{(peak + 1) % 24:02}:00 (МСК)")
+    return "\n".join(lines)
+
+
+def dashboard_panels(prepared):
+    """Графики, для которых есть данные: неделя без сессий или пустая история - без графика"""
+    _, data = prepared
+    return [
+        panel for panel, (_, _, index) in DASHBOARD_PANELS.items()
+        if not data[index].empty and data[index]['seconds'].sum() > 0
+    ]
 
-            # Форматирование дат
-            ax.set_xticklabels(
-                [day.strftime('%d.%m') for day in daily_data['date']],
-                rotation=45,
-                ha='right'
-            )
 
-            # Добавляем значения на столбцах
-            for p in ax.patches:
-                if p.get_height() > 0:
-                    ax.annotate(
-                        f"{p.get_height():.1f}ч",
-                        (p.get_x() + p.get_width() / 2., p.get_height()),
-                        ha='center',
-                        va='center',
-                        xytext=(0, 5),
-                        textcoords='offset points'
-                    )
-
-        # --- График 2: Распределение по задачам ---
-        if not task_data.empty and task_data['seconds'].sum() > 0:
-            # Фильтруем задачи с <1% времени
-            filtered_tasks = task_data[task_data['percentage'] >= 1].copy()
-            other_time = task_data[task_data['percentage'] < 1]['seconds'].sum()
-
-            if other_time > 0:
-                other_row = pd.DataFrame([{
-                    'task_name': 'Другие',
-                    'seconds': other_time,
-                    'hours': other_time / 3600,
-                    'percentage': other_time / task_data['seconds'].sum() * 100
-                }])
-                filtered_tasks = pd.concat([filtered_tasks, other_row])
-
-            # Круговая диаграмма
-            wedges, _, _ = axes[0, 1].pie(
-                filtered_tasks['seconds'],
-                labels=None,
-                autopct=lambda p: f'{p:.1f}%' if p >= 3 else '',
-                startangle=90,
-                pctdistance=0.8,
-                colors=sns.color_palette("pastel", len(filtered_tasks)),
-                textprops={'fontsize': 9}
-            )
+def generate_dashboard_panel(user_id, panel, prepared):
+    """Один график дашборда по данным prepare_dashboard: (название, изображение или None - ошибка рисования)"""
+    version, data = prepared
+    frame = data[DASHBOARD_PANELS[panel][2]]
+    image, _ = _cached_render(
+        user_id, ('dashboard', panel), 'dashboard:_render_panel', panel, frame, version=version
+    )
+    return panel, image
 
-            axes[0, 1].set_title('Распределение времени по задачам')
 
-            # Легенда с часами
-            axes[0, 1].legend(
-                wedges,
-                [f"{name} ({hours:.1f}ч)" for name, hours in zip(filtered_tasks['task_name'], filtered_tasks['hours'])],
-                title="Задачи",
-                loc="center left",
-                bbox_to_anchor=(1, 0.5),
-                fontsize=9
-            )
+# Потоки, которые ждут графики из процессов рисования: отдельно от asyncio.to_thread, чтобы графики
+# многих пользователей не занимали общий пул и не задерживали короткие вызовы (сводку дашборда)
+_panel_threads = ThreadPoolExecutor(max_workers=max(1, RENDER_WORKERS) * len(DASHBOARD_PANELS), thread_name_prefix='dashboard-panel')
 
-        # --- График 3: Активность по часам (МСК) ---
-        if not hour_data.empty:
-            # Преобразуем в московское время и создаем полный диапазон часов
-            hour_data['hour'] = (hour_data['hour'] + 3) % 24
-            all_hours = pd.DataFrame({'hour': range(24)})
-            hour_data = pd.merge(all_hours, hour_data, on='hour', how='left').fillna({'hours': 0})
-
-            ax = sns.barplot(
-                ax=axes[1, 0],
-                x='hour',
-                y='hours',
-                data=hour_data,
-                hue='hour',
-                palette="rocket",
-                legend=False,
-                dodge=False
-            )
 
-            axes[1, 0].set_title('Активность по часам (МСК)')
-            axes[1, 0].set_xlabel('Час дня')
-            axes[1, 0].set_ylabel('Часы')
-            axes[1, 0].set_xticks(range(0, 24, 2))
-
-            # Подписи значений
-            for p in ax.patches:
-                if p.get_height() > 0.1:  # Показываем только >6 минут
-                    ax.annotate(
-                        f"{p.get_height():.1f}ч",
-                        (p.get_x() + p.get_width() / 2., p.get_height()),
-                        ha='center',
-                        va='center',
-                        xytext=(0, 5),
-                        textcoords='offset points',
-                        fontsize=8
-                    )
-
-        # --- График 4: Топ задач за все время ---
-        if not task_data.empty:
-            top_tasks = task_data.head(10).copy()
-
-            ax = sns.barplot(
-                ax=axes[1, 1],
-                x='hours',
-                y='task_name',
-                data=top_tasks,
-                hue='task_name',
-                palette="viridis",
-                legend=False,
-                dodge=False
+async def render_dashboard_panels(user_id, prepared):
+    """Графики dashboard_panels параллельно: (название, изображение или None) в порядке готовности"""
+    loop = asyncio.get_running_loop()
+    renders = [
+        loop.run_in_executor(_panel_threads, generate_dashboard_panel, user_id, panel, prepared)
+        for panel in dashboard_panels(prepared)
+    ]
+    for render in asyncio.as_completed(renders):
+        yield await render
+
+
+def _render_panel(panel, frame, from_snapshot=False, profile=DASHBOARD_PROFILE):
+    """Генерация одного графика дашборда (данные уже прочитаны - from_snapshot не нужен)"""
+    try:
+        _, draw, _ = DASHBOARD_PANELS[panel]
+        # Четверть прежней фигуры 16x12 - графики такого же масштаба, как на общем дашборде
+        with new_figure(figsize=(8, 6), dpi=DASHBOARD_PROFILES[profile]['dpi']) as (fig, ax):
+            if not draw(ax, frame):
+                return None
+            plt.tight_layout(pad=1.5)
+            img_bytes = _encode_figure(fig, profile)
+
+        logger.info(f"График {panel} сгенерирован: профиль {profile}, {img_bytes.getbuffer().nbytes // 1024} КБ")
+        return img_bytes
+
+    except Exception as e:
+        logger.error(f"Ошибка генерации графика {panel}: {str(e)}", exc_info=True)
+        return None
+
+
+# Цвета как у календаря активности GitHub: нет активности и четыре уровня
+HEATMAP_COLORS = ['#ebedf0', '#9be9a8', '#40c463', '#30a14e', '#216e39']
+MONTHS = ['янв', 'фев', 'мар', 'апр', 'май', 'июн', 'июл', 'авг', 'сен', 'окт', 'ноя', 'дек']
+
+
+def get_heatmap_data(user_id, task_id=None, from_snapshot=False):
+    """
+    Часы по дням за последние 365 дней (UTC) в сетке недель: (массив 7 x недель, первый понедельник сетки).
+    Один запрос к готовым дневным итогам + свежим сессиям, сетка заполняется одной векторной операцией.
+    Дни вне года - NaN.
+    """
+    today = datetime.utcnow().date()
+    first_day = today - timedelta(days=364)
+    grid_start = first_day - timedelta(days=first_day.weekday())
+    weeks = (today - grid_start).days // 7 + 1
+
+    day_seconds = storage.get_daily_seconds(user_id, first_day.isoformat(), task_id, from_snapshot)
+
+    grid = np.full(weeks * 7, np.nan)
+    grid[(first_day - grid_start).days:(today - grid_start).days + 1] = 0
+    if day_seconds:
+        offsets = (np.array(list(day_seconds), dtype='datetime64[D]') - np.datetime64(grid_start, 'D')).astype(int)
+        grid[offsets] = np.fromiter(day_seconds.values(), dtype=float, count=len(day_seconds)) / 3600
+    return grid.reshape(weeks, 7).T, grid_start
+
+
+def _render_heatmap(user_id, task_id=None, from_snapshot=False, profile=DASHBOARD_PROFILE):
+    """Календарь активности за год"""
+    started = time.perf_counter()
+    try:
+        hours, grid_start = get_heatmap_data(user_id, task_id, from_snapshot)
+        active = np.nan_to_num(hours) > 0
+        top = np.nanmax(hours) if active.any() else 1.0
+
+        with new_figure(figsize=(13, 2.8), dpi=DASHBOARD_PROFILES[profile]['dpi']) as (fig, ax):
+            cmap = ListedColormap(HEATMAP_COLORS)
+            cmap.set_bad('white')
+            # 0 - серый, дальше четыре равных уровня до максимума за год
+            norm = BoundaryNorm([0, 1e-6, top / 4, top / 2, top * 3 / 4, top * 1.0001], cmap.N)
+            ax.pcolormesh(np.ma.masked_invalid(hours), cmap=cmap, norm=norm, edgecolors='white', linewidth=2)
+            ax.set_aspect('equal')
+            ax.invert_yaxis()
+
+            # Подписи месяцев над первой неделей месяца
+            week_starts = np.datetime64(grid_start, 'D') + np.arange(hours.shape[1]) * 7
+            months = week_starts.astype('datetime64[M]').astype(int) % 12
+            first_weeks = np.flatnonzero(np.diff(months, prepend=-1))
+            ax.set_xticks(first_weeks + 0.5, [MONTHS[months[week]] for week in first_weeks])
+            ax.set_yticks([0.5, 2.5, 4.5], ['Пн', 'Ср', 'Пт'])
+            ax.tick_params(length=0)
+            ax.xaxis.tick_top()
+            ax.grid(False)
+            for spine in ax.spines.values():
+                spine.set_visible(False)
+
+            ax.set_title(
+                f"Активность за год: {np.nansum(hours):.0f} ч, активных дней: {int(active.sum())}",
+                loc='left', pad=24
             )
+            plt.tight_layout()
+
+            img_bytes = _encode_figure(fig, profile)
 
-            axes[1, 1].set_title('Топ задач за все время')
-            axes[1, 1].set_xlabel('Часы')
-            axes[1, 1].set_ylabel('')
-
-            # Подписи справа от столбцов
-            for p in ax.patches:
-                if p.get_width() > 0.1:  # Показываем только >6 минут
-                    ax.annotate(
-                        f"{p.get_width():.1f}ч",
-                        (p.get_width(), p.get_y() + p.get_height() / 2.),
-                        ha='left',
-                        va='center',
-                        xytext=(5, 0),
-                        textcoords='offset points',
-                        fontsize=9
-                    )
-
-            axes[1, 1].tick_params(axis='y', labelsize=9)
-
-        # Общие настройки
-        plt.tight_layout(pad=3.0)
-
-        # Сохраняем в байты
-        img_bytes = BytesIO()
-        plt.savefig(img_bytes, format='png', dpi=120, bbox_inches='tight')
-        img_bytes.seek(0)
-        plt.close()
-
-        logger.info("Дашборд успешно сгенерирован")
+        elapsed = time.perf_counter() - started
+        if elapsed > HEATMAP_TIME_BUDGET:
+            logger.warning(f"Календарь активности user_id={user_id} рисовался {elapsed:.2f} с (бюджет {HEATMAP_TIME_BUDGET} с)")
         return img_bytes
 
     except Exception as e:
-        logger.error(f"Ошибка генерации дашборда: {str(e)}", exc_info=True)
-        return None
\ No newline at end of file
+        logger.error(f"Ошибка генерации календаря активности: {str(e)}", exc_info=True)
+        return None
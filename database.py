@@ -1,17 +1,72 @@
+import os
+import queue
 import sqlite3
 import logging
 import locale
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-
-#Настройка логирования
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
+from config import (
+    DB_PATH, DB_SHARDS, DB_POOL_SIZE, IMPORT_BATCH_SIZE, MAX_SESSION_HOURS, COMPACTION_CHUNK_DAYS,
+    TASK_UNDO_MINUTES, TASK_PURGE_CHUNK_ROWS, BACKGROUND_CPU_SHARE
 )
+import metrics
+
+#Условие для сессий и итогов: задача не удалена. Удаленная задача скрыта сразу, а ее сессии
+#удаляет фоновая задача (purge_deleted_tasks) - удаленных задач в шарде единицы, подзапрос дешевый
+LIVE_TASK_FILTER = 'task_id NOT IN (SELECT id FROM tasks WHERE deleted_at IS NOT NULL)'
+
+
+#Путь к файлу шарда (при одном шарде - основной файл БД)
+def get_shard_path(shard: int, shards: int = DB_SHARDS):
+    if shards == 1:
+        return DB_PATH
+    base, ext = os.path.splitext(DB_PATH)
+    return f"{base}.{shard}-of-{shards}{ext}"
+
+#Номер шарда пользователя (стабильный хеш, не зависит от PYTHONHASHSEED)
+def get_user_shard(user_id: int, shards: int = DB_SHARDS):
+    return zlib.crc32(str(user_id).encode()) % shards
+
+
+class PooledConnection(sqlite3.Connection):
+    """Соединение из пула: close() возвращает его в пул шарда вместо закрытия"""
+
+    pool = None
+
+    def close(self):
+        if self.in_transaction:
+            self.rollback()
+        self.row_factory = sqlite3.Row
+        try:
+            self.pool.put_nowait(self)
+        except queue.Full:
+            super().close()
+
+
+#Пулы соединений по шардам: (путь к файлу) -> очередь свободных соединений
+_pools = {}
 
 #Создание/подключение к БД
-def get_db_connections():
-    conn = sqlite3.connect('/data/time_tracker.db') #Создаем или подключаемся к созданной БД
+def get_db_connections(user_id: int = None, shard: int = None, shards: int = DB_SHARDS):
+    """
+    user_id - соединение с шардом пользователя, shard - с конкретным шардом,
+    без аргументов - с основным файлом DB_PATH (служебные таблицы: persistence и т.п.)
+    """
+    if shard is None and user_id is not None:
+        shard = get_user_shard(user_id, shards)
+    path = get_shard_path(shard, shards) if shard is not None else DB_PATH
+
+    pool = _pools.setdefault(path, queue.Queue(maxsize=DB_POOL_SIZE))
+    try:
+        return pool.get_nowait()
+    except queue.Empty:
+        pass
+
+    #Создаем или подключаемся к созданной БД
+    conn = sqlite3.connect(path, factory=PooledConnection, check_same_thread=False, timeout=10)
+    conn.pool = pool
     conn.row_factory = sqlite3.Row #Возвращаем результат запроса в виде словаря
 
     #Включаем внешние ключи
@@ -21,9 +76,36 @@ def get_db_connections():
 
     return conn
 
+#Функция параллельного выполнения fn(shard) на всех шардах, возвращает список результатов
+def fan_out(fn, shards: int = DB_SHARDS):
+    if shards == 1:
+        return [fn(0)]
+    with ThreadPoolExecutor(max_workers=shards) as executor:
+        return list(executor.map(fn, range(shards)))
+
+#Функция паузы после фоновой работы длительностью elapsed: фон занимает не больше BACKGROUND_CPU_SHARE времени
+def background_pause(elapsed: float):
+    return elapsed * (1 - BACKGROUND_CPU_SHARE) / BACKGROUND_CPU_SHARE
+
 # Функция для инициализации БД
 def init_db():
-    conn = get_db_connections()
+    for shard in range(DB_SHARDS):
+        _init_shard(shard)
+
+    #Проверка внешних ключей
+    def check_foreign_keys():
+        conn = get_db_connections()
+        cursor = conn.cursor()
+        cursor.execute('PRAGMA foreign_keys;')
+        result = cursor.fetchone()
+        conn.close()
+        return result[0]
+
+    print("Внешние ключи включены:" if check_foreign_keys() else "Внешние ключи отключены.")
+
+# Функция для создания/миграции схемы одного шарда
+def _init_shard(shard: int, shards: int = DB_SHARDS):
+    conn = get_db_connections(shard=shard, shards=shards)
     cursor = conn.cursor()
 
     #Включаем русскую локализацию для linux, (Windows - locale.setlocale(locale.LC_TIME, 'Russian_Russia.1251')
@@ -53,48 +135,280 @@ def init_db():
             )
         ''')
 
-    conn.commit()  # Сохраняем изменения
-    conn.close()  # Закрываем соединение
+    #Миграция: время последнего использования задачи (для сортировки в выборе задач)
+    cursor.execute('PRAGMA table_info(tasks)')
+    task_columns = [row['name'] for row in cursor.fetchall()]
+    if 'last_used_at' not in task_columns:
+        cursor.execute('ALTER TABLE tasks ADD COLUMN last_used_at DATETIME')
+        cursor.execute('''
+            UPDATE tasks
+            SET last_used_at = COALESCE(
+                (SELECT MAX(start_time) FROM sessions WHERE sessions.task_id = tasks.id),
+                created_at
+            )
+        ''')
 
-    #Проверка внешних ключей
-    def check_foreign_keys():
-        conn = get_db_connections()
-        cursor = conn.cursor()
-        cursor.execute('PRAGMA foreign_keys;')
-        result = cursor.fetchone()
-        conn.close()
-        return result[0]
+    #Индекс для постраничной выборки задач (keyset-пагинация)
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_tasks_user_last_used ON tasks (user_id, last_used_at, id)')
 
-    print("Внешние ключи включены:" if check_foreign_keys() else "Внешние ключи отключены.")
+    #Миграция: мягкое удаление задач (время удаления; сессии удаляются позже, небольшими порциями)
+    cursor.execute('PRAGMA table_info(tasks)')
+    if 'deleted_at' not in [row['name'] for row in cursor.fetchall()]:
+        cursor.execute('ALTER TABLE tasks ADD COLUMN deleted_at DATETIME')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_tasks_deleted ON tasks (deleted_at) WHERE deleted_at IS NOT NULL')
+    #Сессии задачи - для порционного удаления (и каскада) без просмотра всей таблицы
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_sessions_task ON sessions (task_id)')
+
+    #Таблица дневных итогов (пересчитывается фоновой задачей в тихие часы)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS daily_totals (
+            user_id INTEGER NOT NULL,
+            task_id INTEGER NOT NULL,
+            day DATE NOT NULL,
+            seconds INTEGER NOT NULL,
+            PRIMARY KEY (user_id, day, task_id),
+            FOREIGN KEY (task_id) REFERENCES tasks (id) ON DELETE CASCADE
+        )
+    ''')
+
+    #Таблица итогов по часам (UTC) за всю сжатую историю
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS hourly_totals (
+            user_id INTEGER NOT NULL,
+            task_id INTEGER NOT NULL,
+            hour TEXT NOT NULL,
+            seconds INTEGER NOT NULL,
+            PRIMARY KEY (user_id, task_id, hour),
+            FOREIGN KEY (task_id) REFERENCES tasks (id) ON DELETE CASCADE
+        )
+    ''')
+
+    #Служебные значения агрегатов (до какого дня daily_totals полные, до какого дня история сжата)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS aggregates_meta (
+            name TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        )
+    ''')
+
+    #Настройки пользователя (максимальная длина сессии и т.п.)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_settings (
+            user_id INTEGER PRIMARY KEY,
+            max_session_hours REAL
+        )
+    ''')
+
+    #Миграция: профиль вывода дашборда и недельная цель
+    cursor.execute('PRAGMA table_info(user_settings)')
+    settings_columns = [row['name'] for row in cursor.fetchall()]
+    if 'dashboard_profile' not in settings_columns:
+        cursor.execute('ALTER TABLE user_settings ADD COLUMN dashboard_profile TEXT')
+    if 'weekly_goal_hours' not in settings_columns:
+        cursor.execute('ALTER TABLE user_settings ADD COLUMN weekly_goal_hours REAL')
+
+    #Миграция: недельная цель по задаче
+    cursor.execute('PRAGMA table_info(tasks)')
+    if 'weekly_goal_hours' not in [row['name'] for row in cursor.fetchall()]:
+        cursor.execute('ALTER TABLE tasks ADD COLUMN weekly_goal_hours REAL')
+
+    #Показатели регулярности (серии, активные дни, неделя) - пользователя в целом и по задачам
+    metrics_columns = '''
+        current_streak INTEGER NOT NULL,
+        longest_streak INTEGER NOT NULL,
+        first_day DATE NOT NULL,
+        last_day DATE NOT NULL,
+        active_days INTEGER NOT NULL,
+        week_start DATE NOT NULL,
+        week_seconds INTEGER NOT NULL
+    '''
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS user_metrics (
+            user_id INTEGER PRIMARY KEY,
+            {metrics_columns}
+        )
+    ''')
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS task_metrics (
+            task_id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            {metrics_columns},
+            FOREIGN KEY (task_id) REFERENCES tasks (id) ON DELETE CASCADE
+        )
+    ''')
+
+    #WAL: чтения не блокируют запись, чекпоинты делает фоновая задача.
+    #Режим журнала нельзя сменить внутри транзакции (ее открывают миграции) - сначала фиксируем их
+    conn.commit()
+    cursor.execute('PRAGMA journal_mode = WAL').fetchone()
+
+    conn.commit()  # Сохраняем изменения
+    conn.close()  # Закрываем соединение
 
 # Функция для добавления задачи
 def add_task(user_id: int, task_name: str):
-    conn = get_db_connections()
+    conn = get_db_connections(user_id)
     cursor = conn.cursor()
-    cursor.execute('INSERT INTO tasks (user_id, name) VALUES (?, ?)', (user_id, task_name))
+    cursor.execute(
+        'INSERT INTO tasks (user_id, name, last_used_at) VALUES (?, ?, CURRENT_TIMESTAMP)', (user_id, task_name)
+    )
     conn.commit()
     conn.close()
 
 # Функция для удаления задачи
 def delete_task(user_id: int, task_id: int):
-    conn = get_db_connections()
+    """
+    Мягкое удаление: задача сразу пропадает из списков и статистики, а ее сессии удаляет
+    фоновая задача после TASK_UNDO_MINUTES (до этого задачу можно вернуть - restore_task).
+    Одна короткая транзакция вместо каскадного удаления тысяч сессий. True - если задача удалена.
+    """
+    conn = get_db_connections(user_id)
     cursor = conn.cursor()
-    cursor.execute('DELETE FROM tasks WHERE id = ? AND user_id = ?', (task_id, user_id))
+    cursor.execute(
+        'UPDATE tasks SET deleted_at = CURRENT_TIMESTAMP WHERE id = ? AND user_id = ? AND deleted_at IS NULL',
+        (task_id, user_id)
+    )
+    deleted = cursor.rowcount > 0
+    if deleted:
+        # Активная сессия удаленной задачи не продолжается и при отмене не возвращается
+        cursor.execute('DELETE FROM sessions WHERE task_id = ? AND is_active = 1', (task_id,))
+        # Дни удаленной задачи больше не считаются активными - пересчитываем общие показатели
+        _rebuild_user_metrics(cursor, user_id)
     conn.commit()
     conn.close()
+    return deleted
+
+# Функция отмены удаления задачи (пока ее сессии не удалены фоновой задачей)
+def restore_task(user_id: int, task_id: int, undo_minutes: int = TASK_UNDO_MINUTES):
+    conn = get_db_connections(user_id)
+    cursor = conn.cursor()
+    cursor.execute('''
+        UPDATE tasks SET deleted_at = NULL
+        WHERE id = ? AND user_id = ? AND deleted_at IS NOT NULL AND deleted_at > datetime('now', ?)
+    ''', (task_id, user_id, f'-{undo_minutes} minutes'))
+    restored = cursor.rowcount > 0
+    if restored:
+        _rebuild_user_metrics(cursor, user_id)
+    conn.commit()
+    conn.close()
+    return restored
+
+# Функция окончательного удаления задач, время отмены которых прошло (фоновая задача)
+def purge_deleted_tasks(undo_minutes: int = TASK_UNDO_MINUTES, chunk_rows: int = TASK_PURGE_CHUNK_ROWS):
+    """
+    Сессии и итоги удаляются порциями по chunk_rows строк, каждая порция - своя короткая транзакция,
+    после нее поток спит (доля BACKGROUND_CPU_SHARE), чтобы старты и остановки сессий других
+    пользователей не ждали блокировку записи. Возвращает (удалено задач, удалено строк).
+    """
+    results = fan_out(lambda shard: _purge_shard(shard, undo_minutes, chunk_rows))
+    return sum(tasks for tasks, _ in results), sum(rows for _, rows in results)
+
+def _purge_shard(shard: int, undo_minutes: int, chunk_rows: int):
+    conn = get_db_connections(shard=shard)
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT id, user_id FROM tasks WHERE deleted_at IS NOT NULL AND deleted_at <= datetime('now', ?)",
+        (f'-{undo_minutes} minutes',)
+    )
+    tasks = cursor.fetchall()
+    archive_path = get_archive_path(shard)
+    # Сессии старше горизонта сжатия лежат в архивном файле - их тоже удаляем
+    has_archive = bool(tasks) and os.path.exists(archive_path)
+    if has_archive:
+        cursor.execute('ATTACH DATABASE ? AS archive', (archive_path,))
+        cursor.execute('CREATE INDEX IF NOT EXISTS archive.idx_archive_sessions_task ON sessions (task_id)')
+
+    tables = ['sessions', 'daily_totals', 'hourly_totals'] + (['archive.sessions'] if has_archive else [])
+    purged_rows = 0
+    try:
+        for task in tasks:
+            for table in tables:
+                while True:
+                    started = time.perf_counter()
+                    cursor.execute(f'''
+                        DELETE FROM {table} WHERE rowid IN (
+                            SELECT rowid FROM {table} WHERE user_id = ? AND task_id = ? LIMIT ?
+                        )
+                    ''', (task['user_id'], task['id'], chunk_rows))
+                    deleted = cursor.rowcount
+                    conn.commit()
+                    purged_rows += deleted
+                    if deleted < chunk_rows:
+                        break
+                    time.sleep(background_pause(time.perf_counter() - started))
+            # Строк задачи уже нет - каскад по остальным таблицам ничего не ищет
+            cursor.execute('DELETE FROM tasks WHERE id = ?', (task['id'],))
+            conn.commit()
+    finally:
+        if has_archive:
+            cursor.execute('DETACH DATABASE archive')
+        conn.close()
+
+    if tasks:
+        logging.info(f"Шард {shard}: удалено задач {len(tasks)}, строк сессий и итогов {purged_rows}")
+    return len(tasks), purged_rows
 
 # Функция для получения списка задач
 def get_tasks(user_id: int):
-    conn = get_db_connections()
+    conn = get_db_connections(user_id)
     cursor = conn.cursor()
-    cursor.execute('SELECT id, name FROM tasks WHERE user_id = ? ORDER BY created_at', (user_id,))
+    cursor.execute('SELECT id, name FROM tasks WHERE user_id = ? AND deleted_at IS NULL ORDER BY created_at', (user_id,))
     tasks = cursor.fetchall()
     conn.close()
     return tasks
 
+# Функция для получения одной задачи пользователя
+def get_task(user_id: int, task_id: int):
+    conn = get_db_connections(user_id)
+    cursor = conn.cursor()
+    cursor.execute('SELECT id, name FROM tasks WHERE id = ? AND user_id = ? AND deleted_at IS NULL', (task_id, user_id))
+    task = cursor.fetchone()
+    conn.close()
+    return task
+
+# Функция для получения одной страницы задач (недавно использованные - первыми)
+def get_tasks_page(user_id: int, limit: int, cursor_key=None, backward: bool = False, prefix: str = None):
+    """
+    Keyset-пагинация по (last_used_at, id): читаем только limit + 1 строк, без OFFSET.
+    cursor_key - (last_used_at, id) крайней задачи текущей страницы,
+    backward=True - страница перед ней. Возвращает (задачи, есть ли еще задачи в этом направлении).
+    """
+    conn = get_db_connections(user_id)
+    cursor = conn.cursor()
+
+    conditions = ['user_id = ?', 'deleted_at IS NULL']
+    params = [user_id]
+
+    if cursor_key is not None:
+        conditions.append('(last_used_at, id) > (?, ?)' if backward else '(last_used_at, id) < (?, ?)')
+        params.extend(cursor_key)
+
+    if prefix:
+        #Экранируем спецсимволы LIKE, чтобы искать именно по началу названия
+        escaped = prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        conditions.append("name LIKE ? ESCAPE '\\'")
+        params.append(escaped + '%')
+
+    order = 'ASC' if backward else 'DESC'
+    cursor.execute(f'''
+        SELECT id, name, last_used_at
+        FROM tasks
+        WHERE {' AND '.join(conditions)}
+        ORDER BY last_used_at {order}, id {order}
+        LIMIT ?
+    ''', (*params, limit + 1))
+    tasks = cursor.fetchall()
+    conn.close()
+
+    has_more = len(tasks) > limit
+    tasks = tasks[:limit]
+    if backward:
+        tasks.reverse()
+    return tasks, has_more
+
 # Функция для запуска сессии
 def start_session(user_id: int, task_id: int):
-    conn = get_db_connections()
+    conn = get_db_connections(user_id)
     cursor = conn.cursor()
 
     # Проверяем, есть ли уже активная сессия
@@ -105,24 +419,35 @@ def start_session(user_id: int, task_id: int):
         conn.close()
         return False  # Сессия уже активна
 
-    # Запускаем новую сессию
-    cursor.execute('INSERT INTO sessions (user_id, task_id, start_time) VALUES (?, ?, CURRENT_TIMESTAMP)', (user_id, task_id,))
+    # Запускаем новую сессию - только для своей и не удаленной задачи (кнопка могла устареть)
+    cursor.execute('''
+        INSERT INTO sessions (user_id, task_id, start_time)
+        SELECT user_id, id, CURRENT_TIMESTAMP FROM tasks WHERE id = ? AND user_id = ? AND deleted_at IS NULL
+    ''', (task_id, user_id))
+    if cursor.rowcount == 0:
+        conn.close()
+        return None  # Задача не найдена
+    cursor.execute('UPDATE tasks SET last_used_at = CURRENT_TIMESTAMP WHERE id = ?', (task_id,))
     conn.commit()
     conn.close()
     return True
 
 # Функция для остановки сессии
-def stop_session(user_id: int):
-    conn = get_db_connections()
+def stop_session(user_id: int, session_id: int = None, end_time: str = None):
+    """
+    session_id - остановить только эту сессию (если активна другая - ничего не делаем),
+    end_time - время окончания в UTC вместо текущего (автоостановка забытой сессии)
+    """
+    conn = get_db_connections(user_id)
     cursor = conn.cursor()
 
     # Находим активную сессию пользователя
-    cursor.execute('''
+    cursor.execute(f'''
         SELECT s.id, t.name
         FROM sessions s
         JOIN tasks t ON s.task_id = t.id
-        WHERE s.user_id = ? AND s.is_active = 1
-    ''', (user_id,))
+        WHERE s.user_id = ? AND s.is_active = 1 {'AND s.id = ?' if session_id is not None else ''}
+    ''', (user_id,) if session_id is None else (user_id, session_id))
     active_session = cursor.fetchone()
 
     if not active_session:
@@ -132,17 +457,32 @@ def stop_session(user_id: int):
     # Останавливаем сессию
     cursor.execute('''
         UPDATE sessions
-        SET end_time = CURRENT_TIMESTAMP, is_active = 0
+        SET end_time = COALESCE(?, CURRENT_TIMESTAMP), is_active = 0
         WHERE id = ?
-    ''', (active_session['id'],))
-    conn.commit()
+    ''', (end_time, active_session['id']))
 
     cursor.execute('''
-        SELECT strftime('%H:%M:%S', strftime('%s', end_time) - strftime('%s', start_time), 'unixepoch') AS time_diff
+        SELECT 
+            strftime('%H:%M:%S', strftime('%s', end_time) - strftime('%s', start_time), 'unixepoch') AS time_diff,
+            strftime('%s', end_time) - strftime('%s', start_time) AS seconds,
+            DATE(start_time) AS day,
+            task_id, start_time, end_time
         FROM sessions
         WHERE id = ?
     ''', (active_session['id'],))
-    time_diff = cursor.fetchone()['time_diff']
+    stopped = cursor.fetchone()
+    time_diff = stopped['time_diff']
+
+    # Если день начала сессии уже посчитан в daily_totals - дописываем итог сразу
+    if stopped['day'] < _get_daily_totals_until(cursor):
+        _add_daily_total(cursor, user_id, stopped['task_id'], stopped['day'], stopped['seconds'])
+    # Если этот день уже сжат - итоги по часам тоже дописываем сразу
+    if stopped['day'] < _get_meta(cursor, 'compacted_until'):
+        _add_hourly_totals(cursor, user_id, stopped['task_id'], stopped['start_time'], stopped['end_time'])
+    # Серии и недельный прогресс сдвигаем сразу, без прохода по истории
+    _advance_metrics(cursor, user_id, stopped['task_id'], stopped['day'], stopped['seconds'])
+
+    conn.commit()
     conn.close()
     return {
         'name': active_session['name'],
@@ -151,12 +491,12 @@ def stop_session(user_id: int):
 
 # Функция для получения активной сессии
 def get_active_session(user_id: int):
-    conn = get_db_connections()
+    conn = get_db_connections(user_id)
     cursor = conn.cursor()
 
     # Находим активную сессию для пользователя
     cursor.execute('''
-        SELECT s.id, t.name
+        SELECT s.id, t.name, s.start_time
         FROM sessions s
         JOIN tasks t ON s.task_id = t.id
         WHERE s.user_id = ? AND s.is_active = 1
@@ -171,18 +511,39 @@ def seconds_to_hms(seconds):
     minutes, seconds = divmod(remainder, 60)
     return f"{hours:02}:{minutes:02}:{seconds:02}"
 
+#Функция вывода активного времени за каждый из 7 дней: stats - {'YYYY-MM-DD': секунды}
+def _format_daily_week(stats: dict, end_date: datetime):
+    #Генерируем все даты за последние 7 дней (включая дни без активности)
+    date_range = [end_date.date() - timedelta(days=i) for i in range(7)]
+
+    #Формируем итоговый результат
+    result = {}
+    for date in date_range:
+        formatted_date = date.strftime('%d %b')  # '05 Jan'
+        day_of_week = date.strftime('%A')  # 'Monday'
+
+        #Получаем активное время или 0
+        active_seconds = stats.get(date.strftime('%Y-%m-%d'), 0)
+
+        result[formatted_date] = {
+            'day_of_week': day_of_week,
+            'active_time': seconds_to_hms(active_seconds)
+        }
+
+    return result
+
 #Функция для получения общего и среднего времени активности за последние 7 дней
 def get_total_stat_last_7_days(user_id: int):
-    conn = get_db_connections()
+    conn = get_db_connections(user_id)
     cursor = conn.cursor()
 
     start_date = (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d %H:%M:%S')
 
     #Находим общее время за 7 дней
-    cursor.execute('''
+    cursor.execute(f'''
         SELECT COALESCE(SUM(strftime('%s', end_time) - strftime('%s', start_time)),0) AS total_time
         FROM sessions 
-        WHERE user_id = ? AND end_time IS NOT NULL AND start_time >= ?
+        WHERE user_id = ? AND end_time IS NOT NULL AND start_time >= ? AND {LIVE_TASK_FILTER}
         ''', (user_id, start_date))
     result_total = cursor.fetchone()
     conn.close()
@@ -206,57 +567,22 @@ def get_total_stat_last_7_days(user_id: int):
 
 #Функция нахождения активного времени за каждый из 7 дней
 def get_stat_daily_day(user_id: int):
-    conn = get_db_connections()
+    conn = get_db_connections(user_id)
     cursor = conn.cursor()
 
     #Определяем временной диапазон (последние 7 дней)
     end_date = datetime.now()
     start_date = end_date - timedelta(days=7)
 
-    #Запрашиваем данные из БД (группируем по дням)
-    cursor.execute('''
-        SELECT 
-            DATE(start_time) AS day, 
-            SUM(strftime('%s', end_time) - strftime('%s', start_time)) AS total_seconds
-        FROM sessions
-        WHERE user_id = ? 
-            AND end_time IS NOT NULL 
-            AND start_time >= ?
-        GROUP BY day
-        ORDER BY day DESC
-    ''', (user_id, start_date.strftime('%Y-%m-%d %H:%M:%S')))
-
-    db_results = cursor.fetchall()
+    #Получаем активное время по дням (готовые итоги + свежие сессии)
+    stats = _get_daily_seconds(cursor, user_id, start_date.strftime('%Y-%m-%d'))
     conn.close()
 
-    #Готовим структуру для хранения данных
-    stats = {}
-    for row in db_results:
-        day = row['day']  # 'YYYY-MM-DD'
-        stats[day] = row['total_seconds'] or 0  # 0, если NULL
-
-    #Генерируем все даты за последние 7 дней (включая дни без активности)
-    date_range = [end_date.date() - timedelta(days=i) for i in range(7)]
-
-    #Формируем итоговый результат
-    result = {}
-    for date in date_range:
-        formatted_date = date.strftime('%d %b')  # '05 Jan'
-        day_of_week = date.strftime('%A')  # 'Monday'
-
-        #Получаем активное время или 0
-        active_seconds = stats.get(date.strftime('%Y-%m-%d'), 0)
-
-        result[formatted_date] = {
-            'day_of_week': day_of_week,
-            'active_time': seconds_to_hms(active_seconds)
-        }
-
-    return result
+    return _format_daily_week(stats, end_date)
 
 #Функция для получения общего и среднего времени активности за последние 7 дней по задаче
 def get_task_stat_last_7_days(user_id: int, task_id: int):
-    conn = get_db_connections()
+    conn = get_db_connections(user_id)
     cursor = conn.cursor()
 
     start_date = (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d %H:%M:%S')
@@ -288,51 +614,591 @@ def get_task_stat_last_7_days(user_id: int, task_id: int):
 
 #Функция нахождения активного времени по задаче за каждый из 7 дней
 def get_stat_task_daily_day(user_id: int, task_id: int):
-    conn = get_db_connections()
+    conn = get_db_connections(user_id)
     cursor = conn.cursor()
 
     #Определяем временной диапазон (последние 7 дней)
     end_date = datetime.now()
     start_date = end_date - timedelta(days=7)
 
-    #Запрашиваем данные из БД (группируем по дням)
+    #Получаем активное время по дням (готовые итоги + свежие сессии)
+    stats = _get_daily_seconds(cursor, user_id, start_date.strftime('%Y-%m-%d'), task_id)
+    conn.close()
+
+    return _format_daily_week(stats, end_date)
+#Функция пакетного импорта исторических сессий (например, из CSV других трекеров)
+def import_sessions(user_id: int, rows, batch_size: int = IMPORT_BATCH_SIZE):
+    """
+    rows - итерируемый поток кортежей (task_name, start_time, end_time) со временем в UTC
+    в формате 'YYYY-MM-DD HH:MM:SS'. Поток читается лениво, в памяти держится только одна пачка.
+    Недостающие задачи создаются автоматически. Возвращает словарь с количеством
+    импортированных сессий и созданных задач.
+    """
+    conn = get_db_connections(user_id)
+    cursor = conn.cursor()
+
+    #Загружаем уже существующие задачи пользователя один раз
+    cursor.execute('SELECT id, name FROM tasks WHERE user_id = ? AND deleted_at IS NULL', (user_id,))
+    task_ids = {row['name']: row['id'] for row in cursor.fetchall()}
+
+    #Сессии в уже сжатом периоде сразу учитываем в итогах (сжатые дни не пересчитываются из сессий)
+    compacted_until = _get_meta(cursor, 'compacted_until')
+
+    imported = 0
+    created_tasks = 0
+    batch = []
+
+    def flush():
+        #Вставляем всю пачку одной транзакцией - вместе с итогами сессий сжатого периода из этой пачки
+        cursor.executemany(
+            'INSERT INTO sessions (user_id, task_id, start_time, end_time, is_active) VALUES (?, ?, ?, ?, 0)',
+            batch
+        )
+        for _, task_id, start_time, end_time in batch:
+            if start_time < compacted_until:
+                seconds = int(
+                    (datetime.fromisoformat(end_time) - datetime.fromisoformat(start_time)).total_seconds()
+                )
+                _add_daily_total(cursor, user_id, task_id, start_time[:10], seconds)
+                _add_hourly_totals(cursor, user_id, task_id, start_time, end_time)
+        conn.commit()
+        batch.clear()
+
+    try:
+        for task_name, start_time, end_time in rows:
+            task_id = task_ids.get(task_name)
+            if task_id is None:
+                cursor.execute(
+                    'INSERT INTO tasks (user_id, name, last_used_at) VALUES (?, ?, CURRENT_TIMESTAMP)',
+                    (user_id, task_name)
+                )
+                task_id = cursor.lastrowid
+                task_ids[task_name] = task_id
+                created_tasks += 1
+
+            batch.append((user_id, task_id, start_time, end_time))
+            if len(batch) >= batch_size:
+                imported += len(batch)
+                flush()
+
+        if batch:
+            imported += len(batch)
+            flush()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    #Дневные итоги и показатели регулярности пересчитываем один раз после всего импорта, а не на каждую строку
+    rebuild_user_daily_totals(user_id)
+    rebuild_user_metrics(user_id)
+
+    logging.info(f"Импорт для пользователя {user_id}: сессий {imported}, новых задач {created_tasks}")
+    return {'imported': imported, 'created_tasks': created_tasks}
+
+#Функция чтения служебного значения агрегатов ('' - если не задано)
+def _get_meta(cursor, name: str):
+    cursor.execute("SELECT value FROM aggregates_meta WHERE name = ?", (name,))
+    row = cursor.fetchone()
+    return row['value'] if row else ''
+
+def _set_meta(cursor, name: str, value: str):
+    cursor.execute("INSERT OR REPLACE INTO aggregates_meta (name, value) VALUES (?, ?)", (name, value))
+
+#Функция получения дня, до которого (не включая) daily_totals полные
+def _get_daily_totals_until(cursor):
+    return _get_meta(cursor, 'daily_totals_until')
+
+#Функция разбиения интервала на части по часам: [('HH', секунды), ...]
+def _split_by_hour(start_time: str, end_time: str):
+    start = datetime.fromisoformat(start_time)
+    end = datetime.fromisoformat(end_time)
+    parts = []
+    while start < end:
+        hour_end = min(start.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1), end)
+        parts.append((start.strftime('%H'), int((hour_end - start).total_seconds())))
+        start = hour_end
+    return parts
+
+#Функция прибавления сессии к итогам по часам
+def _add_hourly_totals(cursor, user_id, task_id, start_time, end_time):
+    cursor.executemany('''
+        INSERT INTO hourly_totals (user_id, task_id, hour, seconds) VALUES (?, ?, ?, ?)
+        ON CONFLICT (user_id, task_id, hour) DO UPDATE SET seconds = seconds + excluded.seconds
+    ''', [(user_id, task_id, hour, seconds) for hour, seconds in _split_by_hour(start_time, end_time)])
+
+#Функция прибавления времени к дневному итогу
+def _add_daily_total(cursor, user_id, task_id, day, seconds):
     cursor.execute('''
-        SELECT 
-            DATE(start_time) AS day, 
-            SUM(strftime('%s', end_time) - strftime('%s', start_time)) AS total_seconds
-        FROM sessions
-        WHERE user_id = ? 
-            AND end_time IS NOT NULL 
-            AND start_time >= ?
-            AND task_id = ?
+        INSERT INTO daily_totals (user_id, task_id, day, seconds) VALUES (?, ?, ?, ?)
+        ON CONFLICT (user_id, day, task_id) DO UPDATE SET seconds = seconds + excluded.seconds
+    ''', (user_id, task_id, day, seconds))
+
+#Функция получения активного времени по дням начиная с start_day: {'YYYY-MM-DD': секунды}
+def _get_daily_seconds(cursor, user_id: int, start_day: str, task_id: int = None):
+    """Дни до границы daily_totals берутся из готовых итогов, остальные - из сессий"""
+    until = max(_get_daily_totals_until(cursor), start_day)
+    task_filter = 'AND task_id = ?' if task_id is not None else ''
+    task_params = (task_id,) if task_id is not None else ()
+
+    cursor.execute(f'''
+        SELECT day, SUM(seconds) AS total_seconds
+        FROM (
+            SELECT day, seconds
+            FROM daily_totals
+            WHERE user_id = ? AND day >= ? AND day < ? AND {LIVE_TASK_FILTER} {task_filter}
+
+            UNION ALL
+
+            SELECT DATE(start_time) AS day, strftime('%s', end_time) - strftime('%s', start_time) AS seconds
+            FROM sessions
+            WHERE user_id = ? AND end_time IS NOT NULL AND start_time >= ? AND {LIVE_TASK_FILTER} {task_filter}
+        )
         GROUP BY day
-        ORDER BY day DESC
-    ''', (user_id, start_date.strftime('%Y-%m-%d %H:%M:%S'), task_id))
+    ''', (user_id, start_day, until, *task_params, user_id, until, *task_params))
+
+    return {row['day']: row['total_seconds'] or 0 for row in cursor.fetchall()}
+
+#Функция пересчета дневных итогов за завершенные дни (запускается в тихие часы)
+def refresh_daily_totals():
+    """
+    Пересчитывает daily_totals от предыдущей границы (минус день - на случай поздних остановок)
+    до сегодняшнего дня (UTC) и сдвигает границу. Возвращает количество записанных строк.
+    """
+    return sum(fan_out(_refresh_daily_totals_shard))
+
+def _refresh_daily_totals_shard(shard: int):
+    conn = get_db_connections(shard=shard)
+    cursor = conn.cursor()
+
+    previous = _get_daily_totals_until(cursor)
+    cursor.execute("SELECT DATE('now') AS today, DATE(?, '-1 day') AS since", (previous or '0001-01-01',))
+    row = cursor.fetchone()
+    today, since = row['today'], (row['since'] if previous else '0001-01-01')
+    # Сжатые дни пересчитать из сессий уже нельзя - их итоги окончательные
+    since = max(since, _get_meta(cursor, 'compacted_until'))
+
+    cursor.execute('DELETE FROM daily_totals WHERE day >= ? AND day < ?', (since, today))
+    cursor.execute('''
+        INSERT INTO daily_totals (user_id, task_id, day, seconds)
+        SELECT user_id, task_id, DATE(start_time) AS day,
+               SUM(strftime('%s', end_time) - strftime('%s', start_time))
+        FROM sessions
+        WHERE end_time IS NOT NULL AND start_time >= ? AND start_time < ?
+        GROUP BY user_id, task_id, day
+    ''', (since, today))
+    written = cursor.rowcount
+    _set_meta(cursor, 'daily_totals_until', max(today, _get_daily_totals_until(cursor)))
+    conn.commit()
+    conn.close()
+
+    logging.info(f"Дневные итоги шарда {shard} пересчитаны с {since} по {today}: {written} строк")
+    return written
+
+#Функция полного пересчета дневных итогов одного пользователя (после импорта истории)
+def rebuild_user_daily_totals(user_id: int):
+    """Сжатые дни не трогаем: их сессии уже в архиве, а итоги - единственный источник"""
+    conn = get_db_connections(user_id)
+    cursor = conn.cursor()
 
-    db_results = cursor.fetchall()
+    until = _get_daily_totals_until(cursor)
+    compacted_until = _get_meta(cursor, 'compacted_until')
+    cursor.execute('DELETE FROM daily_totals WHERE user_id = ? AND day >= ?', (user_id, compacted_until))
+    cursor.execute('''
+        INSERT INTO daily_totals (user_id, task_id, day, seconds)
+        SELECT user_id, task_id, DATE(start_time) AS day,
+               SUM(strftime('%s', end_time) - strftime('%s', start_time))
+        FROM sessions
+        WHERE user_id = ? AND end_time IS NOT NULL AND start_time >= ? AND start_time < ?
+        GROUP BY user_id, task_id, day
+    ''', (user_id, compacted_until, until))
+    conn.commit()
     conn.close()
 
-    #Готовим структуру для хранения данных
-    stats = {}
-    for row in db_results:
-        day = row['day']  # 'YYYY-MM-DD'
-        stats[day] = row['total_seconds'] or 0  # 0, если NULL
+#Функция получения пользователей, у которых были сессии за последние days дней
+def get_recently_active_users(days: int):
+    def query(shard):
+        conn = get_db_connections(shard=shard)
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT DISTINCT user_id FROM sessions WHERE start_time >= datetime('now', ?)", (f'-{days} days',)
+        )
+        user_ids = [row['user_id'] for row in cursor.fetchall()]
+        conn.close()
+        return user_ids
 
-    #Генерируем все даты за последние 7 дней (включая дни без активности)
-    date_range = [end_date.date() - timedelta(days=i) for i in range(7)]
+    return [user_id for user_ids in fan_out(query) for user_id in user_ids]
 
-    #Формируем итоговый результат
-    result = {}
-    for date in date_range:
-        formatted_date = date.strftime('%d %b')  # '05 Jan'
-        day_of_week = date.strftime('%A')  # 'Monday'
+#Функция получения "версии" данных пользователя для кеша дашборда
+def get_dashboard_version(user_id: int):
+    """Меняется при любой новой/остановленной/удаленной сессии, удалении или возврате задачи и при смене дня"""
+    conn = get_db_connections(user_id)
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT DATE('now') AS today, COUNT(*) AS sessions_count, MAX(id) AS last_id, MAX(end_time) AS last_end,
+               (SELECT COUNT(*) FROM tasks WHERE user_id = :user_id AND deleted_at IS NOT NULL) AS deleted_tasks
+        FROM sessions
+        WHERE user_id = :user_id
+    ''', {'user_id': user_id})
+    row = cursor.fetchone()
+    conn.close()
+    return tuple(row)
 
-        #Получаем активное время или 0
-        active_seconds = stats.get(date.strftime('%Y-%m-%d'), 0)
+#Функции обслуживания БД (вызываются фоновой задачей в тихие часы, на всех шардах)
+def analyze_db():
+    def analyze(shard):
+        conn = get_db_connections(shard=shard)
+        conn.execute('PRAGMA optimize')
+        conn.execute('ANALYZE')
+        conn.close()
 
-        result[formatted_date] = {
-            'day_of_week': day_of_week,
-            'active_time': seconds_to_hms(active_seconds)
-        }
+    fan_out(analyze)
+
+def incremental_vacuum(pages: int = 1000):
+    """Работает только при auto_vacuum = INCREMENTAL, иначе ничего не делает"""
+    def vacuum(shard):
+        conn = get_db_connections(shard=shard)
+        auto_vacuum = conn.execute('PRAGMA auto_vacuum').fetchone()[0]
+        if auto_vacuum == 2:
+            conn.execute(f'PRAGMA incremental_vacuum({int(pages)})')
+        conn.close()
+        return auto_vacuum == 2
+
+    return all(fan_out(vacuum))
+
+def checkpoint_wal():
+    def checkpoint(shard):
+        conn = get_db_connections(shard=shard)
+        result = conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchone()
+        conn.close()
+        return tuple(result)
+
+    return fan_out(checkpoint)
+
+#Функция получения максимальной длины сессии пользователя в часах (0 - без ограничения)
+def get_max_session_hours(user_id: int):
+    conn = get_db_connections(user_id)
+    cursor = conn.cursor()
+    cursor.execute('SELECT max_session_hours FROM user_settings WHERE user_id = ?', (user_id,))
+    row = cursor.fetchone()
+    conn.close()
+    if row is None or row['max_session_hours'] is None:
+        return MAX_SESSION_HOURS
+    return row['max_session_hours']
+
+#Функция сохранения максимальной длины сессии пользователя
+def set_max_session_hours(user_id: int, hours: float):
+    conn = get_db_connections(user_id)
+    cursor = conn.cursor()
+    cursor.execute('''
+        INSERT INTO user_settings (user_id, max_session_hours) VALUES (?, ?)
+        ON CONFLICT (user_id) DO UPDATE SET max_session_hours = excluded.max_session_hours
+    ''', (user_id, hours))
+    conn.commit()
+    conn.close()
+
+#Функция получения профиля вывода дашборда пользователя (None - профиль по умолчанию)
+def get_dashboard_profile(user_id: int):
+    conn = get_db_connections(user_id)
+    cursor = conn.cursor()
+    cursor.execute('SELECT dashboard_profile FROM user_settings WHERE user_id = ?', (user_id,))
+    row = cursor.fetchone()
+    conn.close()
+    return row['dashboard_profile'] if row else None
+
+#Функция сохранения профиля вывода дашборда пользователя
+def set_dashboard_profile(user_id: int, profile: str):
+    conn = get_db_connections(user_id)
+    cursor = conn.cursor()
+    cursor.execute('''
+        INSERT INTO user_settings (user_id, dashboard_profile) VALUES (?, ?)
+        ON CONFLICT (user_id) DO UPDATE SET dashboard_profile = excluded.dashboard_profile
+    ''', (user_id, profile))
+    conn.commit()
+    conn.close()
+
+#Функция получения всех активных сессий с лимитом длины (для восстановления таймеров при старте)
+def get_active_sessions_with_limits():
+    def query(shard):
+        conn = get_db_connections(shard=shard)
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT s.id, s.user_id, s.start_time, COALESCE(us.max_session_hours, ?) AS max_session_hours
+            FROM sessions s
+            LEFT JOIN user_settings us ON us.user_id = s.user_id
+            WHERE s.is_active = 1
+        ''', (MAX_SESSION_HOURS,))
+        sessions = cursor.fetchall()
+        conn.close()
+        return sessions
+
+    return [session for sessions in fan_out(query) for session in sessions]
+
+#Функция общих счетчиков по всем шардам (для администратора)
+def get_global_counts():
+    def query(shard):
+        conn = get_db_connections(shard=shard)
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT
+                (SELECT COUNT(DISTINCT user_id) FROM tasks) AS users,
+                (SELECT COUNT(*) FROM tasks WHERE deleted_at IS NULL) AS tasks,
+                (SELECT COUNT(*) FROM sessions) AS sessions,
+                (SELECT COUNT(*) FROM sessions WHERE is_active = 1) AS active_sessions
+        ''')
+        row = dict(cursor.fetchone())
+        conn.close()
+        return row
+
+    totals = {'users': 0, 'tasks': 0, 'sessions': 0, 'active_sessions': 0}
+    for counts in fan_out(query):
+        for key in totals:
+            totals[key] += counts[key]
+    return totals
+
+#Путь к архивному файлу шарда
+def get_archive_path(shard: int):
+    base, ext = os.path.splitext(get_shard_path(shard))
+    return f"{base}.archive{ext}"
+
+#Функция сжатия старой истории: итоги по дням/часам + перенос сессий в архивный файл
+def compact_history(horizon_days: int):
+    """
+    Сессии, начавшиеся раньше чем horizon_days дней назад, сворачиваются в daily_totals и
+    hourly_totals и переносятся в архивный файл. Дашборд за все время складывает итоги
+    сжатых дней и оставшиеся сессии, поэтому цифры не меняются. Возвращает число перенесенных сессий.
+    """
+    return sum(fan_out(lambda shard: _compact_shard(shard, horizon_days)))
+
+def _compact_shard(shard: int, horizon_days: int):
+    conn = get_db_connections(shard=shard)
+    cursor = conn.cursor()
+
+    compacted_until = _get_meta(cursor, 'compacted_until')
+    cursor.execute(
+        "SELECT DATE('now', ?) AS target, MIN(DATE(start_time)) AS first_day FROM sessions WHERE start_time >= ?",
+        (f'-{horizon_days} days', compacted_until)
+    )
+    row = cursor.fetchone()
+    target, first_day = row['target'], row['first_day']
+    if first_day is None or first_day >= target:
+        conn.close()
+        return 0
+
+    cursor.execute('ATTACH DATABASE ? AS archive', (get_archive_path(shard),))
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS archive.sessions (
+            id INTEGER PRIMARY KEY,
+            task_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            start_time DATETIME NOT NULL,
+            end_time DATETIME,
+            is_active INTEGER DEFAULT 0
+        )
+    ''')
+
+    moved = 0
+    try:
+        #Сжимаем кусками по COMPACTION_CHUNK_DAYS дней, каждый кусок - своя короткая транзакция
+        chunk_start = max(compacted_until, first_day)
+        while chunk_start < target:
+            cursor.execute("SELECT MIN(DATE(?, ?), ?) AS chunk_end", (chunk_start, f'+{COMPACTION_CHUNK_DAYS} days', target))
+            chunk_end = cursor.fetchone()['chunk_end']
+            moved += _compact_chunk(cursor, compacted_until, chunk_start, chunk_end)
+            compacted_until = chunk_end
+            conn.commit()
+            chunk_start = chunk_end
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.execute('DETACH DATABASE archive')
+        conn.close()
+
+    logging.info(f"Шард {shard}: история до {compacted_until} сжата, в архив перенесено сессий: {moved}")
+    return moved
 
-    return result
\ No newline at end of file
+def _compact_chunk(cursor, compacted_until: str, chunk_start: str, chunk_end: str):
+    #Итоги по дням для дней куска считаем заново из сессий - сейчас они все на месте
+    cursor.execute('DELETE FROM daily_totals WHERE day >= ? AND day < ?', (chunk_start, chunk_end))
+    cursor.execute('''
+        INSERT INTO daily_totals (user_id, task_id, day, seconds)
+        SELECT user_id, task_id, DATE(start_time) AS day,
+               SUM(strftime('%s', end_time) - strftime('%s', start_time))
+        FROM sessions
+        WHERE end_time IS NOT NULL AND start_time >= ? AND start_time < ?
+        GROUP BY user_id, task_id, day
+    ''', (chunk_start, chunk_end))
+
+    #Итоги по часам накапливаются: сессии куска в них еще не учтены, т.к. переносятся в архив в той же транзакции
+    cursor.execute('''
+        WITH RECURSIVE hour_intervals AS (
+            SELECT 
+                user_id, task_id, end_time,
+                start_time AS interval_start,
+                MIN(strftime('%Y-%m-%d %H:00:00', start_time, '+1 hour'), end_time) AS interval_end
+            FROM sessions
+            WHERE end_time IS NOT NULL AND start_time >= ? AND start_time < ?
+
+            UNION ALL
+
+            SELECT 
+                user_id, task_id, end_time,
+                interval_end,
+                MIN(strftime('%Y-%m-%d %H:00:00', interval_end, '+1 hour'), end_time)
+            FROM hour_intervals
+            WHERE interval_end < end_time
+        )
+        INSERT INTO hourly_totals (user_id, task_id, hour, seconds)
+        SELECT user_id, task_id, strftime('%H', interval_start) AS hour,
+               SUM(strftime('%s', interval_end) - strftime('%s', interval_start))
+        FROM hour_intervals
+        GROUP BY user_id, task_id, hour
+        ON CONFLICT (user_id, task_id, hour) DO UPDATE SET seconds = seconds + excluded.seconds
+    ''', (chunk_start, chunk_end))
+
+    #Переносим завершенные сессии куска (и более ранние, импортированные после прошлого сжатия) в архив
+    cursor.execute('''
+        INSERT OR REPLACE INTO archive.sessions (id, task_id, user_id, start_time, end_time, is_active)
+        SELECT id, task_id, user_id, start_time, end_time, is_active
+        FROM sessions
+        WHERE end_time IS NOT NULL AND start_time < ?
+    ''', (chunk_end,))
+    cursor.execute('DELETE FROM sessions WHERE end_time IS NOT NULL AND start_time < ?', (chunk_end,))
+    moved = cursor.rowcount
+
+    _set_meta(cursor, 'compacted_until', chunk_end)
+    _set_meta(cursor, 'daily_totals_until', max(chunk_end, _get_daily_totals_until(cursor)))
+    return moved
+
+#Функция чтения состояния показателей регулярности (None - активности еще не было)
+def _load_metrics(cursor, user_id: int, task_id: int = None):
+    if task_id is None:
+        cursor.execute(f'SELECT {", ".join(metrics.FIELDS)} FROM user_metrics WHERE user_id = ?', (user_id,))
+    else:
+        cursor.execute(f'SELECT {", ".join(metrics.FIELDS)} FROM task_metrics WHERE task_id = ?', (task_id,))
+    row = cursor.fetchone()
+    return dict(row) if row else None
+
+def _save_metrics(cursor, user_id: int, task_id: int, state: dict):
+    table, keys = ('user_metrics', {'user_id': user_id}) if task_id is None else \
+        ('task_metrics', {'task_id': task_id, 'user_id': user_id})
+    columns = (*keys, *metrics.FIELDS)
+    cursor.execute(
+        f'INSERT OR REPLACE INTO {table} ({", ".join(columns)}) VALUES ({", ".join("?" for _ in columns)})',
+        (*keys.values(), *(state[field] for field in metrics.FIELDS))
+    )
+
+#Функция учета остановленной сессии в показателях регулярности (O(1))
+def _advance_metrics(cursor, user_id: int, task_id: int, day: str, seconds: int):
+    for metrics_task_id in (None, task_id):
+        state = _load_metrics(cursor, user_id, metrics_task_id) or metrics.empty_state()
+        if not metrics.advance(state, day, seconds):
+            # Сессия из прошлого (день раньше последнего учтенного) - серии могли срастись, считаем заново
+            _rebuild_user_metrics(cursor, user_id)
+            return
+        _save_metrics(cursor, user_id, metrics_task_id, state)
+
+#Функция расчета показателей регулярности пользователя с нуля: {None: общие, task_id: по задаче}
+def _compute_user_metrics(cursor, user_id: int):
+    until = _get_daily_totals_until(cursor)
+    cursor.execute(f'''
+        SELECT task_id, day, SUM(seconds) AS seconds
+        FROM (
+            SELECT task_id, day, seconds
+            FROM daily_totals
+            WHERE user_id = ? AND day < ? AND {LIVE_TASK_FILTER}
+
+            UNION ALL
+
+            SELECT task_id, DATE(start_time) AS day, strftime('%s', end_time) - strftime('%s', start_time) AS seconds
+            FROM sessions
+            WHERE user_id = ? AND end_time IS NOT NULL AND start_time >= ? AND {LIVE_TASK_FILTER}
+        )
+        GROUP BY task_id, day
+    ''', (user_id, until, user_id, until))
+
+    day_seconds = {None: {}}
+    for row in cursor.fetchall():
+        day_seconds.setdefault(row['task_id'], {})[row['day']] = row['seconds']
+        day_seconds[None][row['day']] = day_seconds[None].get(row['day'], 0) + row['seconds']
+    return {key: metrics.compute(days) for key, days in day_seconds.items() if days}
+
+def _rebuild_user_metrics(cursor, user_id: int):
+    computed = _compute_user_metrics(cursor, user_id)
+    cursor.execute('DELETE FROM user_metrics WHERE user_id = ?', (user_id,))
+    cursor.execute('DELETE FROM task_metrics WHERE user_id = ?', (user_id,))
+    for task_id, state in computed.items():
+        _save_metrics(cursor, user_id, task_id, state)
+
+#Функция пересчета показателей регулярности одного пользователя (после импорта истории)
+def rebuild_user_metrics(user_id: int):
+    conn = get_db_connections(user_id)
+    _rebuild_user_metrics(conn.cursor(), user_id)
+    conn.commit()
+    conn.close()
+
+#Функция пересчета (или сверки) показателей регулярности всех пользователей
+def rebuild_metrics(verify: bool = False, shards: int = DB_SHARDS):
+    """
+    verify=True - ничего не пишет, а сравнивает сохраненные показатели с посчитанными с нуля.
+    Возвращает (пользователей, список расхождений (user_id, task_id или None, сохранено, посчитано)).
+    """
+    def rebuild_shard(shard):
+        conn = get_db_connections(shard=shard, shards=shards)
+        cursor = conn.cursor()
+        cursor.execute('SELECT DISTINCT user_id FROM tasks')
+        user_ids = [row['user_id'] for row in cursor.fetchall()]
+        mismatches = []
+        for user_id in user_ids:
+            if not verify:
+                _rebuild_user_metrics(cursor, user_id)
+                continue
+            computed = _compute_user_metrics(cursor, user_id)
+            stored = {None: _load_metrics(cursor, user_id)}
+            cursor.execute(
+                f'SELECT task_id, {", ".join(metrics.FIELDS)} FROM task_metrics WHERE user_id = ?', (user_id,)
+            )
+            for row in cursor.fetchall():
+                stored[row['task_id']] = {field: row[field] for field in metrics.FIELDS}
+            for key in set(computed) | {k for k, v in stored.items() if v is not None}:
+                if stored.get(key) != computed.get(key):
+                    mismatches.append((user_id, key, stored.get(key), computed.get(key)))
+        conn.commit()
+        conn.close()
+        return len(user_ids), mismatches
+
+    results = fan_out(rebuild_shard, shards)
+    return sum(r[0] for r in results), [m for r in results for m in r[1]]
+
+#Функция получения показателей регулярности для вывода (task_id=None - по всем задачам)
+def get_consistency_metrics(user_id: int, task_id: int = None):
+    conn = get_db_connections(user_id)
+    cursor = conn.cursor()
+    state = _load_metrics(cursor, user_id, task_id)
+    if task_id is None:
+        cursor.execute('SELECT weekly_goal_hours FROM user_settings WHERE user_id = ?', (user_id,))
+    else:
+        cursor.execute(
+            'SELECT weekly_goal_hours FROM tasks WHERE id = ? AND user_id = ? AND deleted_at IS NULL', (task_id, user_id)
+        )
+    row = cursor.fetchone()
+    conn.close()
+    return metrics.summarize(state, row['weekly_goal_hours'] if row else None, datetime.utcnow().date())
+
+#Функция сохранения недельной цели (task_id=None - общая цель пользователя, hours=0 - без цели)
+def set_weekly_goal(user_id: int, hours: float, task_id: int = None):
+    conn = get_db_connections(user_id)
+    cursor = conn.cursor()
+    if task_id is None:
+        cursor.execute('''
+            INSERT INTO user_settings (user_id, weekly_goal_hours) VALUES (?, ?)
+            ON CONFLICT (user_id) DO UPDATE SET weekly_goal_hours = excluded.weekly_goal_hours
+        ''', (user_id, hours or None))
+    else:
+        cursor.execute(
+            'UPDATE tasks SET weekly_goal_hours = ? WHERE id = ? AND user_id = ?', (hours or None, task_id, user_id)
+        )
+    conn.commit()
+    conn.close()
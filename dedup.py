@@ -0,0 +1,112 @@
+"""
+Подавление повторных обновлений: двойное нажатие инлайн-кнопки или кнопки клавиатуры.
+
+Обработчик в самой ранней группе (-2) помнит последние обновления пользователей. Если такое же
+обновление еще обрабатывается или закончило обрабатываться меньше DEDUP_WINDOW секунд назад,
+повтор отбрасывается (ApplicationHandlerStop): пользователь видит результат первого нажатия,
+а дорогая работа (дашборд, остановка сессии) не выполняется второй раз. На отброшенную кнопку
+отвечаем, чтобы у пользователя не висели часики. Конец обработки отмечает обработчик в
+последней группе.
+
+Кнопка - это данные кнопки + сообщение с его текстом в момент нажатия: повторное нажатие
+"Назад" после перехода на другой экран - уже другое обновление и не отбрасывается.
+"""
+import hashlib
+import logging
+import time
+from collections import Counter, OrderedDict
+from telegram import Update
+from telegram.error import TelegramError
+from telegram.ext import Application, ApplicationHandlerStop, ContextTypes, TypeHandler
+from config import DEDUP_WINDOW, DEDUP_MAX_KEYS
+
+FIRST_GROUP = -2  # Раньше контроля цикла событий (-1) и всех обработчиков бота
+LAST_GROUP = 100  # После всех обработчиков бота
+IN_FLIGHT_TIMEOUT = 120  # Если конец обработки так и не отметили - забываем обновление через столько секунд
+
+
+#Функция ключа обновления для поиска повторов (None - такие обновления не сравниваем)
+def update_key(update: Update):
+    user = update.effective_user
+    if user is None:
+        return None
+    query = update.callback_query
+    if query is not None:
+        message = query.message
+        # Текст сообщения в момент нажатия отличает экраны одного и того же сообщения
+        content = (getattr(message, 'text', None) or getattr(message, 'caption', None) or '') if message else ''
+        digest = hashlib.blake2b(content.encode(), digest_size=8).digest()
+        return user.id, 'callback', message.message_id if message else query.inline_message_id, query.data, digest
+    if update.message is not None and update.message.text:
+        return user.id, 'text', update.message.text
+    return None
+
+
+class UpdateDeduplicator:
+    def __init__(self, window: float = DEDUP_WINDOW, max_keys: int = DEDUP_MAX_KEYS):
+        self._window = window
+        self._max_keys = max_keys
+        # ключ -> [время начала, время конца обработки или None]; порядок - по последнему изменению
+        self._recent = OrderedDict()
+        self.suppressed = Counter()  # вид обновления ('callback', 'text') -> сколько повторов отброшено
+        self.passed = 0
+
+    #Функция подключения к приложению
+    def start(self, application: Application):
+        application.add_handler(TypeHandler(Update, self._on_update), group=FIRST_GROUP)
+        application.add_handler(TypeHandler(Update, self._on_done), group=LAST_GROUP)
+
+    #Функция удаления устаревших записей: старые - в начале, поэтому смотрим только начало (O(1) в среднем)
+    def _expire(self, now: float):
+        while self._recent:
+            started, done = next(iter(self._recent.values()))
+            if done is not None and now - done <= self._window:
+                break
+            if done is None and now - started <= IN_FLIGHT_TIMEOUT:
+                break
+            self._recent.popitem(last=False)
+        while len(self._recent) > self._max_keys:
+            self._recent.popitem(last=False)
+
+    #Функция проверки: True - обновление повторяет недавнее или еще обрабатываемое
+    def is_duplicate(self, key, now: float = None):
+        now = time.monotonic() if now is None else now
+        self._expire(now)
+        entry = self._recent.get(key)
+        if entry is None:
+            return False
+        started, done = entry
+        return done is None or now - done <= self._window
+
+    async def _on_update(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        key = update_key(update)
+        if key is None:
+            return
+        now = time.monotonic()
+        if self.is_duplicate(key, now):
+            self.suppressed[key[1]] += 1
+            logging.info(f"Повтор отброшен: user_id={key[0]}, {key[1]} {key[3] if key[1] == 'callback' else key[2]!r}")
+            if update.callback_query is not None:
+                try:
+                    await update.callback_query.answer()
+                except TelegramError:
+                    pass
+            raise ApplicationHandlerStop
+        self.passed += 1
+        self._recent[key] = [now, None]
+        self._recent.move_to_end(key)
+
+    async def _on_done(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        key = update_key(update)
+        entry = self._recent.get(key) if key is not None else None
+        if entry is not None:
+            entry[1] = time.monotonic()
+            self._recent.move_to_end(key)
+
+    #Функция счетчиков для отчета
+    def snapshot(self):
+        return {'passed': self.passed, 'suppressed': sum(self.suppressed.values()), **self.suppressed,
+                'tracked': len(self._recent)}
+
+
+deduplicator = UpdateDeduplicator()
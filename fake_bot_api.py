@@ -0,0 +1,380 @@
+"""
+Локальная замена Telegram Bot API для нагрузочного тестирования (см. load_test.py).
+
+Принимает запросы бота по HTTP так же, как api.telegram.org/bot<token>/<метод>, отдает
+обновления через getUpdates (long polling) или POST-запросами на адрес из setWebhook
+и записывает все вызовы бота. Сообщения хранятся в памяти, поэтому правки, удаления и
+нажатия кнопок ссылаются на настоящие message_id, как в Telegram.
+
+Лимиты Telegram (chat_limit, global_limit - запросов за секунду в один чат и всего) включают
+режим 429: сообщение сверх лимита отклоняется с parameters.retry_after, как у настоящего API.
+
+Отдельный запуск (обновления тогда никто не присылает - удобно смотреть, что шлет бот):
+    python fake_bot_api.py --port 8081 [--chat-limit 1 --global-limit 30]
+"""
+import argparse
+import asyncio
+import email.parser
+import email.policy
+import itertools
+import json
+import logging
+import math
+import re
+import time
+import urllib.parse
+from collections import Counter, defaultdict, deque
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'Тайм-трекер', 'username': 'fake_tracker_bot'}
+# Вызовы, которые пользователь видит как ответ бота
+RESPONSE_METHODS = {'sendMessage', 'sendPhoto', 'sendDocument', 'editMessageText', 'editMessageReplyMarkup'}
+WEBHOOK_CONNECTIONS = 40  # Как max_connections по умолчанию у Telegram
+WEBHOOK_RETRY_DELAY = 0.5  # Пауза перед повторной доставкой обновления, которое бот не принял
+# Вызовы, на которые действуют лимиты Telegram в режиме 429
+FLOOD_METHODS = RESPONSE_METHODS | {'deleteMessage'}
+FLOOD_WINDOW = 1.0  # Окно, в котором считаются лимиты, с
+
+
+class BotApiError(Exception):
+    def __init__(self, description: str, code: int = 400, retry_after: int = None):
+        super().__init__(description)
+        self.code = code
+        self.retry_after = retry_after
+
+
+#Функция разбора тела запроса бота: form-urlencoded, multipart (файлы) или JSON
+def _parse_body(content_type: str, body: bytes):
+    if not body:
+        return {}
+    if content_type.startswith('application/json'):
+        return json.loads(body)
+    if content_type.startswith('multipart/form-data'):
+        message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+            b'Content-Type: ' + content_type.encode() + b'\r\n\r\n' + body
+        )
+        params = {}
+        for part in message.iter_parts():
+            name = part.get_param('name', header='content-disposition')
+            payload = part.get_payload(decode=True)
+            # Файл запоминаем только размером
+            params[name] = len(payload) if part.get_filename() else payload.decode()
+        return params
+    return dict(urllib.parse.parse_qsl(body.decode()))
+
+
+#Функция инлайн-клавиатуры из параметров (reply_markup бот передает строкой JSON).
+#Обычную клавиатуру Telegram в ответе не возвращает - сообщение получается без reply_markup
+def _inline_markup(params: dict):
+    value = params.get('reply_markup')
+    markup = json.loads(value) if isinstance(value, str) else value
+    return markup if markup and 'inline_keyboard' in markup else None
+
+
+#Функция замены клавиатуры сообщения
+def _set_markup(message: dict, markup):
+    if markup:
+        message['reply_markup'] = markup
+    else:
+        message.pop('reply_markup', None)
+
+
+class FakeBotApi:
+    def __init__(self, host: str = '127.0.0.1', port: int = 8081, chat_limit: int = None, global_limit: int = None):
+        self.host = host
+        self.port = port
+        self.chat_limit = chat_limit  # Сообщений в секунду в один чат (None - без лимита)
+        self.global_limit = global_limit  # Сообщений в секунду всего (None - без лимита)
+        self._chat_sent = defaultdict(deque)  # chat_id -> время принятых запросов за последнее окно
+        self._global_sent = deque()
+        self.url = f"http://{host}:{port}"
+        self._server = None
+        self._update_ids = itertools.count(1)
+        self._updates = []  # Еще не подтвержденные ботом обновления
+        self._updates_changed = asyncio.Event()
+        self._message_ids = defaultdict(lambda: itertools.count(1))  # chat_id -> счетчик message_id
+        self.messages = {}  # (chat_id, message_id) -> сообщение в формате Bot API
+        self._listeners = {}  # chat_id -> очередь ответов бота (для load_test.py)
+        self._webhook = None  # (url, secret_token)
+        self._webhook_task = None
+        self.counts = Counter()  # метод -> число вызовов
+        self.errors = Counter()  # описание ошибки -> число ответов боту с ошибкой
+        self.throttled = Counter()  # метод -> число ответов 429
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        logging.info(f"Fake Bot API слушает {self.url}")
+
+    async def stop(self):
+        if self._webhook_task is not None:
+            self._webhook_task.cancel()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    # --- Обновления от "пользователей" ---
+
+    #Функция добавления обновления в очередь для бота
+    def push_update(self, payload: dict):
+        update = {'update_id': next(self._update_ids), **payload}
+        self._updates.append(update)
+        self._updates_changed.set()
+        return update
+
+    #Функция сообщения пользователя (текст, кнопка reply-клавиатуры или команда)
+    def send_text(self, user_id: int, text: str):
+        message = {
+            'message_id': next(self._message_ids[user_id]),
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private', 'first_name': f'user{user_id}'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}'},
+            'text': text,
+        }
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        return self.push_update({'message': message})
+
+    #Функция нажатия инлайн-кнопки: ищется в последнем сообщении бота с подходящей кнопкой
+    def press_button(self, user_id: int, pattern: str):
+        for (chat_id, _), message in reversed(self.messages.items()):
+            if chat_id != user_id:
+                continue
+            for row in message.get('reply_markup', {}).get('inline_keyboard', []):
+                for button in row:
+                    data = button.get('callback_data')
+                    if data is not None and re.fullmatch(pattern, data):
+                        return self.push_update({'callback_query': {
+                            'id': str(next(self._update_ids)),
+                            'from': {'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}'},
+                            'chat_instance': str(user_id),
+                            'message': message,
+                            'data': data,
+                        }})
+        raise LookupError(f"У пользователя {user_id} нет кнопки {pattern!r}")
+
+    #Функция очереди ответов бота в чат (метод, сообщение или None)
+    def listen(self, chat_id: int):
+        return self._listeners.setdefault(chat_id, asyncio.Queue())
+
+    # --- HTTP ---
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                _, path, _ = request_line.decode().split(' ', 2)
+                headers = {}
+                while (line := await reader.readline()) not in (b'\r\n', b''):
+                    name, value = line.decode().split(':', 1)
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+                method = path.rstrip('/').rsplit('/', 1)[-1]
+                try:
+                    params = _parse_body(headers.get('content-type', ''), body)
+                    response = {'ok': True, 'result': await self._call(method, params)}
+                    status = 200
+                except BotApiError as e:
+                    # 429 бот повторяет сам - это не ошибка, такие ответы считаются в throttled
+                    if e.retry_after is None:
+                        self.errors[f"{method}: {e}"] += 1
+                    response = {'ok': False, 'error_code': e.code, 'description': str(e)}
+                    if e.retry_after is not None:
+                        response['parameters'] = {'retry_after': e.retry_after}
+                    status = e.code
+
+                payload = json.dumps(response, ensure_ascii=False).encode()
+                writer.write(
+                    f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                    f"Content-Type: application/json\r\nContent-Length: {len(payload)}\r\n\r\n".encode() + payload
+                )
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    # --- Методы Bot API ---
+
+    async def _call(self, method: str, params: dict):
+        self.counts[method] += 1
+        self._check_flood(method, params)
+        handler = getattr(self, f"_api_{method}", None)
+        if handler is None:
+            return True  # setMyCommands и прочие служебные методы
+        return await handler(params)
+
+    #Функция проверки лимитов в режиме 429: запрос сверх лимита отклоняется, а не засчитывается
+    def _check_flood(self, method: str, params: dict):
+        if method not in FLOOD_METHODS or (self.chat_limit is None and self.global_limit is None):
+            return
+        now = time.monotonic()
+        windows = [(self._global_sent, self.global_limit)]
+        if params.get('chat_id') is not None:
+            windows.append((self._chat_sent[int(params['chat_id'])], self.chat_limit))
+        retry_after = 0
+        for sent, limit in windows:
+            while sent and sent[0] <= now - FLOOD_WINDOW:
+                sent.popleft()
+            if limit is not None and len(sent) >= limit:
+                retry_after = max(retry_after, sent[0] + FLOOD_WINDOW - now)
+        if retry_after:
+            # Как Telegram: целое число секунд, не меньше 1
+            retry_after = max(1, math.ceil(retry_after))
+            self.throttled[method] += 1
+            raise BotApiError(f'Too Many Requests: retry after {retry_after}', 429, retry_after)
+        for sent, _ in windows:
+            sent.append(now)
+
+    async def _api_getMe(self, params):
+        return BOT_USER
+
+    async def _api_getUpdates(self, params):
+        offset = int(params.get('offset', 0))
+        self._updates = [update for update in self._updates if update['update_id'] >= offset]
+        if not self._updates:
+            self._updates_changed.clear()
+            try:
+                await asyncio.wait_for(self._updates_changed.wait(), float(params.get('timeout', 0)))
+            except asyncio.TimeoutError:
+                pass
+        return self._updates[:int(params.get('limit', 100))]
+
+    async def _api_setWebhook(self, params):
+        self._webhook = (params['url'], params.get('secret_token'))
+        if self._webhook_task is None:
+            self._webhook_task = asyncio.create_task(self._deliver_webhooks())
+        return True
+
+    async def _api_deleteWebhook(self, params):
+        self._webhook = None
+        return True
+
+    async def _api_getWebhookInfo(self, params):
+        return {'url': self._webhook[0] if self._webhook else '', 'has_custom_certificate': False,
+                'pending_update_count': len(self._updates)}
+
+    async def _api_sendMessage(self, params):
+        return self._store(params, text=params.get('text', ''))
+
+    async def _api_sendPhoto(self, params):
+        return self._store(params, photo=[{'file_id': 'photo', 'file_unique_id': 'photo', 'width': 1280,
+                                           'height': 960, 'file_size': params.get('photo', 0)}],
+                           caption=params.get('caption'))
+
+    async def _api_sendDocument(self, params):
+        return self._store(params, document={'file_id': 'document', 'file_unique_id': 'document'},
+                           caption=params.get('caption'))
+
+    async def _api_editMessageText(self, params):
+        message = self._find(params, 'message to edit not found')
+        markup = _inline_markup(params)
+        if message.get('text') == params.get('text') and message.get('reply_markup') == markup:
+            raise BotApiError('Bad Request: message is not modified')
+        message['text'] = params.get('text')
+        _set_markup(message, markup)
+        self._notify('editMessageText', message)
+        return message
+
+    async def _api_editMessageReplyMarkup(self, params):
+        message = self._find(params, 'message to edit not found')
+        _set_markup(message, _inline_markup(params))
+        self._notify('editMessageReplyMarkup', message)
+        return message
+
+    async def _api_deleteMessage(self, params):
+        message = self._find(params, 'message to delete not found')
+        del self.messages[(message['chat']['id'], message['message_id'])]
+        self._notify('deleteMessage', None, message['chat']['id'])
+        return True
+
+    async def _api_answerCallbackQuery(self, params):
+        return True
+
+    #Функция сохранения нового сообщения бота
+    def _store(self, params, **content):
+        chat_id = int(params['chat_id'])
+        message = {
+            'message_id': next(self._message_ids[chat_id]),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private', 'first_name': f'user{chat_id}'},
+            'from': BOT_USER,
+            **{key: value for key, value in content.items() if value is not None},
+        }
+        _set_markup(message, _inline_markup(params))
+        self.messages[(chat_id, message['message_id'])] = message
+        self._notify(self._method_for(content), message)
+        return message
+
+    @staticmethod
+    def _method_for(content):
+        return 'sendPhoto' if 'photo' in content else 'sendDocument' if 'document' in content else 'sendMessage'
+
+    def _find(self, params, error: str):
+        message = self.messages.get((int(params.get('chat_id', 0)), int(params.get('message_id', 0))))
+        if message is None:
+            raise BotApiError(f'Bad Request: {error}')
+        return message
+
+    def _notify(self, method: str, message, chat_id: int = None):
+        chat_id = chat_id if chat_id is not None else message['chat']['id']
+        queue = self._listeners.get(chat_id)
+        if queue is not None:
+            queue.put_nowait((method, message))
+
+    # --- Webhook ---
+
+    #Функция доставки обновлений POST-запросами на адрес из setWebhook
+    async def _deliver_webhooks(self):
+        semaphore = asyncio.Semaphore(WEBHOOK_CONNECTIONS)
+        while True:
+            if not self._updates or self._webhook is None:
+                self._updates_changed.clear()
+                await self._updates_changed.wait()
+                continue
+            update = self._updates.pop(0)
+            await semaphore.acquire()
+            task = asyncio.create_task(self._post_update(*self._webhook, update))
+            task.add_done_callback(lambda _: semaphore.release())
+
+    async def _post_update(self, url: str, secret_token: str, update: dict):
+        parsed = urllib.parse.urlsplit(url)
+        body = json.dumps(update, ensure_ascii=False).encode()
+        secret = f"X-Telegram-Bot-Api-Secret-Token: {secret_token}\r\n" if secret_token else ""
+        try:
+            reader, writer = await asyncio.open_connection(parsed.hostname, parsed.port or 80)
+            writer.write(
+                f"POST {parsed.path or '/'} HTTP/1.1\r\nHost: {parsed.netloc}\r\nContent-Type: application/json\r\n"
+                f"{secret}Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+            status = (await reader.readline()).decode().split(' ')[1]
+            writer.close()
+            if status == '200':
+                return
+            self.errors[f"webhook: HTTP {status}"] += 1
+        except (ConnectionError, OSError, IndexError):
+            pass
+        # Как Telegram: недоставленное обновление остается в очереди и отправляется повторно (бот перезапускается)
+        self.counts['webhook_retry'] += 1
+        await asyncio.sleep(WEBHOOK_RETRY_DELAY)
+        self._updates.insert(0, update)
+        self._updates_changed.set()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Локальная замена Telegram Bot API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--chat-limit', type=int, help='сообщений в секунду в один чат, сверх - 429')
+    parser.add_argument('--global-limit', type=int, help='сообщений в секунду всего, сверх - 429')
+    args = parser.parse_args()
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+
+    async def serve():
+        api = FakeBotApi(args.host, args.port, args.chat_limit, args.global_limit)
+        await api.start()
+        await asyncio.Event().wait()
+
+    asyncio.run(serve())
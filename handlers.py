@@ -1,23 +1,133 @@
+import asyncio
 import logging
+from datetime import timedelta
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup
+from telegram.error import TelegramError
 from telegram.ext import ContextTypes, ConversationHandler
-from database import(
-    add_task, delete_task, get_tasks, start_session, stop_session,
-    get_active_session, get_total_stat_last_7_days, get_stat_daily_day,
-    get_task_stat_last_7_days, get_stat_task_daily_day
-)
+from storage import storage
 from enum import Enum, auto
-from dashboard import generate_dashboard
-
-# Настройка логирования
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
+from dashboard import (
+    prepare_dashboard, format_dashboard_summary, dashboard_panels, render_dashboard_panels, generate_heatmap,
+    get_user_profile, get_render_stats, DASHBOARD_PANELS, DASHBOARD_PROFILES
 )
+from importer import import_sessions_csv
+from session_watchdog import session_watchdog
+from outbound import placeholder
+from admin_report import build_report, format_report, format_runtime
+from render_workers import render_workers
+from memory_report import build_memory_report, start_tracing, stop_tracing
+import tracemalloc
+from loop_monitor import loop_monitor
+from dedup import deduplicator
+from jobs import JOB_METRICS
+from config import IMPORT_MAX_FILE_SIZE, TASK_PICKER_PAGE_SIZE, TZ_OFFSET_HOURS, ADMIN_IDS, TASK_UNDO_MINUTES
+
 
 class State(Enum):
     WAITING_FOR_TASK_NAME = auto()  # Ожидание названия задачи
     WAITING_FOR_TASK_NUMBER = auto()  # Ожидание номера задачи
+    WAITING_FOR_IMPORT_FILE = auto()  # Ожидание CSV-файла для импорта
+    WAITING_FOR_TASK_SEARCH = auto()  # Ожидание начала названия задачи для поиска
+
+#Подпись часового пояса пользователей (TZ_OFFSET_HOURS): МСК или UTC+N
+TZ_LABEL = 'МСК' if TZ_OFFSET_HOURS == 3 else f'UTC{TZ_OFFSET_HOURS:+d}'
+
+#Настройки выбора задачи: префикс callback задачи, callback отмены и заголовок
+TASK_PICKERS = {
+    'delete': ('delete', 'cancel', 'Выбери задачу для удаления:'),
+    'start': ('start', 'cancel_start', 'По какой задаче запустить таймер?'),
+    'stat': ('stat', 'stat', 'Для какой задачи вывести статистику?'),
+}
+
+#Функция построения одной страницы выбора задачи
+def _build_task_picker(user_id, kind, prefix=None, cursor_key=None, backward=False):
+    task_callback, cancel_callback, title = TASK_PICKERS[kind]
+    tasks, has_more = storage.get_tasks_page(user_id, TASK_PICKER_PAGE_SIZE, cursor_key, backward, prefix)
+
+    if not tasks:
+        return None, None
+
+    # Определяем, есть ли страницы до и после текущей
+    if backward:
+        has_prev, has_next = has_more, True
+    else:
+        has_prev, has_next = cursor_key is not None, has_more
+
+    keyboard = [
+        [InlineKeyboardButton(task['name'], callback_data=f"{task_callback}_{task['id']}")] for task in tasks
+    ]
+
+    # Курсор страницы - (last_used_at, id) первой и последней задачи
+    navigation = []
+    if has_prev:
+        first = tasks[0]
+        navigation.append(InlineKeyboardButton("◀️", callback_data=f"pg_{kind}_prev_{first['last_used_at']}_{first['id']}"))
+    if has_next:
+        last = tasks[-1]
+        navigation.append(InlineKeyboardButton("▶️", callback_data=f"pg_{kind}_next_{last['last_used_at']}_{last['id']}"))
+    if navigation:
+        keyboard.append(navigation)
+
+    keyboard.append([
+        InlineKeyboardButton("🔍 Поиск", callback_data=f"search_{kind}"),
+        InlineKeyboardButton("Отмена", callback_data=cancel_callback),
+    ])
+
+    if prefix:
+        title = f'{title}\n(поиск: "{prefix}")'
+    return title, InlineKeyboardMarkup(keyboard)
+
+#Обработчик кнопок перелистывания страниц выбора задачи
+async def task_page_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+
+    user_id = query.from_user.id
+    _, kind, direction, last_used_at, task_id = query.data.split("_", 4)
+
+    title, reply_markup = _build_task_picker(
+        user_id, kind,
+        prefix=context.user_data.get('task_picker_prefix'),
+        cursor_key=(last_used_at, int(task_id)),
+        backward=direction == 'prev',
+    )
+    if reply_markup:
+        await query.edit_message_text(title, reply_markup=reply_markup)
+    return State.WAITING_FOR_TASK_NUMBER
+
+#Обработчик кнопки поиска задачи по началу названия
+async def task_search_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+
+    kind = query.data.split("_", 1)[1]
+    context.user_data['task_picker_kind'] = kind
+    # Отмена поиска - та же кнопка, что и у списка задач
+    keyboard = [[InlineKeyboardButton("Отмена", callback_data=TASK_PICKERS[kind][1])]]
+    await query.edit_message_text("Введи начало названия задачи:", reply_markup=InlineKeyboardMarkup(keyboard))
+    return State.WAITING_FOR_TASK_SEARCH
+
+#Обработчик ввода начала названия задачи
+async def receive_task_search(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.message.from_user.id
+    kind = context.user_data.get('task_picker_kind', 'start')
+    prefix = update.message.text.strip()
+
+    title, reply_markup = _build_task_picker(user_id, kind, prefix=prefix)
+    if not reply_markup:
+        # Ничего не нашли - показываем полный список заново
+        context.user_data.pop('task_picker_prefix', None)
+        title, reply_markup = _build_task_picker(user_id, kind)
+        if not reply_markup:
+            # Задач не осталось совсем (удалены, пока шел поиск)
+            await update.message.reply_text("У тебя пока нет задач.")
+            return ConversationHandler.END
+        title = f'Задач, начинающихся на "{prefix}", нет.\n{title}'
+    else:
+        context.user_data['task_picker_prefix'] = prefix
+
+    await update.message.reply_text(title, reply_markup=reply_markup)
+    return State.WAITING_FOR_TASK_NUMBER
 
 # Обработчик команды /start
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -66,7 +176,7 @@ async def receive_task_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.message.from_user.id
 
     # Добавляем задачу в базу данных
-    add_task(user_id, task_name)
+    storage.add_task(user_id, task_name)
     await update.message.reply_text(f'Задача "{task_name}" создана!✅')
     return ConversationHandler.END
 
@@ -77,21 +187,15 @@ async def delete_task_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
 
     user_id = query.from_user.id
 
-    # Получаем список задач
-    tasks = get_tasks(user_id)
+    # Получаем первую страницу задач
+    context.user_data.pop('task_picker_prefix', None)
+    title, reply_markup = _build_task_picker(user_id, 'delete')
 
-    if not tasks:
-        await update.message.reply_text("У тебя пока нет задач.")
+    if not reply_markup:
+        await query.edit_message_text("У тебя пока нет задач.")
         return ConversationHandler.END
 
-    # Формируем сообщение со списком задач
-    keyboard = [
-        [InlineKeyboardButton(task['name'], callback_data=f"delete_{task['id']}")] for task in tasks
-    ]
-    keyboard.append([InlineKeyboardButton("Отмена", callback_data="cancel")])
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
-    await query.edit_message_text('Выбери задачу для удаления:', reply_markup=reply_markup)
+    await query.edit_message_text(title, reply_markup=reply_markup)
     return State.WAITING_FOR_TASK_NUMBER
 
 # Обработчик ввода номера задачи для удаления
@@ -101,17 +205,39 @@ async def receive_task_for_deletion(update: Update, context: ContextTypes.DEFAUL
 
     user_id = query.from_user.id
     task_id = int(query.data.split("_")[1])
-    tasks = get_tasks(user_id)
 
     # Находим задачу по task_id
-    task = next((task for task in tasks if task["id"] == task_id), None)
+    task = storage.get_task(user_id, task_id)
 
-    # Удаляем задачу
-    delete_task(user_id, task_id)
+    # Удаляем задачу: она сразу пропадает из списков и статистики, сессии удалятся позже в фоне
+    if task is None or not storage.delete_task(user_id, task_id):
+        await query.edit_message_text("Задача уже удалена.")
+        return ConversationHandler.END
+    # Активная сессия удаленной задачи удалена вместе с ней - напоминание и автоостановка больше не нужны
+    if storage.get_active_session(user_id) is None:
+        session_watchdog.untrack(user_id)
 
-    await query.edit_message_text(f'Задача "{task["name"]}" удалена!❌')
+    keyboard = [[InlineKeyboardButton("↩️ Вернуть", callback_data=f'undo_delete_{task_id}')]]
+    await query.edit_message_text(
+        f'Задача "{task["name"]}" удалена!❌\nВернуть ее вместе с историей можно в течение {TASK_UNDO_MINUTES} мин.',
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
     return ConversationHandler.END
 
+# Обработчик кнопки "Вернуть" после удаления задачи
+async def undo_delete_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+
+    user_id = query.from_user.id
+    task_id = int(query.data.rsplit("_", 1)[1])
+
+    if storage.restore_task(user_id, task_id):
+        task = storage.get_task(user_id, task_id)
+        await query.edit_message_text(f'Задача "{task["name"]}" восстановлена ✅')
+    else:
+        await query.edit_message_text("⚠️ Время на отмену удаления вышло.")
+
 #Обработчик кнопки "Отмена" для выхода из состояния ожидания данных
 async def cancel_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
@@ -129,7 +255,7 @@ async def list_tasks_handler(update: Update, context: ContextTypes.DEFAULT_TYPE)
     user_id = query.from_user.id
 
     # Получаем список задач из базы данных
-    tasks = get_tasks(user_id)
+    tasks = storage.get_tasks(user_id)
 
     if not tasks:
         await update.message.reply_text("У тебя пока нет задач.")
@@ -165,21 +291,15 @@ async def about(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def start_session_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.message.from_user.id
 
-    # Получаем список задач
-    tasks = get_tasks(user_id)
+    # Получаем первую страницу задач
+    context.user_data.pop('task_picker_prefix', None)
+    title, reply_markup = _build_task_picker(user_id, 'start')
 
-    if not tasks:
+    if not reply_markup:
         await update.message.reply_text("У тебя пока нет задач.")
         return ConversationHandler.END
 
-    # Формируем сообщение со списком задач
-    keyboard = [
-        [InlineKeyboardButton(task['name'], callback_data=f"start_{task['id']}")] for task in tasks
-    ]
-    keyboard.append([InlineKeyboardButton("Отмена", callback_data="cancel_start")])
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
-    await update.message.reply_text('По какой задаче запустить таймер?', reply_markup=reply_markup)
+    await update.message.reply_text(title, reply_markup=reply_markup)
     return State.WAITING_FOR_TASK_NUMBER
 
 # Обработчик ввода номера задачи для запуска сессии
@@ -192,11 +312,15 @@ async def receive_task_for_start_session(update: Update, context: ContextTypes.D
     task_id = int(query.data.split("_")[1])
 
     # Запускаем сессию
-    if start_session(user_id, task_id):
+    started = storage.start_session(user_id, task_id)
+    if started:
+        session_watchdog.track(user_id)
 
         #Находим активную сессию, для определения 'name'
-        active_session = get_active_session(user_id)
+        active_session = storage.get_active_session(user_id)
         await query.edit_message_text(f'Сессия для задачи "{active_session["name"]}" запущена!▶️')
+    elif started is None:
+        await query.edit_message_text("Задача не найдена.")
     else:
         await query.edit_message_text("У тебя уже есть активная сессия.")
     return ConversationHandler.END
@@ -215,14 +339,15 @@ async def stop_session_handler(update: Update, context: ContextTypes.DEFAULT_TYP
     user_id = update.message.from_user.id
 
     # Получаем активную сессию пользователя
-    active_session = get_active_session(user_id)
+    active_session = storage.get_active_session(user_id)
 
     if not active_session:
         await update.message.reply_text("У тебя нет активной сессии.")
         return
 
     # Останавливаем сессию и получаем результат
-    result = stop_session(user_id)
+    result = storage.stop_session(user_id)
+    session_watchdog.untrack(user_id)
 
     if result:
         await update.message.reply_text(
@@ -235,7 +360,7 @@ async def active_session_handler(update: Update, context: ContextTypes.DEFAULT_T
     user_id = update.message.from_user.id
 
     # Получаем активную сессию пользователя
-    active_session = get_active_session(user_id)
+    active_session = storage.get_active_session(user_id)
 
     if not active_session:
         await update.message.reply_text("У тебя нет активной сессии.")
@@ -252,6 +377,7 @@ async def stats_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         [InlineKeyboardButton('Общая статистика за 7 дней', callback_data='total_stat_7')],
         [InlineKeyboardButton('Статистика по задаче за 7 дней', callback_data='total_stat_task_7')],
         [InlineKeyboardButton('📊 Открыть дашборд', callback_data='open_dashboard')],
+        [InlineKeyboardButton('🗓 Активность за год', callback_data='open_heatmap')],
         [InlineKeyboardButton('Назад', callback_data='back_menu')]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
@@ -280,8 +406,8 @@ async def handle_stats_selection(update: Update, context: ContextTypes.DEFAULT_T
     user_id = query.from_user.id
 
     if query.data == 'total_stat_7':
-        stats = get_total_stat_last_7_days(user_id)
-        daily_day = get_stat_daily_day(user_id)
+        stats = storage.get_total_stat_last_7_days(user_id)
+        daily_day = storage.get_stat_daily_day(user_id)
 
         # Клавиатура для кнопки назад
         keyboard = [[InlineKeyboardButton("Назад", callback_data='stats')]]
@@ -296,27 +422,21 @@ async def handle_stats_selection(update: Update, context: ContextTypes.DEFAULT_T
             f"📈Статистика за последние 7 дней:\n"
             f"Общее активное время: {stats['total_time']}\n"
             f"Cреднее активное время: {stats['avg_time']}\n\n"
-            f"Статистика по дням:\n{days_info}",reply_markup=reply_markup
+            f"Статистика по дням:\n{days_info}\n\n"
+            f"{_format_metrics(storage.get_consistency_metrics(user_id))}",reply_markup=reply_markup
             )
 
     elif query.data == 'total_stat_task_7':
 
-        # Получаем список задач
-        tasks = get_tasks(user_id)
+        # Получаем первую страницу задач
+        context.user_data.pop('task_picker_prefix', None)
+        title, reply_markup = _build_task_picker(user_id, 'stat')
 
-        if not tasks:
+        if not reply_markup:
             await query.edit_message_text("У тебя пока нет задач.")
             return ConversationHandler.END
 
-
-        # Формируем сообщение со списком задач
-        keyboard = [
-            [InlineKeyboardButton(task['name'], callback_data=f"stat_{task['id']}")] for task in tasks
-        ]
-        keyboard.append([InlineKeyboardButton("Отмена", callback_data="stat")])
-        reply_markup = InlineKeyboardMarkup(keyboard)
-
-        await query.edit_message_text(f"Для какой задачи вывести статистику?", reply_markup=reply_markup)
+        await query.edit_message_text(title, reply_markup=reply_markup)
         return State.WAITING_FOR_TASK_NUMBER
 
     elif query.data == "open_dashboard":
@@ -324,60 +444,170 @@ async def handle_stats_selection(update: Update, context: ContextTypes.DEFAULT_T
         logging.info(f"Пользователь {user_id} запросил дашборд.")
         await _handle_dashboard(query, context, user_id)
 
-#Обработчик вывода графиков статистики
+    elif query.data == "open_heatmap" or query.data.startswith("heatmap_"):
+        # Календарь активности за год: общий или по задаче (heatmap_<task_id>)
+        task_id = int(query.data.split("_")[1]) if query.data.startswith("heatmap_") else None
+        await _handle_heatmap(query, context, user_id, task_id)
+
+#Функция текста показателей регулярности
+def _format_metrics(summary):
+    lines = [
+        f"🔥 Серия: {summary['current_streak']} дн. подряд (рекорд: {summary['longest_streak']})",
+        f"📅 Активных дней: {summary['active_ratio']:.0%} ({summary['active_days']} из {summary['days']})",
+    ]
+    if summary['goal_hours']:
+        lines.append(
+            f"🎯 Цель на неделю: {summary['week_hours']:.1f} из {summary['goal_hours']:g} ч "
+            f"({summary['goal_progress']:.0%})"
+        )
+    else:
+        lines.append(f"🎯 За эту неделю: {summary['week_hours']:.1f} ч. Поставить цель: /goal")
+    return "\n".join(lines)
+
+#Функция подписи о свежести данных дашборда
+def _format_data_time(data_time):
+    if data_time is None:
+        return "Данные актуальны на текущий момент"
+    local_time = data_time + timedelta(hours=TZ_OFFSET_HOURS)
+    return f"Данные на {local_time:%H:%M} ({TZ_LABEL}), свежие сессии появятся в течение нескольких минут"
+
+#Обработчик вывода графиков статистики: сводка сразу, графики - по мере готовности
 async def _handle_dashboard(query, context, user_id):
-   #Обрабатывает запрос на генерацию и отправку дашборда.
     try:
         await query.delete_message()
-        generating_message = await context.bot.send_message(
+        # Заглушка уйдет, только если чтение данных затянется
+        async with placeholder(context.bot, user_id, "⏳ Генерация дашборда..."):
+            prepared = await asyncio.to_thread(prepare_dashboard, user_id)
+            summary = format_dashboard_summary(prepared[1])
+            metrics = await asyncio.to_thread(storage.get_consistency_metrics, user_id)
+
+        # Кнопка "Назад" - на сводке: графики приходят ниже, уйти можно, не дожидаясь их
+        keyboard = InlineKeyboardMarkup([
+            [InlineKeyboardButton("Назад", callback_data='cancel_dashboard')]
+        ])
+        panels = dashboard_panels(prepared)
+        text = f"📊 Дашборд твоей активности\n\n{summary}\n{_format_metrics(metrics)}\n\n{_format_data_time(prepared[0][1])}"
+        message = await context.bot.send_message(
             chat_id=user_id,
-            text="⏳ Генерация дашборда..."
+            text=f"{text}\nГрафики придут следующими сообщениями." if panels
+            else f"{text}\n\n😞 Недостаточно данных для графиков.\nПора начинать учиться!",
+            reply_markup=keyboard
+        )
+        if not panels:
+            return
+        # Сообщения дашборда удаляются вместе по кнопке "Назад"
+        messages = context.user_data['dashboard_messages'] = [message.message_id]
+
+        # Графики - фоновой задачей: обновления обрабатываются по одному, и следующие пользователи
+        # не должны ждать, пока нарисуются все графики этого (PTB дождется задачи при остановке)
+        context.application.create_task(
+            _send_dashboard_panels(context, user_id, prepared, messages, text, keyboard), name=f'dashboard_{user_id}'
         )
-        logging.info("Запущена генерация дашборда")
-        # Генерируем графики
-        images = generate_dashboard(user_id)
-        if images:
-
-            keyboard = InlineKeyboardMarkup([
-                [InlineKeyboardButton("Назад", callback_data='cancel_dashboard')]
-            ])
-            # Отправляем изображения пользователю
-            await context.bot.send_photo(
-                chat_id=user_id,
-                photo=images,
-                caption="Дашборд твоей активности готов",
-                reply_markup = keyboard
-            )
-            images.close()  # Закрываем байтовый объект
-            await generating_message.delete()
 
-        else:
-            await context.bot.send_message(
-                chat_id=user_id,
-                text="😞 Недостаточно данных для построения отчета.\nПора начинать учиться!"
+    except Exception as e:
+        logging.error(f"Ошибка при генерации дашборда для пользователя {user_id}: {e}")
+        await context.bot.send_message(
+            chat_id=user_id,
+            text="⚠️ Произошла ошибка при генерации. Попробуйте позже."
+        )
+
+#Функция отправки графиков дашборда по мере готовности; если не удалось ни одного - сводка говорит об этом
+async def _send_dashboard_panels(context, user_id, prepared, messages, text, keyboard):
+    sent = 0
+    try:
+        # Графики рисуются параллельно (RENDER_WORKERS процессов) и отправляются в порядке готовности
+        async for panel, image in render_dashboard_panels(user_id, prepared):
+            if context.user_data.get('dashboard_messages') is not messages:
+                continue  # Пользователь уже ушел с дашборда - картинки остаются в кеше
+            if image:
+                photo = await context.bot.send_photo(chat_id=user_id, photo=image, caption=DASHBOARD_PANELS[panel][0])
+                image.close()
+                messages.append(photo.message_id)
+                sent += 1
+        logging.info(f"Дашборд для пользователя {user_id} отправлен: графиков {sent} из {len(DASHBOARD_PANELS)}")
+    except Exception as e:
+        logging.error(f"Ошибка при генерации графиков дашборда для пользователя {user_id}: {e}")
+
+    if not sent and context.user_data.get('dashboard_messages') is messages:
+        try:
+            await context.bot.edit_message_text(
+                chat_id=user_id, message_id=messages[0],
+                text=f"{text}\n\n⚠️ Графики построить не удалось. Попробуйте позже.", reply_markup=keyboard
             )
-            await generating_message.delete()
+        except TelegramError as e:
+            logging.error(f"Не удалось обновить сводку дашборда для пользователя {user_id}: {e}")
+
+#Обработчик вывода календаря активности за год
+async def _handle_heatmap(query, context, user_id, task_id=None):
+    title = "Календарь активности за год"
+    if task_id is not None:
+        task = storage.get_task(user_id, task_id)
+        if task is None:
+            await query.edit_message_text("Задача не найдена.")
+            return
+        title += f' по задаче "{task["name"]}"'
+    await _send_rendered_image(
+        query, context, user_id, lambda uid: generate_heatmap(uid, task_id), "⏳ Рисую календарь...", title
+    )
+
+#Функция отправки картинки статистики вместо сообщения с меню
+async def _send_rendered_image(query, context, user_id, generate, progress_text, caption):
+    try:
+        await query.delete_message()
+        # Заглушка уйдет, только если генерация затянется (кэш отвечает сразу)
+        async with placeholder(context.bot, user_id, progress_text):
+            logging.info(f"Запущена генерация: {caption}")
+            # Генерируем графики в потоке, чтобы не останавливать цикл событий (и отправку сообщений)
+            images, data_time = await asyncio.to_thread(generate, user_id)
+            if images:
+
+                keyboard = InlineKeyboardMarkup([
+                    [InlineKeyboardButton("Назад", callback_data='cancel_dashboard')]
+                ])
+                # Отправляем изображения пользователю
+                await context.bot.send_photo(
+                    chat_id=user_id,
+                    photo=images,
+                    caption=f"{caption}\n{_format_data_time(data_time)}",
+                    reply_markup = keyboard
+                )
+                images.close()  # Закрываем байтовый объект
+
+            else:
+                await context.bot.send_message(
+                    chat_id=user_id,
+                    text="😞 Недостаточно данных для построения отчета.\nПора начинать учиться!"
+                )
 
     except Exception as e:
-        logging.error(f"Ошибка при генерации дашборда для пользователя {user_id}: {e}")
+        logging.error(f"Ошибка при генерации картинки для пользователя {user_id}: {e}")
         await context.bot.send_message(
             chat_id=user_id,
-            text="⚠️ Произошла ошибка при генерации дашборда. Попробуйте позже."
+            text="⚠️ Произошла ошибка при генерации. Попробуйте позже."
         )
-        await generating_message.delete()
 
 async def cancel_dashboard_handler(update, context):
     query = update.callback_query
     await query.answer()
 
-    # Удаляем сообщение с дашбордом
+    # Удаляем сообщение с дашбордом (и графики, если это сводка дашборда)
     await query.delete_message()
+    messages = context.user_data.get('dashboard_messages') or []
+    if query.message.message_id in messages:
+        context.user_data.pop('dashboard_messages')
+        for message_id in messages:
+            if message_id != query.message.message_id:
+                try:
+                    await context.bot.delete_message(chat_id=query.message.chat_id, message_id=message_id)
+                except TelegramError as e:
+                    logging.error(f"Не удалось удалить график дашборда: {e}")
 
     # Создаём новое меню статистики
     keyboard = [
         [InlineKeyboardButton('Общая статистика за 7 дней', callback_data='total_stat_7')],
         [InlineKeyboardButton('Статистика по задаче за 7 дней', callback_data='total_stat_task_7')],
         [InlineKeyboardButton('📊 Открыть дашборд', callback_data='open_dashboard')],
+        [InlineKeyboardButton('🗓 Активность за год', callback_data='open_heatmap')],
         [InlineKeyboardButton('Назад', callback_data='back_menu')]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
@@ -397,17 +627,22 @@ async def handler_task_number_stat(update: Update, context: ContextTypes.DEFAULT
     user_id = query.from_user.id
     task_id = int(query.data.split("_")[1])
 
-    # Находим задачу по task_id
-    tasks = get_tasks(user_id)
-    task = next((task for task in tasks if task["id"] == task_id), None)
+    # Находим задачу по task_id (кнопка могла устареть: задачу удалили)
+    task = storage.get_task(user_id, task_id)
+    if task is None:
+        await query.edit_message_text("Задача не найдена.")
+        return ConversationHandler.END
 
-    # Клавиатура для кнопки назад
-    keyboard = [[InlineKeyboardButton("Назад", callback_data='stats')]]
+    # Клавиатура: календарь по задаче и кнопка назад
+    keyboard = [
+        [InlineKeyboardButton("🗓 Активность за год", callback_data=f'heatmap_{task_id}')],
+        [InlineKeyboardButton("Назад", callback_data='stats')],
+    ]
     reply_markup = InlineKeyboardMarkup(keyboard)
 
     #Получаем статистику
-    stat = get_task_stat_last_7_days(user_id, task_id)
-    stat_daily = get_stat_task_daily_day(user_id, task_id)
+    stat = storage.get_task_stat_last_7_days(user_id, task_id)
+    stat_daily = storage.get_stat_task_daily_day(user_id, task_id)
 
     days_info = "\n".join(
         f"• {formatted_date}: {data['day_of_week']} ({data['active_time']})"
@@ -419,7 +654,8 @@ async def handler_task_number_stat(update: Update, context: ContextTypes.DEFAULT
         f'📈Статистика по задаче "{task["name"]}" за последние 7 дней:\n'
         f'Общее активное время: {stat["total_time_task"]}\n'
         f'Cреднее активное время: {stat["avg_time_task"]}\n\n'
-        f'Статистика по дням:\n{days_info}', reply_markup=reply_markup)
+        f'Статистика по дням:\n{days_info}\n\n'
+        f'{_format_metrics(storage.get_consistency_metrics(user_id, task_id))}', reply_markup=reply_markup)
 
     return ConversationHandler.END
 
@@ -431,3 +667,191 @@ async def cancel_stat_task_handler(update: Update, context: ContextTypes.DEFAULT
     # Возвращаем пользователя в меню статистики
     await stats_handler(update, context)
     return ConversationHandler.END
+
+#Обработчик команды /import - импорт истории сессий из CSV
+async def import_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    keyboard = [[InlineKeyboardButton("Отмена", callback_data="cancel_import")]]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+
+    await update.message.reply_text(
+        "Пришли CSV-файл с историей.\n"
+        "Колонки: task, start, end (время в формате 2024-01-31 18:30).\n"
+        "Подходит и экспорт Toggl (Project, Start date, Start time, End date, End time).",
+        reply_markup=reply_markup
+    )
+    return State.WAITING_FOR_IMPORT_FILE
+
+#Обработчик получения CSV-файла для импорта
+async def receive_import_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.message.from_user.id
+    document = update.message.document
+
+    if document.file_size and document.file_size > IMPORT_MAX_FILE_SIZE:
+        await update.message.reply_text("Файл слишком большой, максимум 20 МБ.")
+        return ConversationHandler.END
+
+    progress_message = await update.message.reply_text("⏳ Импортирую историю...")
+    file = await document.get_file()
+    data = await file.download_as_bytearray()
+
+    try:
+        # Разбор и вставка идут в отдельном потоке, чтобы не блокировать остальных пользователей
+        result, stats = await asyncio.to_thread(import_sessions_csv, user_id, bytes(data))
+    except (ValueError, UnicodeDecodeError) as e:
+        logging.warning(f"Ошибка импорта CSV пользователя {user_id}: {e}")
+        await progress_message.edit_text(f"⚠️ Не удалось прочитать файл: {e}")
+        return ConversationHandler.END
+
+    message_text = (
+        f"Импорт завершен ✅\n"
+        f"Сессий добавлено: {result['imported']}\n"
+        f"Новых задач: {result['created_tasks']}\n"
+        f"Пропущено строк: {stats.skipped}"
+    )
+    if stats.errors:
+        message_text += "\n\nОшибки:\n" + "\n".join(f"• {error}" for error in stats.errors)
+
+    await progress_message.edit_text(message_text)
+    return ConversationHandler.END
+
+#Обработчик отмены импорта
+async def cancel_import_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()  # Подтверждаем нажатие кнопки
+
+    await query.edit_message_text("Импорт отменен!")
+    return ConversationHandler.END
+
+#Обработчик команды /max_session - лимит длины сессии для автоостановки
+async def max_session_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.message.from_user.id
+
+    if not context.args:
+        hours = storage.get_max_session_hours(user_id)
+        current = f"{hours:g} ч." if hours else "без ограничения"
+        await update.message.reply_text(
+            f"Максимальная длина сессии: {current}\n"
+            f"После нее забытый таймер остановится сам.\n"
+            f"Изменить: /max_session 8 (0 - без ограничения)"
+        )
+        return
+
+    try:
+        hours = float(context.args[0].replace(',', '.'))
+    except ValueError:
+        hours = -1
+    if hours < 0 or hours > 168:
+        await update.message.reply_text("Укажи число часов от 0 до 168, например: /max_session 8")
+        return
+
+    storage.set_max_session_hours(user_id, hours)
+    # Пересчитываем срок уже идущей сессии
+    session_watchdog.track(user_id)
+
+    await update.message.reply_text(
+        f"Лимит сессии: {hours:g} ч. ✅" if hours else "Автоостановка сессий отключена ✅"
+    )
+
+#Обработчик выбора профиля вывода дашборда: /dashboard_profile [профиль]
+async def dashboard_profile_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.message.from_user.id
+    profiles = "\n".join(f"{name} - {settings['title']}" for name, settings in DASHBOARD_PROFILES.items())
+
+    if not context.args:
+        await update.message.reply_text(
+            f"Профиль дашборда: {get_user_profile(user_id)}\n\n{profiles}\n\n"
+            f"Изменить: /dashboard_profile mobile"
+        )
+        return
+
+    profile = context.args[0].lower()
+    if profile not in DASHBOARD_PROFILES:
+        await update.message.reply_text(f"Такого профиля нет. Доступные:\n{profiles}")
+        return
+
+    storage.set_dashboard_profile(user_id, profile)
+    await update.message.reply_text(f"Профиль дашборда: {DASHBOARD_PROFILES[profile]['title']} ✅")
+
+#Обработчик недельной цели: /goal [часы] [название задачи]
+async def goal_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.message.from_user.id
+
+    if not context.args:
+        await update.message.reply_text(
+            f"{_format_metrics(storage.get_consistency_metrics(user_id))}\n\n"
+            f"Поставить цель на неделю: /goal 10\n"
+            f"Цель по задаче: /goal 3 Название задачи\n"
+            f"Убрать цель: /goal 0"
+        )
+        return
+
+    try:
+        hours = float(context.args[0].replace(',', '.'))
+    except ValueError:
+        hours = -1
+    if hours < 0 or hours > 168:
+        await update.message.reply_text("Укажи число часов в неделю от 0 до 168, например: /goal 10")
+        return
+
+    task_name = " ".join(context.args[1:])
+    task = None
+    if task_name:
+        task = next((t for t in storage.get_tasks(user_id) if t['name'].lower() == task_name.lower()), None)
+        if task is None:
+            await update.message.reply_text(f'Задача "{task_name}" не найдена.')
+            return
+
+    storage.set_weekly_goal(user_id, hours, task['id'] if task else None)
+    target = f' по задаче "{task["name"]}"' if task else ''
+    await update.message.reply_text(
+        f"Цель на неделю{target}: {hours:g} ч. ✅" if hours else f"Цель на неделю{target} убрана ✅"
+    )
+
+#Обработчик сводки для администраторов: /admin_report [chart]
+async def admin_report_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.message.from_user.id
+    if user_id not in ADMIN_IDS:
+        logging.warning(f"Пользователь {user_id} запросил /admin_report без прав администратора")
+        return
+
+    with_chart = bool(context.args) and context.args[0].lower() in ('chart', 'график')
+    try:
+        async with placeholder(context.bot, user_id, "⏳ Собираю сводку..."):
+            # Проход по всем шардам - в потоке, цикл событий продолжает обслуживать пользователей
+            report = await asyncio.to_thread(build_report)
+            runtime = format_runtime(
+                loop_monitor.snapshot(), list(loop_monitor.stalls)[-3:], JOB_METRICS,
+                getattr(context.bot.rate_limiter, 'stats', None),
+                {**deduplicator.snapshot(), **{f"render_{key}": value for key, value in get_render_stats().items()}}
+            )
+            await update.message.reply_text(f"{format_report(report)}\n\n{runtime}")
+            if with_chart:
+                image = await asyncio.to_thread(
+                    render_workers.render, 'admin_report:render_report_chart', report, get_user_profile(user_id)
+                )
+                if image:
+                    await context.bot.send_photo(chat_id=user_id, photo=image)
+                    image.close()
+    except Exception as e:
+        logging.error(f"Ошибка построения сводки для администратора {user_id}: {e}")
+        await update.message.reply_text("⚠️ Не удалось собрать сводку. Подробности в логе.")
+
+#Обработчик отчета о памяти для администраторов: /memory [start|stop]
+async def memory_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.message.from_user.id
+    if user_id not in ADMIN_IDS:
+        logging.warning(f"Пользователь {user_id} запросил /memory без прав администратора")
+        return
+
+    action = context.args[0].lower() if context.args else None
+    if action == 'start':
+        if not tracemalloc.is_tracing():
+            start_tracing()
+        await update.message.reply_text("tracemalloc включен. Первый /memory покажет текущее состояние, следующие - прирост.")
+        return
+    if action == 'stop':
+        stop_tracing()
+        await update.message.reply_text("tracemalloc выключен.")
+        return
+
+    await update.message.reply_text(await asyncio.to_thread(build_memory_report))
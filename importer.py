@@ -0,0 +1,144 @@
+import csv
+import io
+import logging
+from datetime import datetime, timedelta
+from config import TZ_OFFSET_HOURS
+from storage import storage
+
+#Возможные названия колонок (свой формат и экспорт Toggl-подобных трекеров)
+TASK_COLUMNS = ('task', 'задача', 'project', 'description')
+START_COLUMNS = ('start', 'start_time', 'начало')
+END_COLUMNS = ('end', 'end_time', 'конец')
+START_DATE_COLUMNS = ('start date',)
+START_TIME_COLUMNS = ('start time',)
+END_DATE_COLUMNS = ('end date',)
+END_TIME_COLUMNS = ('end time',)
+
+#Поддерживаемые форматы даты и времени
+DATETIME_FORMATS = (
+    '%Y-%m-%d %H:%M:%S',
+    '%Y-%m-%d %H:%M',
+    '%Y-%m-%dT%H:%M:%S',
+    '%Y-%m-%dT%H:%M',
+    '%d.%m.%Y %H:%M:%S',
+    '%d.%m.%Y %H:%M',
+)
+
+MAX_ERRORS_SHOWN = 5  # Сколько ошибок показываем пользователю
+
+
+class ImportStats:
+    """Счетчики разбора файла: сколько строк прочитано, пропущено и примеры ошибок"""
+
+    def __init__(self):
+        self.total = 0
+        self.skipped = 0
+        self.errors = []
+
+    def add_error(self, line_number, message):
+        self.skipped += 1
+        if len(self.errors) < MAX_ERRORS_SHOWN:
+            self.errors.append(f"строка {line_number}: {message}")
+
+
+#Функция разбора даты и времени в одном из поддерживаемых форматов
+def parse_datetime(value: str, formats=DATETIME_FORMATS):
+    value = value.strip()
+    for fmt in formats:
+        try:
+            return datetime.strptime(value, fmt), fmt
+        except ValueError:
+            continue
+    raise ValueError(f'неизвестный формат даты "{value}"')
+
+
+#Функция разбора с запоминанием последнего подошедшего формата (в файле он обычно один)
+def _make_datetime_parser():
+    formats = list(DATETIME_FORMATS)
+
+    def parse(value: str):
+        result, fmt = parse_datetime(value, formats)
+        if fmt != formats[0]:
+            formats.remove(fmt)
+            formats.insert(0, fmt)
+        return result
+
+    return parse
+
+
+#Функция поиска колонки по списку возможных названий (в порядке приоритета)
+def _find_columns(header, names):
+    normalized = [column.strip().lower() for column in header]
+    return [normalized.index(name) for name in names if name in normalized]
+
+
+def _find_column(header, names):
+    columns = _find_columns(header, names)
+    return columns[0] if columns else None
+
+
+#Функция потокового разбора CSV: отдает кортежи (task_name, start_time, end_time) в UTC
+def parse_sessions_csv(lines, stats: ImportStats):
+    """
+    lines - любой итерируемый поток строк (файл, TextIOWrapper). Строки с ошибками
+    пропускаются и учитываются в stats, весь файл в память не загружается.
+    """
+    reader = csv.reader(lines)
+    header = next(reader, None)
+    if header is None:
+        raise ValueError("файл пустой")
+
+    task_cols = _find_columns(header, TASK_COLUMNS)
+    start_col = _find_column(header, START_COLUMNS)
+    end_col = _find_column(header, END_COLUMNS)
+    start_date_col = _find_column(header, START_DATE_COLUMNS)
+    start_time_col = _find_column(header, START_TIME_COLUMNS)
+    end_date_col = _find_column(header, END_DATE_COLUMNS)
+    end_time_col = _find_column(header, END_TIME_COLUMNS)
+
+    split_format = None not in (start_date_col, start_time_col, end_date_col, end_time_col)
+    if not task_cols or not (split_format or None not in (start_col, end_col)):
+        raise ValueError("в заголовке нужны колонки task, start, end (или Start date/Start time/End date/End time)")
+
+    offset = timedelta(hours=TZ_OFFSET_HOURS)
+    parse = _make_datetime_parser()
+
+    for line_number, row in enumerate(reader, start=2):
+        if not row or not any(cell.strip() for cell in row):
+            continue
+        stats.total += 1
+        try:
+            #Берем первую непустую колонку с названием (в Toggl колонка Task часто пустая)
+            task_name = next((row[i].strip() for i in task_cols if i < len(row) and row[i].strip()), '')
+            if not task_name:
+                raise ValueError("пустое название задачи")
+
+            if split_format:
+                start = parse(f"{row[start_date_col]} {row[start_time_col]}")
+                end = parse(f"{row[end_date_col]} {row[end_time_col]}")
+            else:
+                start = parse(row[start_col])
+                end = parse(row[end_col])
+        except (IndexError, ValueError) as e:
+            stats.add_error(line_number, str(e) or "неполная строка")
+            continue
+
+        if end <= start:
+            stats.add_error(line_number, "конец сессии раньше начала")
+            continue
+
+        #Время в файле указано в часовом поясе пользователя, в БД храним UTC
+        yield (
+            task_name,
+            (start - offset).strftime('%Y-%m-%d %H:%M:%S'),
+            (end - offset).strftime('%Y-%m-%d %H:%M:%S'),
+        )
+
+
+#Функция импорта CSV-документа из байтов (вызывается в отдельном потоке)
+def import_sessions_csv(user_id: int, data: bytes):
+    stats = ImportStats()
+    lines = io.TextIOWrapper(io.BytesIO(data), encoding='utf-8-sig', newline='')
+    result = storage.import_sessions(user_id, parse_sessions_csv(lines, stats))
+    logging.info(f"Импорт CSV пользователя {user_id}: прочитано {stats.total}, пропущено {stats.skipped}")
+    return result, stats
@@ -0,0 +1,133 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta, timezone, time as dt_time
+from telegram.ext import Application, ContextTypes
+from config import (
+    TZ_OFFSET_HOURS, QUIET_HOURS_START, QUIET_HOURS_END, PRERENDER_ACTIVE_DAYS,
+    ANALYTICS_SNAPSHOT_INTERVAL, COMPACTION_HORIZON_DAYS, TASK_PURGE_INTERVAL
+)
+from database import (
+    refresh_daily_totals, analyze_db, incremental_vacuum, checkpoint_wal,
+    compact_history, background_pause
+)
+from storage import storage
+from dashboard import prerender_dashboard
+from analytics_snapshot import refresh_snapshots
+
+USER_TZ = timezone(timedelta(hours=TZ_OFFSET_HOURS))
+
+# Метрики фоновых задач: имя шага -> счетчики запусков и времени выполнения
+JOB_METRICS = {}
+
+
+#Функция проверки, что сейчас тихие часы
+def in_quiet_hours(now: datetime = None):
+    hour = (now or datetime.now(USER_TZ)).hour
+    if QUIET_HOURS_START <= QUIET_HOURS_END:
+        return QUIET_HOURS_START <= hour < QUIET_HOURS_END
+    return hour >= QUIET_HOURS_START or hour < QUIET_HOURS_END  # Окно через полночь
+
+
+#Функция учета времени выполнения шага
+def _record(name, duration, units=1):
+    metrics = JOB_METRICS.setdefault(name, {'runs': 0, 'units': 0, 'total_duration': 0.0, 'last_duration': 0.0})
+    metrics['runs'] += 1
+    metrics['units'] += units
+    metrics['total_duration'] += duration
+    metrics['last_duration'] = duration
+    metrics['last_run'] = datetime.now(USER_TZ).isoformat(timespec='seconds')
+
+
+#Функция выполнения одной единицы работы в отдельном потоке с ограничением доли CPU
+async def _run_throttled(fn, *args):
+    """
+    Работа идет в потоке, а после нее задача спит столько, чтобы занимать не больше
+    BACKGROUND_CPU_SHARE времени: остальное достается обработчикам пользователей.
+    """
+    started = time.perf_counter()
+    result = await asyncio.to_thread(fn, *args)
+    elapsed = time.perf_counter() - started
+    await asyncio.sleep(background_pause(elapsed))
+    return result, elapsed
+
+
+#Фоновая задача тихих часов: агрегаты, дашборды, обслуживание БД
+async def nightly_job(context: ContextTypes.DEFAULT_TYPE):
+    job_started = time.perf_counter()
+    logging.info("Старт фоновых задач тихих часов")
+
+    # 1. Дневные итоги за завершенные дни
+    _, elapsed = await _run_throttled(refresh_daily_totals)
+    _record('refresh_daily_totals', elapsed)
+
+    # 2. Дашборды для недавно активных пользователей
+    user_ids, _ = await _run_throttled(storage.get_recently_active_users, PRERENDER_ACTIVE_DAYS)
+    rendered = 0
+    render_time = 0.0
+    for user_id in user_ids:
+        if not in_quiet_hours():
+            logging.info("Тихие часы закончились, предварительный рендер прерван")
+            break
+        was_rendered, elapsed = await _run_throttled(prerender_dashboard, user_id)
+        rendered += was_rendered
+        render_time += elapsed
+    _record('prerender_dashboards', render_time, rendered)
+
+    # 3. Сжатие старой истории (горизонт не меньше 30 дней - столько читают недельные отчеты с запасом)
+    if in_quiet_hours():
+        moved, elapsed = await _run_throttled(compact_history, max(COMPACTION_HORIZON_DAYS, 30))
+        _record('compact_history', elapsed, moved)
+
+    # 4. Обслуживание БД
+    for name, fn in (('analyze', analyze_db), ('incremental_vacuum', incremental_vacuum),
+                     ('wal_checkpoint', checkpoint_wal)):
+        if not in_quiet_hours():
+            break
+        _, elapsed = await _run_throttled(fn)
+        _record(name, elapsed)
+
+    _record('nightly_job', time.perf_counter() - job_started)
+    logging.info(
+        f"Фоновые задачи завершены за {time.perf_counter() - job_started:.1f} с, "
+        f"дашбордов нарисовано: {rendered} из {len(user_ids)}"
+    )
+
+
+#Фоновая задача обновления аналитического снимка
+async def snapshot_job(context: ContextTypes.DEFAULT_TYPE):
+    try:
+        elapsed = await asyncio.to_thread(refresh_snapshots)
+        _record('analytics_snapshot', elapsed)
+    except Exception as e:
+        logging.error(f"Ошибка обновления аналитического снимка: {e}")
+
+
+#Фоновая задача окончательного удаления задач, время отмены которых прошло
+async def purge_job(context: ContextTypes.DEFAULT_TYPE):
+    """Сессии удаляются порциями по TASK_PURGE_CHUNK_ROWS строк с паузами между ними - запись пользователей не ждет"""
+    started = time.perf_counter()
+    try:
+        tasks, rows = await asyncio.to_thread(storage.purge_deleted_tasks)
+    except Exception as e:
+        logging.error(f"Ошибка удаления сессий удаленных задач: {e}")
+        return
+    _record('purge_deleted_tasks', time.perf_counter() - started, rows)
+    if tasks:
+        logging.info(f"Удалено задач: {tasks}, строк истории: {rows} за {time.perf_counter() - started:.1f} с")
+
+
+#Функция регистрации фоновых задач в JobQueue
+def register_jobs(application: Application):
+    application.job_queue.run_daily(
+        nightly_job,
+        time=dt_time(hour=QUIET_HOURS_START, tzinfo=USER_TZ),
+        name='nightly_job',
+    )
+    application.job_queue.run_repeating(
+        snapshot_job, interval=ANALYTICS_SNAPSHOT_INTERVAL, first=0, name='analytics_snapshot'
+    )
+    application.job_queue.run_repeating(
+        purge_job, interval=TASK_PURGE_INTERVAL, first=TASK_PURGE_INTERVAL, name='purge_deleted_tasks'
+    )
+    logging.info(f"Фоновые задачи запланированы на {QUIET_HOURS_START:02}:00-{QUIET_HOURS_END:02}:00")
@@ -0,0 +1,128 @@
+"""
+Запуск и остановка бота без потерь при перевыкатке контейнера.
+
+Запуск: миграции схемы (до сборки приложения - с таблицами работают persistence и watchdog сессий),
+затем в post_init, до первого getUpdates, - прогрев: соединения и страницы SQLite для недавно
+активных пользователей (их задачи и активные сессии) в пределах WARMUP_TIME_BUDGET и по одной
+маленькой картинке в каждом процессе рисования. Только после этого PTB начинает забирать
+обновления; если задан READY_FILE, он создается - по нему проверяется готовность контейнера.
+
+Остановка (SIGTERM, SIGINT): PTB перестает забирать обновления, дообрабатывает уже полученные,
+ждет фоновые задачи и сохраняет состояния диалогов; затем в post_shutdown завершаются процессы
+рисования (начатые картинки дорисовываются) и WAL переносится в файл БД (wal_checkpoint(TRUNCATE)).
+"""
+import asyncio
+import logging
+import os
+import time
+from telegram.ext import Application
+from config import READY_FILE, WARMUP_TIME_BUDGET, PRERENDER_ACTIVE_DAYS, DASHBOARD_PROFILE
+from database import init_db, checkpoint_wal
+from render_workers import render_workers
+from storage import storage
+
+_imported = time.monotonic()
+
+
+#Функция времени с запуска процесса, с (Linux - по /proc, иначе - с импорта этого модуля)
+def process_uptime():
+    try:
+        with open('/proc/self/stat') as stat, open('/proc/uptime') as uptime:
+            # Поле 22 - время запуска в тиках с загрузки системы; имя процесса в скобках может содержать пробелы
+            started = int(stat.read().rsplit(')', 1)[1].split()[19]) / os.sysconf('SC_CLK_TCK')
+            return float(uptime.read().split()[0]) - started
+    except (OSError, ValueError, IndexError):
+        return time.monotonic() - _imported
+
+
+#Функция прогрева SQLite: задачи и активные сессии недавно активных пользователей, не дольше budget секунд
+def warm_storage(days: int = PRERENDER_ACTIVE_DAYS, budget: float = WARMUP_TIME_BUDGET):
+    deadline = time.monotonic() + budget
+    user_ids = storage.get_recently_active_users(days)
+    warmed = 0
+    for user_id in user_ids:
+        if time.monotonic() > deadline:
+            break
+        storage.get_tasks(user_id)
+        storage.get_active_session(user_id)
+        warmed += 1
+    return warmed, len(user_ids)
+
+
+class Lifecycle:
+    def __init__(self):
+        self.steps = {}  # шаг запуска или остановки -> длительность, с
+        self.ready_after = None  # Секунд от начала запуска (migrate) до готовности
+        self._began = None
+        self._stopping = None
+
+    #Функция миграций: до сборки приложения
+    def migrate(self):
+        self._began = time.monotonic()
+        self.steps = {}
+        init_db()
+        self.steps['migrations'] = time.monotonic() - self._began
+
+    #Функция прогрева (post_init): обновления начнут забираться только после нее
+    async def startup(self, application: Application):
+        if self._began is None:
+            self._began = time.monotonic()
+            self.steps = {}
+
+        started = time.monotonic()
+        warmed, recent = await asyncio.to_thread(warm_storage)
+        self.steps['storage'] = time.monotonic() - started
+
+        started = time.monotonic()
+        try:
+            await asyncio.to_thread(render_workers.warm_up, DASHBOARD_PROFILE)
+        except Exception as e:
+            # Без прогрева бот работает, первая картинка просто рисуется дольше
+            logging.error(f"Не удалось прогреть процессы рисования: {e}")
+        self.steps['render'] = time.monotonic() - started
+
+        if READY_FILE:
+            with open(READY_FILE, 'w') as ready:
+                ready.write(str(os.getpid()))
+        self.ready_after = time.monotonic() - self._began
+        self._began = None
+        logging.info(
+            f"Бот готов за {self.ready_after:.2f} с (процесс запущен {process_uptime():.2f} с назад): "
+            + ", ".join(f"{step} {duration:.2f} с" for step, duration in self.steps.items())
+            + f"; прогрето пользователей {warmed} из {recent}"
+        )
+
+    #Функция начала остановки (post_stop): обновления уже не забираются, полученные обработаны
+    async def stopped(self, application: Application):
+        self._stopping = time.monotonic()
+        if READY_FILE:
+            try:
+                os.remove(READY_FILE)
+            except FileNotFoundError:
+                pass
+        # PTB дообрабатывает очередь до остановки - здесь она должна быть пустой
+        pending = application.update_queue.qsize()
+        if pending:
+            logging.warning(f"При остановке не обработано обновлений: {pending}")
+
+    #Функция завершения (post_shutdown): процессы рисования и WAL
+    async def shutdown(self, application: Application):
+        started = time.monotonic()
+        await asyncio.to_thread(render_workers.shutdown)
+        self.steps['render_shutdown'] = time.monotonic() - started
+
+        started = time.monotonic()
+        try:
+            results = await asyncio.to_thread(checkpoint_wal)
+            busy = sum(1 for result in results if result[0])
+            if busy:
+                logging.warning(f"WAL перенесен не полностью: занято шардов {busy}")
+        except Exception as e:
+            logging.error(f"Не удалось перенести WAL в БД: {e}")
+        self.steps['checkpoint'] = time.monotonic() - started
+
+        total = time.monotonic() - (self._stopping or started)
+        logging.info(f"Бот остановлен, завершение заняло {total:.2f} с")
+
+
+lifecycle = Lifecycle()
@@ -0,0 +1,245 @@
+"""
+Нагрузочный тест бота без Telegram: бот работает против локального fake_bot_api.py.
+
+Каждый виртуальный пользователь проходит обычный сценарий (создать задачу, запустить и
+остановить сессию, посмотреть статистику и дашборд) с паузой --think между шагами. Время шага -
+от отправки обновления до первого ответа бота в этот чат. В конце печатаются пропускная
+способность, p50/p95/p99 по шагам, ошибки и число вызовов Bot API по методам.
+
+    python load_test.py --users 50 --iterations 2
+    python load_test.py --users 50 --mode webhook
+    python load_test.py --users 50 --restart-after 10   # остановка и запуск бота посреди теста: теряются ли обновления
+    python load_test.py --users 50 --double-tap 0.3   # 30% шагов - двойное нажатие (проверка подавления повторов)
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+
+BOT_TOKEN = '123456:load-test'
+WEBHOOK_SECRET = 'load-test-secret'
+
+# Сценарий пользователя: (название шага, действие, параметр, какой ответ бота ждать)
+SCENARIO = [
+    ('/start', 'text', '/start', 'sendMessage'),
+    ('меню', 'text', '⚙️', 'sendMessage'),
+    ('добавить задачу', 'button', 'add_task', 'editMessageText'),
+    ('название задачи', 'text', 'Задача {iteration}', 'sendMessage'),
+    ('выбор задачи', 'text', '▶️', 'sendMessage'),
+    ('старт сессии', 'button', r'start_\d+', 'editMessageText'),
+    ('активная сессия', 'text', '🔄', 'sendMessage'),
+    ('стоп сессии', 'text', '⏹️', 'sendMessage'),
+    ('меню', 'text', '⚙️', 'sendMessage'),
+    ('статистика', 'button', 'stats', 'editMessageText'),
+    ('сводка за 7 дней', 'button', 'total_stat_7', 'editMessageText'),
+    ('статистика', 'button', 'stats', 'editMessageText'),
+    ('выбор задачи для статистики', 'button', 'total_stat_task_7', 'editMessageText'),
+    ('статистика задачи', 'button', r'stat_\d+', 'editMessageText'),
+    ('статистика', 'button', 'stats', 'editMessageText'),
+    ('дашборд', 'button', 'open_dashboard', 'sendPhoto'),
+]
+
+
+#Функция значения перцентиля по отсортированному списку
+def _percentile(values, share):
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+class LoadDriver:
+    def __init__(self, api, users: int, iterations: int, think: float, timeout: float, double_tap: float = 0):
+        self.api = api
+        self.double_tap = double_tap  # Доля шагов, где пользователь отправляет то же обновление второй раз
+        self.users = users
+        self.iterations = iterations
+        self.think = think
+        self.timeout = timeout
+        self.latencies = defaultdict(list)  # шаг -> время ответа, с
+        self.errors = Counter()
+
+    #Функция одного шага: отправить обновление и дождаться ожидаемого ответа бота
+    async def _step(self, user_id: int, queue: asyncio.Queue, name: str, action: str, value: str, expect: str):
+        while not queue.empty():
+            queue.get_nowait()  # Ответы прошлых шагов, которые пришли позже ожидаемого
+        started = time.perf_counter()
+        try:
+            for _ in range(2 if random.random() < self.double_tap else 1):
+                if action == 'text':
+                    self.api.send_text(user_id, value)
+                else:
+                    self.api.press_button(user_id, value)
+        except LookupError:
+            self.errors[f"{name}: нет кнопки"] += 1
+            return False
+
+        deadline = started + self.timeout
+        first = None
+        while True:
+            try:
+                method, message = await asyncio.wait_for(queue.get(), deadline - time.perf_counter())
+            except asyncio.TimeoutError:
+                self.errors[f"{name}: нет ответа за {self.timeout:.0f} с"] += 1
+                return False
+            first = first or time.perf_counter()
+            if method == expect:
+                break
+        if message and '⚠️' in (message.get('text') or ''):
+            self.errors[f"{name}: ответ с ошибкой"] += 1
+        self.latencies[name].append(first - started)
+        return True
+
+    async def _user(self, user_id: int):
+        queue = self.api.listen(user_id)
+        await asyncio.sleep(random.uniform(0, self.think))  # Пользователи приходят не одновременно
+        for iteration in range(1, self.iterations + 1):
+            for name, action, value, expect in SCENARIO:
+                if not await self._step(user_id, queue, name, action, value.format(iteration=iteration), expect):
+                    return  # Дальше сценарий не имеет смысла: нет нужного сообщения
+                await asyncio.sleep(self.think)
+
+    async def run(self):
+        started = time.perf_counter()
+        await asyncio.gather(*(self._user(100000 + i) for i in range(self.users)))
+        self.elapsed = time.perf_counter() - started
+
+    #Функция текста итогов
+    def report(self):
+        everything = sorted(latency for values in self.latencies.values() for latency in values)
+        steps = len(everything)
+        lines = [
+            f"Пользователей: {self.users}, шагов выполнено: {steps} за {self.elapsed:.1f} с "
+            f"({steps / self.elapsed:.1f} шаг/с, вызовов Bot API {sum(self.api.counts.values()) / self.elapsed:.1f}/с)",
+        ]
+        if everything:
+            lines.append(
+                f"Все шаги: p50 {_percentile(everything, 0.5) * 1000:.0f} мс, p95 {_percentile(everything, 0.95) * 1000:.0f} мс, "
+                f"p99 {_percentile(everything, 0.99) * 1000:.0f} мс, max {everything[-1] * 1000:.0f} мс"
+            )
+        lines.append(f"{'Шаг':<30} {'n':>6} {'p50, мс':>9} {'p95, мс':>9} {'p99, мс':>9}")
+        for name, values in self.latencies.items():
+            values = sorted(values)
+            lines.append(
+                f"{name:<30} {len(values):>6} {_percentile(values, 0.5) * 1000:>9.0f} "
+                f"{_percentile(values, 0.95) * 1000:>9.0f} {_percentile(values, 0.99) * 1000:>9.0f}"
+            )
+        errors = self.errors + self.api.errors
+        lines.append(f"Ошибки: {sum(errors.values())} ({sum(errors.values()) / max(1, steps + sum(self.errors.values())):.1%})")
+        lines += [f"  {error}: {count}" for error, count in errors.most_common()]
+        lines.append("Вызовы Bot API: " + ", ".join(f"{method} {count}" for method, count in self.api.counts.most_common()))
+        if self.api.throttled:
+            lines.append("Ответы 429: " + ", ".join(f"{method} {count}" for method, count in self.api.throttled.most_common()))
+        return "\n".join(lines)
+
+
+#Функция запуска бота так же, как run_polling/run_webhook: миграции, прогрев, затем прием обновлений
+async def start_bot(args, api):
+    lifecycle.migrate()
+    application = build_application(BOT_TOKEN, base_url=api.url)
+    await application.initialize()
+    await application.post_init(application)
+    await application.start()
+    if args.mode == 'webhook':
+        await application.updater.start_webhook(
+            listen='127.0.0.1', port=args.webhook_port, url_path='webhook', secret_token=WEBHOOK_SECRET,
+            webhook_url=f"http://127.0.0.1:{args.webhook_port}/webhook",
+        )
+    else:
+        await application.updater.start_polling(poll_interval=0, timeout=10)
+    return application
+
+
+#Функция остановки бота так же, как по SIGTERM
+async def stop_bot(application):
+    await application.updater.stop()
+    await application.stop()
+    await application.post_stop(application)
+    await application.shutdown()
+    await application.post_shutdown(application)
+
+
+#Функция запуска бота против фейкового API и прогона пользователей
+async def run(args, api, api_loop):
+    #Корутины API и пользователей выполняются в своем цикле событий, чтобы не делить его с ботом
+    def in_api_loop(coroutine):
+        return asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coroutine, api_loop))
+
+    driver = LoadDriver(api, args.users, args.iterations, args.think, args.timeout, args.double_tap)
+    bot = {'application': await start_bot(args, api)}
+    print(f"Бот готов за {lifecycle.ready_after:.2f} с")
+
+    #Перезапуск посреди теста: старый бот дообрабатывает полученное, новый прогревается и продолжает
+    async def restart():
+        await asyncio.sleep(args.restart_after)
+        started = time.perf_counter()
+        await stop_bot(bot['application'])
+        stopped = time.perf_counter() - started
+        bot['application'] = await start_bot(args, api)
+        print(f"Перезапуск: остановка {stopped:.2f} с, готовность нового бота {lifecycle.ready_after:.2f} с, "
+              f"без приема обновлений {time.perf_counter() - started:.2f} с")
+
+    restarter = asyncio.create_task(restart()) if args.restart_after else None
+    await in_api_loop(driver.run())
+    if restarter:
+        await restarter
+    await stop_bot(bot['application'])
+    return driver
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Нагрузочный тест бота против локального Bot API')
+    parser.add_argument('--users', type=int, default=20, help='виртуальных пользователей')
+    parser.add_argument('--iterations', type=int, default=1, help='проходов сценария на пользователя')
+    parser.add_argument('--think', type=float, default=1.0, help='пауза между шагами пользователя, с')
+    parser.add_argument('--timeout', type=float, default=30.0, help='сколько ждать ответа на шаг, с')
+    parser.add_argument('--mode', choices=['polling', 'webhook'], default='polling')
+    parser.add_argument('--port', type=int, default=8081, help='порт фейкового Bot API')
+    parser.add_argument('--webhook-port', type=int, default=8443, help='порт webhook бота')
+    parser.add_argument('--chat-limit', type=int, help='лимит Bot API: сообщений в секунду в один чат, сверх - 429')
+    parser.add_argument('--global-limit', type=int, help='лимит Bot API: сообщений в секунду всего, сверх - 429')
+    parser.add_argument('--db', help='файл БД (по умолчанию - новая БД во временной папке)')
+    parser.add_argument('--storage', choices=['sqlite', 'memory'], default='sqlite', help='движок хранилища (STORAGE_ENGINE)')
+    parser.add_argument('--double-tap', type=float, default=0, help='доля шагов с повторной отправкой того же обновления')
+    parser.add_argument('--restart-after', type=float, default=0, help='перезапустить бота через столько секунд (как по SIGTERM)')
+    parser.add_argument('--verbose', action='store_true', help='показывать журнал бота')
+    args = parser.parse_args()
+
+    # Настройки читаются при импорте config, поэтому БД и токен задаются до импорта бота
+    tmp_dir = None
+    if not args.db:
+        tmp_dir = tempfile.mkdtemp(prefix='load_test_')
+        args.db = os.path.join(tmp_dir, 'time_tracker.db')
+    os.environ['DB_PATH'] = args.db
+    os.environ['BOT_TOKEN'] = BOT_TOKEN
+    os.environ['STORAGE_ENGINE'] = args.storage
+
+    from fake_bot_api import FakeBotApi
+    from main import build_application
+    from lifecycle import lifecycle
+    from dedup import deduplicator
+    from dashboard import get_render_stats
+    from logging_setup import setup_logging
+
+    setup_logging()
+    if not args.verbose:
+        logging.disable(logging.INFO)
+
+    api_loop = asyncio.new_event_loop()
+    threading.Thread(target=api_loop.run_forever, name='fake_bot_api', daemon=True).start()
+    api = FakeBotApi(port=args.port, chat_limit=args.chat_limit, global_limit=args.global_limit)
+    asyncio.run_coroutine_threadsafe(api.start(), api_loop).result()
+
+    try:
+        driver = asyncio.run(run(args, api, api_loop))
+        print(f"Режим: {args.mode}, хранилище: {args.storage}, БД: {args.db}")
+        print(driver.report())
+        print("Повторы: " + ", ".join(f"{key} {value}" for key, value in deduplicator.snapshot().items())
+              + ", " + ", ".join(f"render_{key} {value}" for key, value in get_render_stats().items()))
+    finally:
+        asyncio.run_coroutine_threadsafe(api.stop(), api_loop).result()
+        if tmp_dir:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
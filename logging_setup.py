@@ -0,0 +1,137 @@
+"""
+Настройка журнала бота: одна на процесс, вызывается при запуске (main.py, load_test.py, процессы рисования).
+
+Записи из обработчиков и потоков только кладутся в очередь (QueueHandler), а форматирование,
+запись в файл с ротацией и вывод в консоль выполняет отдельный поток (QueueListener) - цикл
+событий не ждет диска. LOG_FORMAT=json - одна запись JSON на строку с полями user_id (пользователь
+обновления, которое сейчас обрабатывается), handler (функция, которая пишет) и latency_ms (сколько
+прошло от начала обработки обновления). Частые INFO с одного места кода прореживаются:
+не больше LOG_INFO_PER_SECOND в секунду, о пропущенных пишется отдельная запись.
+"""
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+from config import LOG_LEVEL, LOG_FORMAT, LOG_FILE, LOG_FILE_MAX_MB, LOG_FILE_BACKUPS, LOG_INFO_PER_SECOND
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+CONTEXT_GROUP = -3  # Раньше всех обработчиков бота, в том числе подавления повторов (-2)
+
+# Обновление, которое сейчас обрабатывается: (user_id, время начала). В потоки asyncio.to_thread копируется само
+_update_context = contextvars.ContextVar('update_context', default=None)
+_listener = None
+
+
+class ContextFilter(logging.Filter):
+    """Добавляет к записи user_id, handler и latency_ms (если их не передали в extra)"""
+    def filter(self, record):
+        context = _update_context.get()
+        if not hasattr(record, 'user_id'):
+            record.user_id = context[0] if context else None
+        if not hasattr(record, 'handler'):
+            record.handler = record.funcName
+        if not hasattr(record, 'latency_ms'):
+            record.latency_ms = round((time.monotonic() - context[1]) * 1000, 1) if context else None
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Прореживает INFO и ниже: с одного места кода не больше limit записей в секунду"""
+    def __init__(self, limit: int = LOG_INFO_PER_SECOND):
+        super().__init__()
+        self.limit = limit
+        self._sites = {}  # (файл, строка) -> [секунда, записей за секунду, пропущено]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if self.limit <= 0 or record.levelno > logging.INFO:
+            return True
+        site = (record.pathname, record.lineno)
+        second = int(record.created)
+        with self._lock:
+            state = self._sites.setdefault(site, [second, 0, 0])
+            dropped = 0
+            if state[0] != second:
+                dropped = state[2]
+                state[:] = [second, 0, 0]
+            state[1] += 1
+            passed = state[1] <= self.limit
+            if not passed:
+                state[2] += 1
+        if dropped:
+            # Сообщение о пропуске - с другого места кода, сюда же оно не попадет
+            logging.getLogger(record.name).info(
+                f"Пропущено {dropped} похожих записей ({record.filename}:{record.lineno})", extra={'sampled': dropped}
+            )
+        return passed
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись - одна строка JSON"""
+    FIELDS = ('user_id', 'handler', 'latency_ms', 'sampled')
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        entry.update({field: getattr(record, field) for field in self.FIELDS if getattr(record, field, None) is not None})
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+#Функция настройки журнала процесса (повторный вызов ничего не меняет)
+def setup_logging(log_file: str = LOG_FILE, level: str = LOG_LEVEL):
+    global _listener
+    if _listener is not None:
+        return
+    formatter = JsonFormatter() if LOG_FORMAT == 'json' else logging.Formatter(TEXT_FORMAT)
+    handlers = [logging.StreamHandler()]
+    if log_file:
+        handlers.append(logging.handlers.RotatingFileHandler(
+            log_file, maxBytes=int(LOG_FILE_MAX_MB * 1024 * 1024), backupCount=LOG_FILE_BACKUPS, encoding='utf-8'
+        ))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    queue_handler = logging.handlers.QueueHandler(queue.SimpleQueue())
+    # Фильтры выполняются в пишущем потоке: там известен контекст обновления
+    queue_handler.addFilter(ContextFilter())
+    queue_handler.addFilter(SamplingFilter())
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+#Функция остановки: дописывает оставшиеся в очереди записи
+def stop_logging():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+#Функция подключения к приложению: записи во время обработки обновления получают user_id и latency_ms
+def track_updates(application):
+    from telegram import Update
+    from telegram.ext import TypeHandler
+
+    async def _on_update(update: Update, context):
+        user = update.effective_user
+        _update_context.set((user.id if user else None, time.monotonic()))
+
+    application.add_handler(TypeHandler(Update, _on_update), group=CONTEXT_GROUP)
@@ -0,0 +1,160 @@
+"""
+Контроль задержки цикла событий.
+
+Пульс (корутина в цикле бота) просыпается каждые LOOP_LAG_INTERVAL секунд и меряет, насколько
+позже запланированного он проснулся - это задержка цикла. Сторожевой поток следит за временем
+последнего пульса: если цикл молчит дольше LOOP_STALL_THRESHOLD, он снимает стек потока цикла
+(то есть место, где цикл сейчас заблокирован) и запоминает обновление Telegram, которое
+обрабатывалось последним. Длительность зависания дописывается, когда цикл проснется.
+"""
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from datetime import datetime, timezone
+from telegram import Update
+from telegram.ext import Application, ContextTypes, TypeHandler
+from config import LOOP_LAG_INTERVAL, LOOP_STALL_THRESHOLD, LOOP_LAG_WINDOW, LOOP_LAG_REPORT_INTERVAL
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+STACK_DEPTH = 12  # Сколько кадров стека хранить для зависания
+STALLS_KEPT = 20  # Сколько последних зависаний хранить
+
+
+#Функция краткого описания обновления Telegram для отчета о зависании
+def describe_update(update: Update):
+    user = update.effective_user
+    who = f"user_id={user.id}" if user else "без пользователя"
+    if update.callback_query:
+        what = f"кнопка {update.callback_query.data!r}"
+    elif update.message and update.message.text:
+        what = f"сообщение {update.message.text[:30]!r}"
+    elif update.message and update.message.document:
+        what = "файл"
+    else:
+        what = "другое обновление"
+    return f"update {update.update_id} ({who}): {what}"
+
+
+#Функция значения перцентиля по отсортированному списку
+def _percentile(values, share):
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+class LoopMonitor:
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL, threshold: float = LOOP_STALL_THRESHOLD,
+                 window: float = LOOP_LAG_WINDOW):
+        self._interval = interval
+        self._threshold = threshold
+        self._lags = deque(maxlen=max(1, int(window / interval)))  # Задержки за последние window секунд
+        self.stalls = deque(maxlen=STALLS_KEPT)
+        self.stalls_total = 0
+        self._lock = threading.Lock()
+        self._beat = None  # Время (monotonic), на которое запланировано следующее пробуждение пульса
+        self._stall = None  # Зависание, которое идет прямо сейчас
+        self._current = None  # (время начала, описание) последнего обновления
+        self._loop_thread = None
+        self._task = None
+        self._stop = threading.Event()
+
+    #Функция подключения к приложению: отметка обновлений, запуск пульса и периодического лога
+    def start(self, application: Application):
+        # Группа -1 обрабатывается раньше остальных и не мешает им
+        application.add_handler(TypeHandler(Update, self._on_update), group=-1)
+        application.job_queue.run_once(self._begin, when=0, name='loop_monitor')
+        application.job_queue.run_repeating(
+            self._report_job, interval=LOOP_LAG_REPORT_INTERVAL, first=LOOP_LAG_REPORT_INTERVAL, name='loop_lag_report'
+        )
+
+    async def _begin(self, context: ContextTypes.DEFAULT_TYPE):
+        self._task = asyncio.create_task(self._heartbeat())
+        threading.Thread(target=self._watch, name='loop_monitor', daemon=True).start()
+        logging.info(f"Контроль цикла событий запущен: пульс {self._interval} с, порог зависания {self._threshold} с")
+
+    async def _on_update(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        self._current = (time.monotonic(), describe_update(update))
+
+    #Пульс: измерение задержки цикла
+    async def _heartbeat(self):
+        self._loop_thread = threading.get_ident()
+        while True:
+            self._beat = time.monotonic() + self._interval
+            await asyncio.sleep(self._interval)
+            lag = max(0.0, time.monotonic() - self._beat)
+            self._lags.append(lag)
+
+            with self._lock:
+                stall, self._stall = self._stall, None
+            if stall is not None:
+                stall['duration'] = lag
+                self.stalls.append(stall)
+                self.stalls_total += 1
+                logging.warning(
+                    f"Цикл событий был заблокирован {lag:.2f} с в {stall['where']}; "
+                    f"последнее обновление: {stall['update']}\n{stall['stack']}"
+                )
+
+    #Сторожевой поток: снимок стека цикла во время зависания
+    def _watch(self):
+        while not self._stop.wait(self._threshold / 2):
+            beat = self._beat
+            if beat is None or time.monotonic() - beat < self._threshold:
+                continue
+            with self._lock:
+                if self._stall is not None:
+                    continue  # Это зависание уже записано
+                frame = sys._current_frames().get(self._loop_thread)
+                if frame is None:
+                    continue
+                frames = traceback.extract_stack(frame)[-STACK_DEPTH:]
+                self._stall = {
+                    'at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                    'where': self._where(frames),
+                    'update': self._describe_current(),
+                    'stack': ''.join(traceback.format_list(frames)),
+                    'duration': None,
+                }
+
+    #Функция поиска ближайшего к месту блокировки кадра из кода бота
+    @staticmethod
+    def _where(frames):
+        for frame in reversed(frames):
+            if frame.filename.startswith(PROJECT_DIR) and not frame.filename.endswith('loop_monitor.py'):
+                return f"{os.path.basename(frame.filename)}:{frame.lineno} {frame.name}"
+        last = frames[-1]
+        return f"{os.path.basename(last.filename)}:{last.lineno} {last.name}"
+
+    def _describe_current(self):
+        if self._current is None:
+            return "нет"
+        started, description = self._current
+        return f"{description}, начато {time.monotonic() - started:.1f} с назад"
+
+    #Функция сводки: перцентили задержки за окно и число зависаний
+    def snapshot(self):
+        lags = sorted(self._lags)
+        if not lags:
+            return {'samples': 0, 'p50': 0.0, 'p95': 0.0, 'p99': 0.0, 'max': 0.0, 'stalls': self.stalls_total}
+        return {
+            'samples': len(lags),
+            'p50': _percentile(lags, 0.50),
+            'p95': _percentile(lags, 0.95),
+            'p99': _percentile(lags, 0.99),
+            'max': lags[-1],
+            'stalls': self.stalls_total,
+        }
+
+    async def _report_job(self, context: ContextTypes.DEFAULT_TYPE):
+        stats = self.snapshot()
+        logging.info(
+            f"Задержка цикла событий за {stats['samples'] * self._interval:.0f} с: "
+            f"p50={stats['p50'] * 1000:.1f} мс, p95={stats['p95'] * 1000:.1f} мс, "
+            f"p99={stats['p99'] * 1000:.1f} мс, max={stats['max'] * 1000:.1f} мс, зависаний всего: {stats['stalls']}"
+        )
+
+
+loop_monitor = LoopMonitor()
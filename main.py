@@ -2,28 +2,45 @@ import logging
 from telegram.ext import (
     ApplicationBuilder, CommandHandler, ConversationHandler, MessageHandler, filters, CallbackQueryHandler
 )
-from config import BOT_TOKEN
-from database import init_db
+from config import BOT_TOKEN, MEMORY_TRACE_ON_START
+from lifecycle import lifecycle
+from persistence import SQLitePersistence
+from jobs import register_jobs
+from session_watchdog import session_watchdog
+from dedup import deduplicator
+from logging_setup import setup_logging, track_updates
+from loop_monitor import loop_monitor
+from memory_report import start_tracing
+from outbound import OutboundScheduler
 from handlers import (
     State, start, about, add_task_handler, receive_task_name, delete_task_handler, receive_task_for_deletion,
     list_tasks_handler, help_handler, start_session_handler, receive_task_for_start_session,
     stop_session_handler, active_session_handler, stats_handler, handle_stats_selection, handler_task_number_stat,
     menu_handler, back_menu_handler, cancel_handler, cancel_start_handler, cancel_stat_task_handler,
-    cancel_dashboard_handler,)
+    cancel_dashboard_handler, import_handler, receive_import_file, cancel_import_handler,
+    task_page_handler, task_search_handler, receive_task_search, max_session_handler, dashboard_profile_handler,
+    goal_handler, admin_report_handler, memory_handler, undo_delete_handler,)
 
-# Настройка логирования
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
 
-# Инициализация базы данных
-init_db()
+# Текст для поиска задачи (кнопки reply-клавиатуры поиском не считаем)
+TASK_SEARCH_FILTER = filters.TEXT & ~filters.COMMAND & ~filters.Text(['▶️', '⏹️', '🔄', '⚙️'])
 
-# Функция для запуска бота
-if __name__ == '__main__':
+# Функция сборки приложения со всеми обработчиками и фоновыми задачами
+def build_application(token: str = BOT_TOKEN, base_url: str = None):
+    """base_url - другой адрес Bot API (например, локальный fake_bot_api.py для нагрузочного теста)"""
     # Создаем объект Application и передаем ему токен бота
-    application = ApplicationBuilder().token(BOT_TOKEN).build()
+    builder = (
+        ApplicationBuilder().token(token)
+        .persistence(SQLitePersistence())
+        .rate_limiter(OutboundScheduler())
+        # Прогрев до первого getUpdates и аккуратная остановка по SIGTERM
+        .post_init(lifecycle.startup)
+        .post_stop(lifecycle.stopped)
+        .post_shutdown(lifecycle.shutdown)
+    )
+    if base_url:
+        builder = builder.base_url(f"{base_url}/bot").base_file_url(f"{base_url}/file/bot")
+    application = builder.build()
 
     # ConversationHandler для добавления задачи
     add_task_conv = ConversationHandler(
@@ -36,6 +53,8 @@ if __name__ == '__main__':
         ],
     },
     fallbacks=[],
+    name='add_task_conv',
+    persistent=True,
     )
 
     # ConversationHandler для удаления задачи
@@ -45,10 +64,19 @@ if __name__ == '__main__':
         states={
             State.WAITING_FOR_TASK_NUMBER: [
                 CallbackQueryHandler(receive_task_for_deletion, pattern=r"^delete_\d+$"),
+                CallbackQueryHandler(task_page_handler, pattern=r"^pg_delete_"),
+                CallbackQueryHandler(task_search_handler, pattern="^search_delete$"),
+                CallbackQueryHandler(cancel_handler, pattern="cancel"),
+            ],
+            State.WAITING_FOR_TASK_SEARCH: [
+                MessageHandler(TASK_SEARCH_FILTER, receive_task_search),
                 CallbackQueryHandler(cancel_handler, pattern="cancel"),
             ],
         },
-        fallbacks=[]
+        fallbacks=[],
+        name='delete_task_conv',
+        persistent=True,
+        allow_reentry=True,  # Повторное "Удалить задачу" посреди выбора или поиска начинает выбор заново
     )
 
     # ConversationHandler для запуска сессии
@@ -57,10 +85,19 @@ if __name__ == '__main__':
         states={
             State.WAITING_FOR_TASK_NUMBER: [
                 CallbackQueryHandler(receive_task_for_start_session, pattern=r"^start_\d+$"),
+                CallbackQueryHandler(task_page_handler, pattern=r"^pg_start_"),
+                CallbackQueryHandler(task_search_handler, pattern="^search_start$"),
                 CallbackQueryHandler(cancel_start_handler, pattern="cancel_start"),
             ],
+            State.WAITING_FOR_TASK_SEARCH: [
+                MessageHandler(TASK_SEARCH_FILTER, receive_task_search),
+                CallbackQueryHandler(cancel_start_handler, pattern="^cancel_start$"),
+            ],
         },
-        fallbacks=[]
+        fallbacks=[],
+        name='start_session_conv',
+        persistent=True,
+        allow_reentry=True,  # ▶️ посреди выбора или поиска задачи открывает список заново
     )
 
     # ConversationHandler для получения статистики по задаче
@@ -69,12 +106,33 @@ if __name__ == '__main__':
         states={
             State.WAITING_FOR_TASK_NUMBER: [
                 CallbackQueryHandler(handler_task_number_stat, pattern=r"^stat_\d+$"),
+                CallbackQueryHandler(task_page_handler, pattern=r"^pg_stat_"),
+                CallbackQueryHandler(task_search_handler, pattern="^search_stat$"),
                 CallbackQueryHandler(cancel_stat_task_handler, pattern="stat"),
             ],
+            State.WAITING_FOR_TASK_SEARCH: [
+                MessageHandler(TASK_SEARCH_FILTER, receive_task_search),
+                CallbackQueryHandler(cancel_stat_task_handler, pattern="^stat$"),
+            ],
         },
         fallbacks=[],
         name='stats_task_conv',  # Имя для логирования
-        persistent=False,  # Сохранять состояние между перезапусками
+        persistent=True,  # Сохранять состояние между перезапусками
+        allow_reentry=True,  # Повторный выбор "Статистика по задаче" начинает выбор заново
+    )
+
+    # ConversationHandler для импорта истории из CSV
+    import_conv = ConversationHandler(
+        entry_points=[CommandHandler('import', import_handler)],
+        states={
+            State.WAITING_FOR_IMPORT_FILE: [
+                MessageHandler(filters.Document.ALL, receive_import_file),
+                CallbackQueryHandler(cancel_import_handler, pattern="^cancel_import$"),
+            ],
+        },
+        fallbacks=[],
+        name='import_conv',
+        persistent=True,
     )
 
     logging.info(f'ConversationHandler stats_task_conv зарегистрирован.')
@@ -84,9 +142,11 @@ if __name__ == '__main__':
     application.add_handler(CommandHandler('start', start))
     application.add_handler(add_task_conv)
     application.add_handler(delete_task_conv)
+    application.add_handler(CallbackQueryHandler(undo_delete_handler, pattern=r'^undo_delete_\d+$'))
     application.add_handler(CallbackQueryHandler(list_tasks_handler, pattern='list_tasks'))
     application.add_handler(CommandHandler('help', help_handler))
     application.add_handler(start_session_conv)
+    application.add_handler(import_conv)
     application.add_handler(CallbackQueryHandler(stats_handler, pattern='stats'))
     application.add_handler(CallbackQueryHandler(back_menu_handler, pattern='back_menu'))
     application.add_handler(CallbackQueryHandler(cancel_dashboard_handler, pattern='cancel_dashboard'))
@@ -95,6 +155,35 @@ if __name__ == '__main__':
     application.add_handler(MessageHandler(filters.Text('⚙️'), menu_handler))
     application.add_handler(CallbackQueryHandler(handle_stats_selection))
     application.add_handler(CommandHandler('about', about))
+    application.add_handler(CommandHandler('max_session', max_session_handler))
+    application.add_handler(CommandHandler('dashboard_profile', dashboard_profile_handler))
+    application.add_handler(CommandHandler('goal', goal_handler))
+    application.add_handler(CommandHandler('admin_report', admin_report_handler))
+    application.add_handler(CommandHandler('memory', memory_handler))
+
+    # Фоновые задачи в тихие часы
+    register_jobs(application)
+
+    # Восстанавливаем таймеры автоостановки забытых сессий
+    session_watchdog.start(application)
+
+    # Контроль задержки цикла событий и поиск блокирующих вызовов
+    track_updates(application)
+    loop_monitor.start(application)
+    deduplicator.start(application)
+    return application
+
+
+# Функция для запуска бота
+if __name__ == '__main__':
+    setup_logging()
+    # Миграции базы данных (процессы рисования тоже импортируют этот модуль - поэтому только здесь)
+    lifecycle.migrate()
+    application = build_application()
+
+    # Отчет о памяти: tracemalloc с момента запуска, если это задано в настройках
+    if MEMORY_TRACE_ON_START:
+        start_tracing()
 
-    # Запускаем бота
+    # Запускаем бота: обновления забираются после прогрева, SIGTERM/SIGINT - остановка без потери полученных обновлений
     application.run_polling()
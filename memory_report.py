@@ -0,0 +1,78 @@
+"""
+Отчет о памяти бота для администраторов (/memory).
+
+RSS основного процесса и процессов рисования, кеш картинок и - если включен tracemalloc -
+строки кода, выделившие больше всего памяти, и прирост с прошлого отчета. tracemalloc
+замедляет выделение памяти, поэтому включается по команде (/memory start) или MEMORY_TRACE_ON_START.
+"""
+import resource
+import tracemalloc
+from config import MEMORY_TRACE_FRAMES, MEMORY_REPORT_TOP
+from dashboard import plt, get_cache_stats
+from render_workers import render_workers, get_rss
+
+# Фильтр служебных выделений: импорт модулей и сам tracemalloc
+TRACE_FILTERS = (
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+    tracemalloc.Filter(False, tracemalloc.__file__),
+)
+
+_previous_snapshot = None
+
+
+def start_tracing():
+    global _previous_snapshot
+    _previous_snapshot = None
+    tracemalloc.start(MEMORY_TRACE_FRAMES)
+
+
+def stop_tracing():
+    global _previous_snapshot
+    _previous_snapshot = None
+    tracemalloc.stop()
+
+
+#Функция форматирования размера в мегабайтах
+def _mb(size: float):
+    return f"{size / 2**20:.1f} МБ"
+
+
+#Функция текста отчета (снимок tracemalloc - тяжелая операция, вызывать через asyncio.to_thread)
+def build_memory_report(top: int = MEMORY_REPORT_TOP):
+    global _previous_snapshot
+    cache_entries, cache_bytes = get_cache_stats()
+    lines = [
+        "🧠 Память бота",
+        f"Основной процесс: RSS {_mb(get_rss())}, пик {_mb(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024)}, "
+        f"открытых фигур: {len(plt.get_fignums())}",
+        f"Кеш картинок: {cache_entries} шт., {_mb(cache_bytes)}",
+    ]
+
+    for pid, stats in render_workers.processes.items():
+        lines.append(
+            f"Процесс рисования {pid}: RSS {_mb(stats['rss'])}, картинок {stats['renders']}, фигур {stats['figures']}"
+        )
+    if render_workers.recycles:
+        lines.append("Перезапуски процессов рисования: " + ", ".join(
+            f"{reason} - {count}" for reason, count in render_workers.recycles.items()
+        ))
+
+    if not tracemalloc.is_tracing():
+        lines.append("\ntracemalloc выключен. Включить: /memory start")
+        return "\n".join(lines)
+
+    current, peak = tracemalloc.get_traced_memory()
+    snapshot = tracemalloc.take_snapshot().filter_traces(TRACE_FILTERS)
+    lines += ["", f"tracemalloc: сейчас {_mb(current)}, пик {_mb(peak)}", "Больше всего памяти:"]
+    for stat in snapshot.statistics('lineno')[:top]:
+        frame = stat.traceback[0]
+        lines.append(f"{_mb(stat.size)} ({stat.count} объектов) - {frame.filename}:{frame.lineno}")
+
+    if _previous_snapshot is not None:
+        lines.append("Прирост с прошлого отчета:")
+        for stat in snapshot.compare_to(_previous_snapshot, 'lineno')[:top]:
+            frame = stat.traceback[0]
+            lines.append(f"{stat.size_diff / 2**20:+.2f} МБ ({stat.count_diff:+} объектов) - {frame.filename}:{frame.lineno}")
+    _previous_snapshot = snapshot
+    return "\n".join(lines)
@@ -0,0 +1,350 @@
+"""
+Хранилище в памяти процесса (STORAGE_ENGINE=memory) - для тестов и бенчмарков без диска.
+
+Данные разложены по пользователям и проиндексированы под запросы бота: задачи пользователя,
+его сессии по дням, итоги по дням и часам и показатели регулярности обновляются при каждой
+остановке сессии, поэтому статистика и дашборд не проходят по всей истории. Поведение
+совпадает с SQLite (database.py), включая мелочи вроде LIKE без учета регистра только для
+латиницы - это проверяет storage_conformance.py. Данные живут, пока жив процесс.
+"""
+import itertools
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from config import MAX_SESSION_HOURS, TASK_UNDO_MINUTES, TASK_PURGE_CHUNK_ROWS
+from database import seconds_to_hms, _format_daily_week, _split_by_hour
+from storage import Storage
+import metrics
+
+
+#Функция текущего времени UTC в формате CURRENT_TIMESTAMP SQLite
+def _now():
+    return datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+
+
+#Функция длительности сессии в секундах (как strftime('%s', end) - strftime('%s', start))
+def _seconds(start_time: str, end_time: str):
+    return int((datetime.fromisoformat(end_time) - datetime.fromisoformat(start_time)).total_seconds())
+
+
+#Функция проверки начала названия как у LIKE 'prefix%' в SQLite: регистр не важен только для ASCII
+def _like_prefix(name: str, prefix: str):
+    if len(name) < len(prefix):
+        return False
+    return all(
+        a == b or (a.isascii() and b.isascii() and a.lower() == b.lower()) for a, b in zip(name, prefix)
+    )
+
+
+class MemoryStorage(Storage):
+    def __init__(self):
+        self._lock = threading.RLock()  # Обработчики зовут хранилище и из потоков (импорт, дашборд)
+        self._task_ids = itertools.count(1)
+        self._session_ids = itertools.count(1)
+        self._tasks = {}  # task_id -> задача
+        self._user_tasks = defaultdict(dict)  # user_id -> {task_id: задача}
+        self._sessions = defaultdict(dict)  # user_id -> {session_id: сессия}
+        self._day_sessions = defaultdict(lambda: defaultdict(list))  # user_id -> день начала -> сессии
+        self._active = {}  # user_id -> активная сессия
+        self._day_seconds = defaultdict(lambda: defaultdict(Counter))  # user_id -> день -> {task_id: секунды}
+        self._hour_seconds = defaultdict(Counter)  # user_id -> {(task_id, 'HH'): секунды}
+        self._metrics = defaultdict(dict)  # user_id -> {None или task_id: состояние metrics}
+        self._settings = defaultdict(dict)  # user_id -> настройки
+        self._versions = Counter()  # user_id -> номер изменения сессий (для кеша дашборда)
+        self._deleted = {}  # task_id -> (время удаления, задача, завершенные сессии) - пока удаление можно отменить
+
+    # --- Задачи ---
+
+    def _create_task(self, user_id: int, task_name: str):
+        task = {'id': next(self._task_ids), 'user_id': user_id, 'name': task_name, 'created_at': _now(),
+                'last_used_at': _now(), 'weekly_goal_hours': None}
+        self._tasks[task['id']] = task
+        self._user_tasks[user_id][task['id']] = task
+        return task
+
+    def add_task(self, user_id: int, task_name: str):
+        with self._lock:
+            self._create_task(user_id, task_name)
+
+    def delete_task(self, user_id: int, task_id: int):
+        with self._lock:
+            task = self._user_tasks[user_id].pop(task_id, None)
+            if task is None:
+                return False
+            del self._tasks[task_id]
+
+            # Как мягкое удаление в SQLite: задача и ее завершенные сессии ждут окончательного удаления,
+            # активная сессия удаляется сразу, итоги и показатели считаются без задачи
+            sessions = self._sessions[user_id]
+            removed = [sessions.pop(session['id']) for session in list(sessions.values()) if session['task_id'] == task_id]
+            by_day = self._day_sessions[user_id]
+            for day in list(by_day):
+                by_day[day] = [session for session in by_day[day] if session['task_id'] != task_id]
+            active = self._active.get(user_id)
+            if active is not None and active['task_id'] == task_id:
+                del self._active[user_id]
+            for day, totals in list(self._day_seconds[user_id].items()):
+                totals.pop(task_id, None)
+                if not totals:
+                    del self._day_seconds[user_id][day]
+            hours = self._hour_seconds[user_id]
+            for key in [key for key in hours if key[0] == task_id]:
+                del hours[key]
+            self._deleted[task_id] = (time.monotonic(), task, [session for session in removed if not session['is_active']])
+            self._rebuild_metrics(user_id)
+            self._versions[user_id] += 1
+            return True
+
+    def restore_task(self, user_id: int, task_id: int, undo_minutes: int = TASK_UNDO_MINUTES):
+        with self._lock:
+            deleted = self._deleted.get(task_id)
+            if deleted is None or deleted[1]['user_id'] != user_id or time.monotonic() - deleted[0] >= undo_minutes * 60:
+                return False
+            del self._deleted[task_id]
+            _, task, sessions = deleted
+            self._tasks[task_id] = task
+            self._user_tasks[user_id][task_id] = task
+            for session in sessions:
+                self._sessions[user_id][session['id']] = session
+                self._day_sessions[user_id][session['start_time'][:10]].append(session)
+                self._add_totals(session)
+            self._rebuild_metrics(user_id)
+            self._versions[user_id] += 1
+            return True
+
+    def purge_deleted_tasks(self, undo_minutes: int = TASK_UNDO_MINUTES, chunk_rows: int = TASK_PURGE_CHUNK_ROWS):
+        with self._lock:
+            expired = [task_id for task_id, (deleted_at, _, _) in self._deleted.items()
+                       if time.monotonic() - deleted_at >= undo_minutes * 60]
+            rows = sum(len(self._deleted.pop(task_id)[2]) for task_id in expired)
+        return len(expired), rows
+
+    def get_tasks(self, user_id: int):
+        with self._lock:
+            tasks = sorted(self._user_tasks[user_id].values(), key=lambda task: (task['created_at'], task['id']))
+            return [{'id': task['id'], 'name': task['name']} for task in tasks]
+
+    def get_task(self, user_id: int, task_id: int):
+        task = self._user_tasks[user_id].get(task_id)
+        return {'id': task['id'], 'name': task['name']} if task else None
+
+    def get_tasks_page(self, user_id: int, limit: int, cursor_key=None, backward: bool = False, prefix: str = None):
+        with self._lock:
+            tasks = [
+                task for task in self._user_tasks[user_id].values()
+                if (not prefix or _like_prefix(task['name'], prefix))
+                and (cursor_key is None or ((task['last_used_at'], task['id']) > tuple(cursor_key) if backward
+                                            else (task['last_used_at'], task['id']) < tuple(cursor_key)))
+            ]
+        tasks.sort(key=lambda task: (task['last_used_at'], task['id']), reverse=not backward)
+        page = [{'id': task['id'], 'name': task['name'], 'last_used_at': task['last_used_at']} for task in tasks[:limit]]
+        if backward:
+            page.reverse()
+        return page, len(tasks) > limit
+
+    # --- Сессии ---
+
+    def _add_session(self, user_id: int, task_id: int, start_time: str, end_time: str = None):
+        session = {'id': next(self._session_ids), 'task_id': task_id, 'user_id': user_id,
+                   'start_time': start_time, 'end_time': end_time, 'is_active': int(end_time is None)}
+        self._sessions[user_id][session['id']] = session
+        self._day_sessions[user_id][start_time[:10]].append(session)
+        self._versions[user_id] += 1
+        if end_time is not None:
+            self._add_totals(session)
+        return session
+
+    #Функция учета завершенной сессии в итогах по дням и часам
+    def _add_totals(self, session: dict):
+        user_id, task_id = session['user_id'], session['task_id']
+        self._day_seconds[user_id][session['start_time'][:10]][task_id] += _seconds(session['start_time'], session['end_time'])
+        for hour, seconds in _split_by_hour(session['start_time'], session['end_time']):
+            self._hour_seconds[user_id][(task_id, hour)] += seconds
+
+    def start_session(self, user_id: int, task_id: int):
+        with self._lock:
+            if user_id in self._active:
+                return False
+            if task_id not in self._user_tasks[user_id]:
+                return None  # Задача не найдена или удалена
+            self._active[user_id] = self._add_session(user_id, task_id, _now())
+            self._tasks[task_id]['last_used_at'] = _now()
+            return True
+
+    def stop_session(self, user_id: int, session_id: int = None, end_time: str = None):
+        with self._lock:
+            session = self._active.get(user_id)
+            if session is None or (session_id is not None and session['id'] != session_id):
+                return False
+            del self._active[user_id]
+            session.update(end_time=end_time or _now(), is_active=0)
+            self._add_totals(session)
+            self._versions[user_id] += 1
+
+            seconds = _seconds(session['start_time'], session['end_time'])
+            day = session['start_time'][:10]
+            for key in (None, session['task_id']):
+                state = self._metrics[user_id].setdefault(key, metrics.empty_state())
+                if not metrics.advance(state, day, seconds):
+                    # Сессия из прошлого - серии могли срастись, считаем заново
+                    self._rebuild_metrics(user_id)
+                    break
+            return {
+                'name': self._tasks[session['task_id']]['name'],
+                'time_diff': time.strftime('%H:%M:%S', time.gmtime(seconds)),
+            }
+
+    def get_active_session(self, user_id: int):
+        session = self._active.get(user_id)
+        if session is None:
+            return None
+        return {'id': session['id'], 'name': self._tasks[session['task_id']]['name'], 'start_time': session['start_time']}
+
+    def get_active_sessions_with_limits(self):
+        with self._lock:
+            return [
+                {'id': session['id'], 'user_id': user_id, 'start_time': session['start_time'],
+                 'max_session_hours': self.get_max_session_hours(user_id)}
+                for user_id, session in self._active.items()
+            ]
+
+    def import_sessions(self, user_id: int, rows):
+        imported = 0
+        created_tasks = 0
+        with self._lock:
+            task_ids = {task['name']: task['id'] for task in sorted(self._user_tasks[user_id].values(), key=lambda t: t['id'])}
+            for task_name, start_time, end_time in rows:
+                task_id = task_ids.get(task_name)
+                if task_id is None:
+                    task_id = task_ids[task_name] = self._create_task(user_id, task_name)['id']
+                    created_tasks += 1
+                self._add_session(user_id, task_id, start_time, end_time)
+                imported += 1
+            self._rebuild_metrics(user_id)
+
+        logging.info(f"Импорт для пользователя {user_id}: сессий {imported}, новых задач {created_tasks}")
+        return {'imported': imported, 'created_tasks': created_tasks}
+
+    def get_recently_active_users(self, days: int):
+        since = (datetime.utcnow() - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+        with self._lock:
+            return [
+                user_id for user_id, by_day in self._day_sessions.items()
+                if any(session['start_time'] >= since for day in by_day if day >= since[:10] for session in by_day[day])
+            ]
+
+    # --- Статистика ---
+
+    #Функция суммы завершенных сессий с началом не раньше since (строковое сравнение, как в SQLite)
+    def _seconds_since(self, user_id: int, since: str, task_id: int = None):
+        total = 0
+        for day, totals in self._day_seconds[user_id].items():
+            if day > since[:10]:
+                total += totals.get(task_id, 0) if task_id is not None else sum(totals.values())
+        for session in self._day_sessions[user_id].get(since[:10], []):
+            if session['end_time'] is not None and session['start_time'] >= since \
+                    and (task_id is None or session['task_id'] == task_id):
+                total += _seconds(session['start_time'], session['end_time'])
+        return total
+
+    def get_total_stat_last_7_days(self, user_id: int):
+        with self._lock:
+            total = self._seconds_since(user_id, (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d %H:%M:%S'))
+        return {'total_time': seconds_to_hms(total), 'avg_time': seconds_to_hms(int(total / 7))}
+
+    def get_task_stat_last_7_days(self, user_id: int, task_id: int):
+        with self._lock:
+            total = self._seconds_since(
+                user_id, (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d %H:%M:%S'), task_id
+            )
+        return {'total_time_task': seconds_to_hms(total), 'avg_time_task': seconds_to_hms(int(total / 7))}
+
+    def get_stat_daily_day(self, user_id: int):
+        end_date = datetime.now()
+        stats = self.get_daily_seconds(user_id, (end_date - timedelta(days=7)).strftime('%Y-%m-%d'))
+        return _format_daily_week(stats, end_date)
+
+    def get_stat_task_daily_day(self, user_id: int, task_id: int):
+        end_date = datetime.now()
+        stats = self.get_daily_seconds(user_id, (end_date - timedelta(days=7)).strftime('%Y-%m-%d'), task_id)
+        return _format_daily_week(stats, end_date)
+
+    def get_daily_seconds(self, user_id: int, start_day: str, task_id: int = None, from_snapshot: bool = False):
+        with self._lock:
+            if task_id is None:
+                return {day: sum(totals.values()) for day, totals in self._day_seconds[user_id].items() if day >= start_day}
+            return {
+                day: totals[task_id] for day, totals in self._day_seconds[user_id].items()
+                if day >= start_day and task_id in totals
+            }
+
+    #Функция пересчета показателей регулярности пользователя с нуля по итогам дней
+    def _rebuild_metrics(self, user_id: int):
+        by_key = defaultdict(dict)
+        for day, totals in self._day_seconds[user_id].items():
+            by_key[None][day] = sum(totals.values())
+            for task_id, seconds in totals.items():
+                by_key[task_id][day] = seconds
+        self._metrics[user_id] = {key: metrics.compute(days) for key, days in by_key.items()}
+
+    def get_consistency_metrics(self, user_id: int, task_id: int = None):
+        with self._lock:
+            state = self._metrics[user_id].get(task_id)
+            if task_id is None:
+                goal = self._settings[user_id].get('weekly_goal_hours')
+            else:
+                task = self._user_tasks[user_id].get(task_id)
+                goal = task['weekly_goal_hours'] if task else None
+            return metrics.summarize(dict(state) if state else None, goal, datetime.utcnow().date())
+
+    def set_weekly_goal(self, user_id: int, hours: float, task_id: int = None):
+        with self._lock:
+            if task_id is None:
+                self._settings[user_id]['weekly_goal_hours'] = hours or None
+            elif task_id in self._user_tasks[user_id]:
+                self._user_tasks[user_id][task_id]['weekly_goal_hours'] = hours or None
+
+    # --- Дашборд ---
+
+    def get_dashboard_data(self, user_id: int, from_snapshot: bool = False):
+        today = datetime.utcnow().date()
+        with self._lock:
+            day_seconds = self._day_seconds[user_id]
+            daily = []
+            for offset in range(6, -1, -1):
+                day = (today - timedelta(days=offset)).isoformat()
+                daily.append((day, sum(day_seconds[day].values()) if day in day_seconds else 0))
+
+            by_name = Counter()
+            for totals in day_seconds.values():
+                for task_id, seconds in totals.items():
+                    by_name[self._tasks[task_id]['name']] += seconds
+            tasks = sorted(by_name.items(), key=lambda item: item[1], reverse=True)
+
+            by_hour = Counter()
+            for (_, hour), seconds in self._hour_seconds[user_id].items():
+                by_hour[hour] += seconds
+            hours = sorted(by_hour.items())
+        return daily, tasks, hours
+
+    def get_dashboard_version(self, user_id: int):
+        return datetime.utcnow().date().isoformat(), self._versions[user_id]
+
+    # --- Настройки пользователя ---
+
+    def get_max_session_hours(self, user_id: int):
+        hours = self._settings[user_id].get('max_session_hours')
+        return MAX_SESSION_HOURS if hours is None else hours
+
+    def set_max_session_hours(self, user_id: int, hours: float):
+        with self._lock:
+            self._settings[user_id]['max_session_hours'] = hours
+
+    def get_dashboard_profile(self, user_id: int):
+        return self._settings[user_id].get('dashboard_profile')
+
+    def set_dashboard_profile(self, user_id: int, profile: str):
+        with self._lock:
+            self._settings[user_id]['dashboard_profile'] = profile
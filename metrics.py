@@ -0,0 +1,77 @@
+"""
+Показатели регулярности: текущая и лучшая серия дней, доля активных дней, прогресс недельной цели.
+
+Состояние хранится в БД (user_metrics / task_metrics) и сдвигается на каждую остановку
+сессии за O(1). День - день начала сессии (UTC), как в daily_totals и статистике за 7 дней.
+"""
+from datetime import date, timedelta
+
+# Поля состояния в порядке колонок таблиц user_metrics / task_metrics
+FIELDS = ('current_streak', 'longest_streak', 'first_day', 'last_day', 'active_days', 'week_start', 'week_seconds')
+
+
+#Функция получения понедельника недели
+def week_start(day: date):
+    return day - timedelta(days=day.weekday())
+
+
+def empty_state():
+    return dict.fromkeys(FIELDS)
+
+
+#Функция учета очередного активного дня
+def advance(state: dict, day: str, seconds: int):
+    """
+    Дни должны приходить по порядку (день не раньше последнего учтенного).
+    Возвращает False, если пришел более ранний день - тогда состояние нужно пересчитать целиком.
+    """
+    current = date.fromisoformat(day)
+    if state['last_day'] is None:
+        state.update(current_streak=1, longest_streak=1, first_day=day, last_day=day, active_days=1)
+    else:
+        last = date.fromisoformat(state['last_day'])
+        if current < last:
+            return False
+        if current > last:
+            state['current_streak'] = state['current_streak'] + 1 if current - last == timedelta(days=1) else 1
+            state['longest_streak'] = max(state['longest_streak'], state['current_streak'])
+            state['active_days'] += 1
+            state['last_day'] = day
+
+    monday = week_start(current).isoformat()
+    if state['week_start'] == monday:
+        state['week_seconds'] += seconds
+    else:
+        state['week_start'] = monday
+        state['week_seconds'] = seconds
+    return True
+
+
+#Функция расчета состояния с нуля по итогам дней {день: секунды}
+def compute(day_seconds: dict):
+    state = empty_state()
+    for day in sorted(day_seconds):
+        advance(state, day, day_seconds[day])
+    return state
+
+
+#Функция расчета показателей для вывода на сегодняшний день
+def summarize(state: dict, goal_hours: float = None, today: date = None):
+    today = today or date.today()
+    summary = {'current_streak': 0, 'longest_streak': 0, 'active_days': 0, 'days': 0,
+               'active_ratio': 0.0, 'week_hours': 0.0, 'goal_hours': goal_hours, 'goal_progress': None}
+
+    if state and state['last_day'] is not None:
+        last = date.fromisoformat(state['last_day'])
+        # Серия прерывается, если вчера и сегодня занятий не было
+        summary['current_streak'] = state['current_streak'] if today - last <= timedelta(days=1) else 0
+        summary['longest_streak'] = state['longest_streak']
+        summary['active_days'] = state['active_days']
+        summary['days'] = (today - date.fromisoformat(state['first_day'])).days + 1
+        summary['active_ratio'] = state['active_days'] / max(summary['days'], state['active_days'])
+        if state['week_start'] == week_start(today).isoformat():
+            summary['week_hours'] = state['week_seconds'] / 3600
+
+    if goal_hours:
+        summary['goal_progress'] = summary['week_hours'] / goal_hours
+    return summary
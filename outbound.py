@@ -0,0 +1,348 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from contextlib import asynccontextmanager
+from datetime import timedelta
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+from config import (
+    OUTBOUND_GLOBAL_RATE, OUTBOUND_CHAT_RATE, OUTBOUND_CHAT_BURST, OUTBOUND_MAX_RETRIES, PLACEHOLDER_DELAY
+)
+
+INTERACTIVE = 0  # Ответы на действия пользователя
+BACKGROUND = 1  # Напоминания, автоостановки и прочие сообщения от фоновых задач
+
+# Запросы, которые меняют одно и то же сообщение: из нескольких ожидающих достаточно последнего
+EDIT_ENDPOINTS = ('editMessageText', 'editMessageCaption', 'editMessageReplyMarkup', 'editMessageMedia')
+BUCKET_SWEEP_INTERVAL = 60  # Как часто забывать лимиты чатов, в которые давно не писали, с
+
+
+class _Request:
+    __slots__ = ('priority', 'seq', 'chat_key', 'endpoint', 'callback', 'args', 'kwargs',
+                 'futures', 'attempts', 'started', 'cancelled', 'edit_key', 'withdraw_key')
+
+    def __init__(self, priority, seq, chat_key, endpoint, callback, args, kwargs):
+        self.priority = priority
+        self.seq = seq
+        self.chat_key = chat_key
+        self.endpoint = endpoint
+        self.callback = callback
+        self.args = args
+        self.kwargs = kwargs
+        self.futures = []  # Ожидающие результата (несколько - если запросы слиты)
+        self.attempts = 0
+        self.started = False
+        self.cancelled = False
+        self.edit_key = None
+        self.withdraw_key = None
+
+
+class _TokenBucket:
+    """rate=None - без ограничения, только пауза после 429"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0  # Пауза после 429 от Telegram
+
+    #Функция получения момента, когда можно отправить следующий запрос (0 - можно сейчас)
+    def ready_at(self, now):
+        if self.rate is None:
+            return self.paused_until if now < self.paused_until else 0.0
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if now < self.paused_until:
+            return self.paused_until
+        if self.tokens >= 1:
+            return 0.0
+        return now + (1 - self.tokens) / self.rate
+
+    def take(self):
+        if self.rate is not None:
+            self.tokens -= 1
+
+
+class OutboundScheduler(BaseRateLimiter):
+    """
+    Планировщик исходящих запросов к Bot API.
+
+    У каждого чата своя очередь с приоритетами и свой лимит, поверх - общий лимит бота.
+    Отправляется самый приоритетный запрос среди чатов, которым сейчас можно писать, поэтому
+    фоновая рассылка не задерживает ответы на нажатия, а один активный чат - остальных.
+    При 429 чат ставится на паузу на retry_after, и запрос повторяется. Несколько ожидающих
+    правок одного сообщения сливаются в одну, а заглушку можно отозвать, пока она в очереди.
+
+    Приоритет передается через rate_limit_args: {'priority': BACKGROUND}.
+    """
+
+    def __init__(self, global_rate: float = OUTBOUND_GLOBAL_RATE, chat_rate: float = OUTBOUND_CHAT_RATE,
+                 chat_burst: int = OUTBOUND_CHAT_BURST, max_retries: int = OUTBOUND_MAX_RETRIES):
+        # Запас общего лимита небольшой: в любом окне в 1 с уходит не больше rate + burst запросов
+        self._global = _TokenBucket(global_rate, max(1, global_rate / 5))
+        self._chat_rate = chat_rate
+        self._chat_burst = chat_burst
+        self._max_retries = max_retries
+        self._seq = itertools.count()
+        self._chats = {}  # chat_key -> куча (priority, seq, request)
+        self._buckets = {}  # chat_key -> _TokenBucket (только чаты, чей лимит еще не восстановился)
+        self._next_sweep = time.monotonic() + BUCKET_SWEEP_INTERVAL
+        self._ready = []  # куча (priority, seq, chat_key) - голова очереди чата, которому можно писать
+        self._waiting = []  # куча (время, chat_key) - чаты, ждущие лимита или паузы
+        self._edits = {}  # (endpoint, chat_id, message_id) -> ожидающая правка
+        self._withdrawable = {}  # ключ заглушки -> запрос
+        self._wakeup = None
+        self._dispatcher = None
+        self._inflight = set()
+        self.stats = {'sent': 0, 'retried': 0, 'coalesced': 0, 'withdrawn': 0, 'failed': 0}
+
+    async def initialize(self):
+        # PTB вызывает initialize и из Application, и из Updater - второй диспетчер не нужен
+        if self._dispatcher is not None:
+            return
+        self._wakeup = asyncio.Event()
+        self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def shutdown(self):
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            try:
+                await self._dispatcher
+            except asyncio.CancelledError:
+                pass
+            self._dispatcher = None
+        for queue in self._chats.values():
+            for _, _, request in queue:
+                self._finish(request, error=asyncio.CancelledError())
+        self._chats.clear()
+        logging.info(f"Планировщик исходящих запросов остановлен: {self.stats}")
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        options = rate_limit_args or {}
+        priority = options.get('priority', INTERACTIVE)
+        chat_id = data.get('chat_id')
+        future = asyncio.get_running_loop().create_future()
+
+        # Новая правка сообщения, для которого правка уже ждет в очереди, заменяет ее
+        edit_key = None
+        if endpoint in EDIT_ENDPOINTS:
+            edit_key = (endpoint, chat_id, data.get('message_id'), data.get('inline_message_id'))
+            queued = self._edits.get(edit_key)
+            if queued is not None and not queued.started and not queued.cancelled:
+                queued.callback, queued.args, queued.kwargs = callback, args, kwargs
+                queued.futures.append(future)
+                self.stats['coalesced'] += 1
+                if priority < queued.priority:
+                    self._requeue(queued, priority)
+                return await self._wait(queued, future)
+
+        request = _Request(priority, next(self._seq), chat_id, endpoint, callback, args, kwargs)
+        request.futures.append(future)
+        if edit_key is not None:
+            request.edit_key = edit_key
+            self._edits[edit_key] = request
+        if 'withdraw_key' in options:
+            request.withdraw_key = options['withdraw_key']
+            self._withdrawable[request.withdraw_key] = request
+        self._enqueue(request)
+        return await self._wait(request, future)
+
+    async def _wait(self, request, future):
+        try:
+            return await future
+        except asyncio.CancelledError:
+            # Вызвавший больше не ждет: если запрос еще не ушел и его никто не ждет - не отправляем
+            if not request.started and all(f.done() for f in request.futures):
+                request.cancelled = True
+            raise
+
+    #Функция отзыва запроса-заглушки, если он еще не отправлен
+    def withdraw(self, key) -> bool:
+        request = self._withdrawable.pop(key, None)
+        if request is None or request.started:
+            return False
+        request.cancelled = True
+        self.stats['withdrawn'] += 1
+        self._finish(request, error=asyncio.CancelledError())
+        return True
+
+    def _enqueue(self, request):
+        queue = self._chats.setdefault(request.chat_key, [])
+        heapq.heappush(queue, (request.priority, request.seq, request))
+        if queue[0][2] is request:
+            heapq.heappush(self._ready, (request.priority, request.seq, request.chat_key))
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _requeue(self, request, priority):
+        # Повышение приоритета: старая запись в куче станет неактуальной и будет пропущена
+        request.cancelled = True
+        merged = _Request(priority, request.seq, request.chat_key, request.endpoint,
+                          request.callback, request.args, request.kwargs)
+        merged.futures = request.futures
+        merged.edit_key = request.edit_key
+        if merged.edit_key is not None:
+            self._edits[merged.edit_key] = merged
+        self._enqueue(merged)
+
+    def _bucket(self, chat_key):
+        bucket = self._buckets.get(chat_key)
+        if bucket is None:
+            # Запросы без чата (getMe, setMyCommands и т.п.) ограничены только общим лимитом
+            rate, burst = (self._chat_rate, self._chat_burst) if chat_key is not None else (None, None)
+            bucket = self._buckets[chat_key] = _TokenBucket(rate, burst)
+        return bucket
+
+    #Функция удаления лимитов чатов без очереди, которые полностью восстановились и не на паузе:
+    #новый лимит для такого чата будет таким же, а словарь не растет с числом всех чатов бота
+    def _evict_idle_buckets(self, now):
+        idle = [chat_key for chat_key, bucket in self._buckets.items()
+                if chat_key not in self._chats and not bucket.ready_at(now)
+                and (bucket.rate is None or bucket.tokens >= bucket.burst)]
+        for chat_key in idle:
+            del self._buckets[chat_key]
+
+    #Функция выбора следующего запроса: самый приоритетный среди чатов, которым можно писать
+    def _next_request(self, now):
+        while self._waiting and self._waiting[0][0] <= now:
+            _, chat_key = heapq.heappop(self._waiting)
+            queue = self._chats.get(chat_key)
+            if queue:
+                heapq.heappush(self._ready, (queue[0][0], queue[0][1], chat_key))
+
+        while self._ready:
+            priority, seq, chat_key = heapq.heappop(self._ready)
+            queue = self._chats.get(chat_key)
+            if not queue or queue[0][1] != seq:
+                continue  # Устаревшая запись
+            while queue and queue[0][2].cancelled:
+                heapq.heappop(queue)
+            if not queue:
+                del self._chats[chat_key]
+                continue
+            if queue[0][1] != seq:
+                heapq.heappush(self._ready, (queue[0][0], queue[0][1], chat_key))
+                continue
+
+            bucket = self._bucket(chat_key)
+            ready_at = bucket.ready_at(now)
+            if ready_at:
+                heapq.heappush(self._waiting, (ready_at, chat_key))
+                continue
+
+            _, _, request = heapq.heappop(queue)
+            bucket.take()
+            if queue:
+                heapq.heappush(self._ready, (queue[0][0], queue[0][1], chat_key))
+            else:
+                del self._chats[chat_key]
+            return request
+        return None
+
+    async def _dispatch(self):
+        while True:
+            now = time.monotonic()
+            if now >= self._next_sweep:
+                self._evict_idle_buckets(now)
+                self._next_sweep = now + BUCKET_SWEEP_INTERVAL
+            global_ready_at = self._global.ready_at(now)
+            request = None if global_ready_at else self._next_request(now)
+
+            if request is None:
+                self._wakeup.clear()
+                wake_at = global_ready_at or (self._waiting[0][0] if self._waiting else None)
+                timeout = None if wake_at is None else max(wake_at - time.monotonic(), 0)
+                # Если ждем только общий лимит - новые запросы ничего не изменят
+                if global_ready_at:
+                    await asyncio.sleep(timeout)
+                    continue
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            self._global.take()
+            request.started = True
+            if request.edit_key is not None and self._edits.get(request.edit_key) is request:
+                del self._edits[request.edit_key]
+            if request.withdraw_key is not None:
+                self._withdrawable.pop(request.withdraw_key, None)
+            task = asyncio.create_task(self._run(request))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _run(self, request):
+        try:
+            result = await request.callback(*request.args, **request.kwargs)
+        except RetryAfter as e:
+            retry_after = e.retry_after.total_seconds() if isinstance(e.retry_after, timedelta) else e.retry_after
+            bucket = self._bucket(request.chat_key)
+            bucket.paused_until = max(bucket.paused_until, time.monotonic() + retry_after + 0.1)
+            if request.chat_key is None:
+                self._global.paused_until = bucket.paused_until
+
+            request.attempts += 1
+            if request.attempts > self._max_retries:
+                self.stats['failed'] += 1
+                logging.error(f"Лимит Telegram: {request.endpoint} для чата {request.chat_key} не отправлен после "
+                              f"{self._max_retries} повторов")
+                self._finish(request, error=e)
+                return
+            self.stats['retried'] += 1
+            logging.warning(f"Лимит Telegram для чата {request.chat_key}, повтор через {retry_after:.1f} с")
+            request.started = False
+            self._enqueue(request)
+            return
+        except Exception as e:
+            self._finish(request, error=e)
+            return
+        self.stats['sent'] += 1
+        self._finish(request, result=result)
+
+    def _finish(self, request, result=None, error=None):
+        for future in request.futures:
+            if future.done():
+                continue
+            if isinstance(error, asyncio.CancelledError):
+                future.cancel()
+            elif error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+
+#Сообщение-заглушка на время долгой операции
+@asynccontextmanager
+async def placeholder(bot, chat_id: int, text: str, delay: float = PLACEHOLDER_DELAY):
+    """
+    Заглушка отправляется, только если операция не уложилась в delay секунд и запрос
+    не отозван из очереди планировщика до завершения операции. Если заглушка ушла -
+    после операции она удаляется.
+    """
+    key = object()
+    rate_limit_args = {'withdraw_key': key} if isinstance(bot.rate_limiter, OutboundScheduler) else None
+    sending = False
+
+    async def send():
+        nonlocal sending
+        await asyncio.sleep(delay)
+        sending = True
+        return await bot.send_message(chat_id=chat_id, text=text, rate_limit_args=rate_limit_args)
+
+    task = asyncio.create_task(send())
+    try:
+        yield
+    finally:
+        # Заглушка еще не ушла (ждет задержки или стоит в очереди) - не отправляем ее вовсе
+        if not sending or (rate_limit_args is not None and bot.rate_limiter.withdraw(key)):
+            task.cancel()
+        else:
+            try:
+                message = await task
+                await message.delete()
+            except Exception as e:
+                logging.error(f"Ошибка удаления заглушки в чате {chat_id}: {e}")
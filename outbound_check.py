@@ -0,0 +1,179 @@
+"""
+Проверка планировщика исходящих запросов (outbound.py) против локального Bot API.
+
+Каждая проверка поднимает fake_bot_api.py (при необходимости - с лимитами Telegram, сверх которых
+приходит 429 с retry_after) и бота с OutboundScheduler, отправляет сообщения и проверяет, что
+дошло до API и в каком порядке: повтор после паузы при 429, приоритет ответов пользователю при
+нехватке общего лимита, слияние правок одного сообщения, отзыв заглушки и забывание лимитов
+неактивных чатов.
+
+    python outbound_check.py [--port 8091]
+"""
+import argparse
+import asyncio
+import logging
+import sys
+import time
+import traceback
+from contextlib import asynccontextmanager
+
+from telegram.ext import ExtBot
+
+import outbound
+from fake_bot_api import FakeBotApi
+from outbound import BACKGROUND, OutboundScheduler, placeholder
+
+BOT_TOKEN = '123456:outbound-check'
+CHAT = 2000  # Чаты проверок: CHAT, CHAT + 1, ...
+PORT = 8091
+
+
+#Функция бота с планировщиком против нового fake_bot_api: api_options - лимиты API, остальное - планировщику
+@asynccontextmanager
+async def _bot(api_options: dict = None, **scheduler_options):
+    api = FakeBotApi(port=PORT, **(api_options or {}))
+    await api.start()
+    scheduler = OutboundScheduler(**scheduler_options)
+    bot = ExtBot(BOT_TOKEN, base_url=f"{api.url}/bot", rate_limiter=scheduler)
+    try:
+        async with bot:
+            yield api, bot, scheduler
+    finally:
+        await api.stop()
+
+
+#Функция текстов сообщений, дошедших до API, в порядке отправки
+def _texts(api, chat_id: int = None):
+    return [message.get('text') for (chat, _), message in api.messages.items() if chat_id in (None, chat)]
+
+
+async def check_retry_after():
+    # Планировщик не знает лимита API (1 сообщение в секунду в чат) и узнает о нем только из 429
+    async with _bot({'chat_limit': 1}, chat_rate=100, chat_burst=100) as (api, bot, scheduler):
+        started = time.monotonic()
+
+        async def other_chat():
+            # Пока первый чат на паузе, другому чату писать можно
+            await asyncio.sleep(0.3)
+            await bot.send_message(CHAT + 1, 'другой чат')
+
+        await asyncio.gather(*(bot.send_message(CHAT, str(number)) for number in range(1, 4)), other_chat())
+        elapsed = time.monotonic() - started
+
+        assert _texts(api, CHAT) == ['1', '2', '3'], _texts(api)
+        assert _texts(api).index('другой чат') < _texts(api).index('2'), _texts(api)
+        assert api.throttled['sendMessage'] >= 2, api.throttled
+        assert scheduler.stats['retried'] == api.throttled['sendMessage'], (scheduler.stats, api.throttled)
+        assert scheduler.stats['failed'] == 0, scheduler.stats
+        # Повтор - не раньше retry_after: три сообщения при лимите 1 в секунду занимают больше 2 с
+        assert elapsed >= 2, elapsed
+
+
+async def check_retry_limit():
+    # Лимит API не восстанавливается за время повторов: после OUTBOUND_MAX_RETRIES запрос падает с RetryAfter
+    async with _bot({'chat_limit': 1}, chat_rate=100, chat_burst=100, max_retries=1) as (api, bot, scheduler):
+        results = await asyncio.gather(*(bot.send_message(CHAT, str(number)) for number in range(1, 4)),
+                                       return_exceptions=True)
+        failed = [result for result in results if isinstance(result, Exception)]
+        assert len(failed) == 1 and type(failed[0]).__name__ == 'RetryAfter', results
+        assert scheduler.stats['failed'] == 1, scheduler.stats
+        assert _texts(api, CHAT) == ['1', '2'], _texts(api)
+
+
+async def check_priority():
+    # Общий лимит 5 запросов в секунду, фоновая рассылка на 10 чатов уже в очереди
+    async with _bot(global_rate=5, chat_rate=100, chat_burst=100) as (api, bot, scheduler):
+        background = [
+            asyncio.create_task(bot.send_message(CHAT + number, f'фон {number}',
+                                                 rate_limit_args={'priority': BACKGROUND}))
+            for number in range(10)
+        ]
+        await asyncio.sleep(0.05)
+        await bot.send_message(CHAT + 10, 'ответ')
+        await asyncio.gather(*background)
+
+        texts = _texts(api)
+        # Ответ пользователю обгоняет рассылку: до него уходит не больше двух фоновых сообщений
+        assert texts.index('ответ') <= 2, texts
+        assert [text for text in texts if text != 'ответ'] == [f'фон {number}' for number in range(10)], texts
+
+
+async def check_edit_coalescing():
+    # Лимит чата 1 запрос в секунду: пока первая правка ждет лимита, следующие сливаются с ней
+    async with _bot(chat_rate=1, chat_burst=1) as (api, bot, scheduler):
+        message = await bot.send_message(CHAT, 'v0')
+        edited = await asyncio.gather(*(
+            bot.edit_message_text(f'v{number}', chat_id=CHAT, message_id=message.message_id)
+            for number in range(1, 4)
+        ))
+
+        assert api.counts['editMessageText'] == 1, api.counts
+        assert scheduler.stats['coalesced'] == 2, scheduler.stats
+        assert api.messages[(CHAT, message.message_id)]['text'] == 'v3'
+        assert [result.text for result in edited] == ['v3'] * 3, edited
+
+
+async def check_placeholder():
+    async with _bot(chat_rate=1, chat_burst=1) as (api, bot, scheduler):
+        # Операция быстрее задержки - заглушка даже не ставится в очередь
+        async with placeholder(bot, CHAT, '⏳ быстро', delay=0.2):
+            await asyncio.sleep(0.05)
+
+        # Заглушка в очереди (лимит чата израсходован), операция закончилась раньше - заглушку отзывают
+        await bot.send_message(CHAT, 'ответ')
+        async with placeholder(bot, CHAT, '⏳ в очереди', delay=0.1):
+            await asyncio.sleep(0.4)
+        assert scheduler.stats['withdrawn'] == 1, scheduler.stats
+
+        # Заглушка ушла - после операции она удаляется
+        async with placeholder(bot, CHAT + 1, '⏳ долго', delay=0.1):
+            await asyncio.sleep(0.5)
+
+        assert api.counts['sendMessage'] == 2, api.counts
+        assert api.counts['deleteMessage'] == 1, api.counts
+        assert _texts(api) == ['ответ'], _texts(api)
+
+
+async def check_bucket_eviction():
+    # Лимиты неактивных чатов забываются при каждом проходе диспетчера
+    outbound.BUCKET_SWEEP_INTERVAL = 0
+    try:
+        async with _bot(chat_rate=2, chat_burst=1) as (api, bot, scheduler):
+            await asyncio.gather(*(bot.send_message(CHAT + number, 'привет') for number in range(50)))
+            # Лимит 2 в секунду восстанавливается за 0.5 с, после паузы остается только лимит нового чата
+            await asyncio.sleep(0.7)
+            await bot.send_message(CHAT + 50, 'привет')
+            started = time.monotonic()
+            await bot.send_message(CHAT + 50, 'еще раз')
+            assert set(scheduler._buckets) <= {None, CHAT + 50}, sorted(scheduler._buckets, key=str)
+            # Лимит чата, который еще не восстановился, не забывается: второе сообщение ждет его
+            assert time.monotonic() - started >= 0.4, time.monotonic() - started
+            assert api.counts['sendMessage'] == 52, api.counts
+    finally:
+        outbound.BUCKET_SWEEP_INTERVAL = 60
+
+
+CHECKS = [check_retry_after, check_retry_limit, check_priority, check_edit_coalescing, check_placeholder,
+          check_bucket_eviction]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Проверка планировщика исходящих запросов')
+    parser.add_argument('--port', type=int, default=PORT, help='порт фейкового Bot API')
+    parser.add_argument('--verbose', action='store_true', help='показывать журнал планировщика')
+    args = parser.parse_args()
+    PORT = args.port
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+                        level=logging.INFO if args.verbose else logging.CRITICAL)
+
+    failed = 0
+    for check in CHECKS:
+        try:
+            asyncio.run(check())
+            print(f"ok   {check.__name__}")
+        except Exception:
+            failed += 1
+            print(f"FAIL {check.__name__}\n{traceback.format_exc()}")
+
+    print(f"\nПроверок: {len(CHECKS)}, ошибок: {failed}")
+    sys.exit(1 if failed else 0)
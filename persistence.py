@@ -0,0 +1,214 @@
+import asyncio
+import json
+import logging
+import pickle
+from telegram.ext import BasePersistence, PersistenceInput
+from database import get_db_connections
+from config import PERSISTENCE_UPDATE_INTERVAL
+
+
+class SQLitePersistence(BasePersistence):
+    """
+    Хранение состояний диалогов, user_data, chat_data и bot_data в основной БД.
+
+    update_* только помечают изменившиеся ключи, а запись в БД идет одной транзакцией
+    на пачку изменений. Значения, которые не изменились с последней записи, не пишутся.
+    """
+
+    def __init__(self, update_interval: float = PERSISTENCE_UPDATE_INTERVAL):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=True, chat_data=True, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        # Ожидающие записи изменения: ключ -> pickle или None (удаление)
+        self._pending = {'conversations': {}, 'user_data': {}, 'chat_data': {}, 'bot_data': {}}
+        # Последние записанные значения, чтобы не писать неизменившиеся данные
+        self._written = {'conversations': {}, 'user_data': {}, 'chat_data': {}, 'bot_data': {}}
+        self._flush_task = None
+        self._lock = asyncio.Lock()
+        _init_tables()
+
+    async def get_user_data(self):
+        rows = await asyncio.to_thread(_load, 'persistence_user_data', 'user_id')
+        self._written['user_data'] = dict(rows)
+        return {user_id: pickle.loads(data) for user_id, data in rows.items()}
+
+    async def get_chat_data(self):
+        rows = await asyncio.to_thread(_load, 'persistence_chat_data', 'chat_id')
+        self._written['chat_data'] = dict(rows)
+        return {chat_id: pickle.loads(data) for chat_id, data in rows.items()}
+
+    async def get_bot_data(self):
+        rows = await asyncio.to_thread(_load, 'persistence_bot_data', 'id')
+        self._written['bot_data'] = dict(rows)
+        return pickle.loads(rows[0]) if 0 in rows else {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        rows = await asyncio.to_thread(_load_conversations, name)
+
+        conversations = {}
+        for key, state in rows:
+            self._written['conversations'][(name, key)] = state
+            conversations[tuple(json.loads(key))] = pickle.loads(state)
+        return conversations
+
+    #Функция постановки изменения в очередь на запись
+    def _mark(self, kind, key, value):
+        data = None if value is None else pickle.dumps(value)
+        if self._written[kind].get(key) == data:
+            # Значение совпадает с уже записанным - писать нечего
+            self._pending[kind].pop(key, None)
+            return
+        self._pending[kind][key] = data
+        self._schedule_flush()
+
+    #Функция планирования записи после текущей пачки обновлений
+    def _schedule_flush(self):
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_soon())
+
+    async def _flush_soon(self):
+        # Даем Application закончить вызовы update_* этого цикла, затем пишем все одной транзакцией
+        await asyncio.sleep(0)
+        await self.flush()
+
+    async def update_conversation(self, name, key, new_state):
+        self._mark('conversations', (name, json.dumps(list(key))), new_state)
+
+    async def update_user_data(self, user_id, data):
+        self._mark('user_data', user_id, data)
+
+    async def update_chat_data(self, chat_id, data):
+        self._mark('chat_data', chat_id, data)
+
+    async def update_bot_data(self, data):
+        self._mark('bot_data', 0, data)
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_user_data(self, user_id):
+        self._mark('user_data', user_id, None)
+
+    async def drop_chat_data(self, chat_id):
+        self._mark('chat_data', chat_id, None)
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def flush(self):
+        async with self._lock:
+            pending = self._pending
+            if not any(pending.values()):
+                return
+            self._pending = {kind: {} for kind in pending}
+            try:
+                await asyncio.to_thread(_write_pending, pending)
+            except Exception as e:
+                # Возвращаем изменения в очередь (более новые значения не перетираем)
+                logging.error(f"Ошибка записи состояний в БД: {e}")
+                for kind, changes in pending.items():
+                    self._pending[kind] = {**changes, **self._pending[kind]}
+                return
+
+            for kind, changes in pending.items():
+                for key, data in changes.items():
+                    if data is None:
+                        self._written[kind].pop(key, None)
+                    else:
+                        self._written[kind][key] = data
+
+
+#Функция создания таблиц для хранения состояний
+def _init_tables():
+    conn = get_db_connections()
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS persistence_conversations (
+            name TEXT NOT NULL,
+            key TEXT NOT NULL,
+            state BLOB NOT NULL,
+            PRIMARY KEY (name, key)
+        )
+    ''')
+    for table, key_column in (
+        ('persistence_user_data', 'user_id'),
+        ('persistence_chat_data', 'chat_id'),
+        ('persistence_bot_data', 'id'),
+    ):
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                {key_column} INTEGER PRIMARY KEY,
+                data BLOB NOT NULL
+            )
+        ''')
+    conn.commit()
+    conn.close()
+
+
+#Функция чтения таблицы в словарь {ключ: pickle}
+def _load(table, key_column):
+    conn = get_db_connections()
+    cursor = conn.cursor()
+    cursor.execute(f'SELECT {key_column} AS key, data FROM {table}')
+    rows = {row['key']: row['data'] for row in cursor.fetchall()}
+    conn.close()
+    return rows
+
+
+#Функция чтения сохраненных состояний одного ConversationHandler
+def _load_conversations(name):
+    conn = get_db_connections()
+    cursor = conn.cursor()
+    cursor.execute('SELECT key, state FROM persistence_conversations WHERE name = ?', (name,))
+    rows = [(row['key'], row['state']) for row in cursor.fetchall()]
+    conn.close()
+    return rows
+
+
+#Функция записи накопленных изменений одной транзакцией
+def _write_pending(pending):
+    conn = get_db_connections()
+    cursor = conn.cursor()
+    try:
+        conversations = pending['conversations']
+        cursor.executemany(
+            'INSERT OR REPLACE INTO persistence_conversations (name, key, state) VALUES (?, ?, ?)',
+            [(name, key, data) for (name, key), data in conversations.items() if data is not None]
+        )
+        cursor.executemany(
+            'DELETE FROM persistence_conversations WHERE name = ? AND key = ?',
+            [(name, key) for (name, key), data in conversations.items() if data is None]
+        )
+
+        for kind, table, key_column in (
+            ('user_data', 'persistence_user_data', 'user_id'),
+            ('chat_data', 'persistence_chat_data', 'chat_id'),
+            ('bot_data', 'persistence_bot_data', 'id'),
+        ):
+            changes = pending[kind]
+            cursor.executemany(
+                f'INSERT OR REPLACE INTO {table} ({key_column}, data) VALUES (?, ?)',
+                [(key, data) for key, data in changes.items() if data is not None]
+            )
+            cursor.executemany(
+                f'DELETE FROM {table} WHERE {key_column} = ?',
+                [(key,) for key, data in changes.items() if data is None]
+            )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    logging.info(f"Persistence: записано изменений {sum(len(changes) for changes in pending.values())}")
@@ -0,0 +1,25 @@
+"""
+Пересчет показателей регулярности (серии, активные дни, недельный прогресс) с нуля.
+
+Запуск:
+    python rebuild_metrics.py            # пересчитать и сохранить
+    python rebuild_metrics.py --verify   # только сверить сохраненные показатели с посчитанными заново
+"""
+import argparse
+import logging
+from database import rebuild_metrics
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Пересчет показателей регулярности пользователей')
+    parser.add_argument('--verify', action='store_true', help='Только сверить, ничего не записывая')
+    args = parser.parse_args()
+
+    users, mismatches = rebuild_metrics(verify=args.verify)
+    for user_id, task_id, stored, computed in mismatches:
+        logging.warning(f"Расхождение: пользователь {user_id}, задача {task_id or 'все'}: {stored} != {computed}")
+    logging.info(
+        f"Проверено пользователей: {users}, расхождений: {len(mismatches)}" if args.verify
+        else f"Показатели пересчитаны для пользователей: {users}"
+    )
+    if mismatches:
+        raise SystemExit(1)
@@ -0,0 +1,141 @@
+"""
+Процессы для рисования картинок (дашборд, календарь, график сводки).
+
+matplotlib и pandas со временем раздувают память долгоживущего процесса, поэтому рисование
+идет в отдельных процессах, которые перезапускаются: после RENDER_MAX_TASKS картинок
+(max_tasks_per_child) или раньше - если после очередной картинки память процесса выросла
+выше RENDER_MAX_RSS_MB или в нем осталась незакрытая фигура. RENDER_WORKERS=0 - рисовать
+в вызывающем потоке (отладка), тогда pyplot защищен блокировкой.
+"""
+import importlib
+import logging
+import multiprocessing
+import os
+import resource
+import threading
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from logging_setup import setup_logging
+from config import RENDER_WORKERS, RENDER_MAX_TASKS, RENDER_MAX_RSS_MB, STORAGE_ENGINE
+
+
+#Функция текущего RSS процесса в байтах
+def get_rss():
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        # Не Linux: только пиковое значение (ru_maxrss в КБ)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+#Функция поиска функции рисования по имени 'модуль:функция'
+def _resolve(target: str):
+    module, name = target.split(':')
+    return getattr(importlib.import_module(module), name)
+
+
+_renders_done = 0  # Картинок, нарисованных этим процессом
+
+
+def _worker_init():
+    # Файл журнала пишет только основной процесс (ротацию из нескольких процессов не согласовать)
+    setup_logging(log_file=None)
+    # Тяжелые импорты - сразу при старте процесса, а не на первой картинке пользователя
+    importlib.import_module('dashboard')
+
+
+#Функция, выполняемая в процессе-рисовальщике
+def _worker_render(target: str, args, kwargs):
+    global _renders_done
+    import matplotlib.pyplot as plt
+
+    try:
+        img_bytes = _resolve(target)(*args, **kwargs)
+    finally:
+        _renders_done += 1
+    stats = {'pid': os.getpid(), 'rss': get_rss(), 'figures': len(plt.get_fignums()), 'renders': _renders_done}
+    return (img_bytes.getvalue() if img_bytes else None), stats
+
+
+class RenderWorkers:
+    def __init__(self, workers: int = RENDER_WORKERS, max_tasks: int = RENDER_MAX_TASKS,
+                 max_rss_mb: float = RENDER_MAX_RSS_MB):
+        self._workers = workers
+        self._max_tasks = max_tasks
+        self._max_rss = max_rss_mb * 2**20
+        self._executor = None
+        self._lock = threading.Lock()
+        self._inline_lock = threading.Lock()  # pyplot не потокобезопасен
+        self.processes = {}  # pid -> последняя статистика процесса
+        self.recycles = Counter()  # причина -> сколько раз пул перезапускался
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # spawn: дочерний процесс не наследует соединения SQLite и потоки родителя
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self._workers, mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_worker_init, max_tasks_per_child=self._max_tasks or None,
+                )
+            return self._executor
+
+    #Функция перезапуска процессов: новые картинки идут в новый пул, старый доделывает начатое и завершается
+    def _recycle(self, executor, reason: str):
+        with self._lock:
+            if self._executor is not executor:
+                return  # Уже перезапущен другим потоком
+            self._executor = None
+            self.processes.clear()
+        self.recycles[reason] += 1
+        executor.shutdown(wait=False)
+        logging.info(f"Процессы рисования перезапущены: {reason}")
+
+    #Функция рисования: target - 'модуль:функция', возвращающая BytesIO или None
+    def render(self, target: str, *args, **kwargs):
+        if not self._workers:
+            with self._inline_lock:
+                return _resolve(target)(*args, **kwargs)
+
+        executor = self._get_executor()
+        try:
+            data, stats = executor.submit(_worker_render, target, args, kwargs).result()
+        except BrokenProcessPool:
+            # Процесс убит (OOM killer, segfault) - пул больше не принимает задачи: новый пул и еще одна попытка
+            self._recycle(executor, 'процесс рисования упал')
+            executor = self._get_executor()
+            data, stats = executor.submit(_worker_render, target, args, kwargs).result()
+
+        # Последняя статистика каждого живого процесса (перезапущенные по max_tasks_per_child вытесняются)
+        self.processes.pop(stats['pid'], None)
+        self.processes[stats['pid']] = stats
+        while len(self.processes) > self._workers:
+            self.processes.pop(next(iter(self.processes)))
+        if stats['figures']:
+            logging.warning(f"В процессе рисования {stats['pid']} остались незакрытые фигуры: {stats['figures']}")
+            self._recycle(executor, 'незакрытые фигуры')
+        elif stats['rss'] > self._max_rss:
+            self._recycle(executor, f"память выше {self._max_rss / 2**20:.0f} МБ")
+        return BytesIO(data) if data is not None else None
+
+    #Функция прогрева: каждый процесс запускается и рисует маленькую картинку (импорты, шрифты, кодеки)
+    def warm_up(self, profile: str):
+        if not self._workers:
+            return self.render('dashboard:render_warmup', profile=profile) is not None
+        executor = self._get_executor()
+        # Одновременные задачи - пул запускает процессы сразу, а не по одному на каждую картинку пользователя
+        futures = [executor.submit(_worker_render, 'dashboard:render_warmup', (), {'profile': profile})
+                   for _ in range(self._workers)]
+        return all(future.result()[0] is not None for future in futures)
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+# Хранилище в памяти видно только этому процессу - с ним рисуем здесь же
+render_workers = RenderWorkers(0 if STORAGE_ENGINE == 'memory' else RENDER_WORKERS)
@@ -0,0 +1,131 @@
+"""
+Перенос данных при изменении количества шардов.
+
+Запуск (бот должен быть остановлен):
+    python reshard.py --from 1 --to 4
+После успешного переноса выставить DB_SHARDS=4 и запустить бота. Старые файлы не удаляются.
+Сжатая история переносится итогами (daily_totals/hourly_totals), архивные файлы остаются как есть.
+"""
+import argparse
+import logging
+from database import (
+    get_db_connections, get_user_shard, get_shard_path, fan_out, _init_shard, _get_meta, _set_meta, rebuild_metrics
+)
+
+#Таблицы с данными пользователей, которые переезжают вместе с ним (tasks и sessions - отдельно)
+USER_TABLES = ('user_settings',)
+#Итоги сжатой истории: переезжают с заменой task_id (hourly_totals целиком относятся к сжатым дням)
+TOTALS_TABLES = (('daily_totals', 'day < ?'), ('hourly_totals', '? IS NOT NULL'))
+
+
+#Функция переноса одного исходного шарда
+def _move_shard(source_shard: int, source_count: int, target_count: int):
+    source = get_db_connections(shard=source_shard, shards=source_count)
+    compacted_until = _get_meta(source.cursor(), 'compacted_until')
+    user_ids = [row['user_id'] for row in source.execute('SELECT DISTINCT user_id FROM tasks')]
+    targets = {}
+    moved_sessions = 0
+
+    for user_id in user_ids:
+        target_shard = get_user_shard(user_id, target_count)
+        if target_shard not in targets:
+            targets[target_shard] = get_db_connections(shard=target_shard, shards=target_count)
+        target = targets[target_shard]
+
+        # id задач в новом файле другие - строим соответствие старый id -> новый
+        # (удаленные задачи переезжают с отметкой deleted_at: их история удалится фоновой задачей уже в новом файле)
+        task_ids = {}
+        for task in source.execute(
+            'SELECT id, name, created_at, last_used_at, deleted_at FROM tasks WHERE user_id = ?', (user_id,)
+        ).fetchall():
+            cursor = target.execute(
+                'INSERT INTO tasks (user_id, name, created_at, last_used_at, deleted_at) VALUES (?, ?, ?, ?, ?)',
+                (user_id, task['name'], task['created_at'], task['last_used_at'], task['deleted_at'])
+            )
+            task_ids[task['id']] = cursor.lastrowid
+
+        sessions = source.execute(
+            'SELECT task_id, start_time, end_time, is_active FROM sessions WHERE user_id = ?', (user_id,)
+        ).fetchall()
+        target.executemany(
+            'INSERT INTO sessions (task_id, user_id, start_time, end_time, is_active) VALUES (?, ?, ?, ?, ?)',
+            [(task_ids[s['task_id']], user_id, s['start_time'], s['end_time'], s['is_active']) for s in sessions]
+        )
+        moved_sessions += len(sessions)
+
+        # Итоги сжатых дней - единственный источник этих данных, остальные дни пересчитаются
+        for table, condition in TOTALS_TABLES:
+            rows = source.execute(
+                f'SELECT * FROM {table} WHERE user_id = ? AND {condition}', (user_id, compacted_until)
+            ).fetchall()
+            if rows:
+                columns = rows[0].keys()
+                target.executemany(
+                    f'INSERT INTO {table} ({", ".join(columns)}) VALUES ({", ".join("?" for _ in columns)})',
+                    [tuple(task_ids[row['task_id']] if column == 'task_id' else row[column] for column in columns)
+                     for row in rows]
+                )
+
+        for table in USER_TABLES:
+            rows = source.execute(f'SELECT * FROM {table} WHERE user_id = ?', (user_id,)).fetchall()
+            if rows:
+                columns = rows[0].keys()
+                target.executemany(
+                    f'INSERT OR REPLACE INTO {table} ({", ".join(columns)}) VALUES ({", ".join("?" for _ in columns)})',
+                    [tuple(row) for row in rows]
+                )
+        target.commit()
+
+    for target in targets.values():
+        target.close()
+    source.close()
+    return len(user_ids), moved_sessions
+
+
+def reshard(source_count: int, target_count: int):
+    if source_count == target_count:
+        raise ValueError("Количество шардов не меняется")
+
+    # Граница сжатия у всех шардов должна совпадать: в новом файле она будет одна
+    compacted = set()
+    for shard in range(source_count):
+        conn = get_db_connections(shard=shard, shards=source_count)
+        compacted.add(_get_meta(conn.cursor(), 'compacted_until'))
+        conn.close()
+    if len(compacted) > 1:
+        raise ValueError("История шардов сжата до разных дат, сначала запустите сжатие на всех шардах")
+    compacted_until = compacted.pop()
+
+    for shard in range(target_count):
+        conn = get_db_connections(shard=shard, shards=target_count)
+        has_data = conn.execute('SELECT 1 FROM sqlite_master WHERE name = ?', ('tasks',)).fetchone() and \
+            conn.execute('SELECT 1 FROM tasks LIMIT 1').fetchone()
+        conn.close()
+        if has_data:
+            raise ValueError(f"Целевой файл {get_shard_path(shard, target_count)} уже содержит данные")
+        _init_shard(shard, target_count)
+        if compacted_until:
+            conn = get_db_connections(shard=shard, shards=target_count)
+            _set_meta(conn.cursor(), 'compacted_until', compacted_until)
+            _set_meta(conn.cursor(), 'daily_totals_until', compacted_until)
+            conn.commit()
+            conn.close()
+
+    # Исходные шарды читаются параллельно; записи в один целевой файл SQLite сериализует сам
+    results = fan_out(lambda shard: _move_shard(shard, source_count, target_count), source_count)
+    users = sum(result[0] for result in results)
+    sessions = sum(result[1] for result in results)
+    logging.info(f"Перенесено пользователей: {users}, сессий: {sessions} ({source_count} -> {target_count} шардов)")
+
+    # Показатели регулярности привязаны к id задач - считаем их в новых файлах заново.
+    # Дневные итоги в новых файлах пересчитает фоновая задача в тихие часы
+    rebuild_metrics(shards=target_count)
+    return users, sessions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Перераспределение пользователей по шардам БД')
+    parser.add_argument('--from', dest='source', type=int, required=True, help='Текущее количество шардов')
+    parser.add_argument('--to', dest='target', type=int, required=True, help='Новое количество шардов')
+    args = parser.parse_args()
+    reshard(args.source, args.target)
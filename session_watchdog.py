@@ -0,0 +1,145 @@
+import heapq
+import logging
+import time
+from datetime import datetime, timezone
+from telegram.ext import Application, ContextTypes
+from config import SESSION_REMINDER_MINUTES
+from outbound import BACKGROUND
+from storage import storage
+
+REMIND = 0  # Напоминание перед автоостановкой
+STOP = 1  # Автоостановка
+
+
+#Функция перевода времени из БД (UTC) в timestamp
+def _to_timestamp(db_time: str):
+    return datetime.strptime(db_time, '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc).timestamp()
+
+
+class SessionWatchdog:
+    """
+    Следит за забытыми сессиями. Сроки активных сессий лежат в min-куче, а в JobQueue
+    всегда запланирован один таймер на ближайший срок. Старт/остановка сессии - O(log n),
+    периодических проходов по таблице sessions нет.
+    """
+
+    def __init__(self):
+        self._heap = []  # (время срабатывания, тип, user_id, session_id, deadline)
+        self._sessions = {}  # user_id -> (session_id, deadline) - актуальные сессии
+        self._job_queue = None
+        self._job = None
+        self._job_when = None
+
+    #Функция запуска: восстанавливаем кучу по активным сессиям из БД
+    def start(self, application: Application):
+        # Таймер прошлого приложения (перезапуск в том же процессе) остался в его очереди задач
+        self._heap, self._sessions, self._job, self._job_when = [], {}, None, None
+        self._job_queue = application.job_queue
+        for session in storage.get_active_sessions_with_limits():
+            self._push(session['user_id'], session['id'], session['start_time'], session['max_session_hours'])
+        self._rearm()
+        logging.info(f"Watchdog сессий запущен, отслеживается сессий: {len(self._sessions)}")
+
+    #Функция добавления сроков сессии в кучу
+    def _push(self, user_id, session_id, start_time, max_hours):
+        if not max_hours:
+            self._sessions.pop(user_id, None)
+            return
+        deadline = _to_timestamp(start_time) + max_hours * 3600
+        self._sessions[user_id] = (session_id, deadline)
+        # Лимит не длиннее окна напоминания - "таймер работает уже долго" было бы неправдой, не напоминаем
+        if max_hours * 60 > SESSION_REMINDER_MINUTES:
+            heapq.heappush(self._heap, (deadline - SESSION_REMINDER_MINUTES * 60, REMIND, user_id, session_id, deadline))
+        heapq.heappush(self._heap, (deadline, STOP, user_id, session_id, deadline))
+
+    #Функция начала отслеживания только что запущенной сессии
+    def track(self, user_id: int):
+        session = storage.get_active_session(user_id)
+        if session is None:
+            return
+        self._push(user_id, session['id'], session['start_time'], storage.get_max_session_hours(user_id))
+        self._rearm()
+
+    #Функция прекращения отслеживания (сессия остановлена вручную)
+    def untrack(self, user_id: int):
+        # Записи в куче удаляются лениво: при срабатывании они просто не совпадут с _sessions
+        self._sessions.pop(user_id, None)
+        # Если устаревших записей стало слишком много - перестраиваем кучу за O(n)
+        if len(self._heap) > 4 * len(self._sessions) + 64:
+            self._heap = [entry for entry in self._heap if self._is_current(entry)]
+            heapq.heapify(self._heap)
+
+    #Функция проверки, что запись кучи относится к актуальной сессии и актуальному сроку
+    def _is_current(self, entry):
+        _, _, user_id, session_id, deadline = entry
+        return self._sessions.get(user_id) == (session_id, deadline)
+
+    #Функция планирования таймера на ближайший срок
+    def _rearm(self):
+        while self._heap and not self._is_current(self._heap[0]):
+            heapq.heappop(self._heap)
+
+        when = self._heap[0][0] if self._heap else None
+        pending = self._job_pending()
+        if when == self._job_when and pending:
+            return
+        if pending:
+            self._job.schedule_removal()
+        self._job = None
+        self._job_when = when
+        if when is not None and self._job_queue is not None:
+            # Срок мог уже пройти (забытая сессия при старте, лимит меньше прошедшего времени), а JobQueue
+            # при старте бота еще не запущена: без misfire_grace_time APScheduler молча выбросит опоздавший таймер
+            self._job = self._job_queue.run_once(
+                self._on_timer, when=datetime.fromtimestamp(max(when, time.time()), timezone.utc),
+                name='session_watchdog', job_kwargs={'misfire_grace_time': None}
+            )
+
+    #Функция проверки, что таймер еще стоит в очереди JobQueue (не сработал и не выброшен)
+    def _job_pending(self):
+        return self._job is not None and self._job_queue.scheduler.get_job(self._job.job.id) is not None
+
+    #Обработчик срабатывания таймера
+    async def _on_timer(self, context: ContextTypes.DEFAULT_TYPE):
+        self._job = None
+        self._job_when = None
+        now = datetime.now(timezone.utc).timestamp()
+
+        while self._heap and self._heap[0][0] <= now:
+            entry = heapq.heappop(self._heap)
+            if not self._is_current(entry):
+                continue
+            when, kind, user_id, session_id, deadline = entry
+
+            try:
+                if kind == REMIND:
+                    if deadline <= now:
+                        continue  # Срок уже прошел (например, после перезапуска) - сразу останавливаем
+                    # Сколько осталось на самом деле: таймер мог сработать позже (перезапуск бота)
+                    minutes = max(1, round((deadline - now) / 60))
+                    await context.bot.send_message(
+                        chat_id=user_id,
+                        text=f"⏰ Таймер работает уже долго. Через {minutes} мин. "
+                             f"сессия будет остановлена автоматически. Нажми ⏹️, если уже закончил.",
+                        rate_limit_args={'priority': BACKGROUND}
+                    )
+                else:
+                    self._sessions.pop(user_id, None)
+                    end_time = datetime.fromtimestamp(when, timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+                    result = storage.stop_session(user_id, session_id, end_time)
+                    if result:
+                        logging.info(f"Сессия {session_id} пользователя {user_id} остановлена автоматически")
+                        await context.bot.send_message(
+                            chat_id=user_id,
+                            text=f'⏹️ Сессия для задачи "{result["name"]}" остановлена автоматически, '
+                                 f'активное время: {result["time_diff"]}.\n'
+                                 f'Изменить лимит: /max_session',
+                            rate_limit_args={'priority': BACKGROUND}
+                        )
+            except Exception as e:
+                logging.error(f"Ошибка watchdog для пользователя {user_id}: {e}")
+
+        self._rearm()
+
+
+session_watchdog = SessionWatchdog()
@@ -0,0 +1,316 @@
+"""
+Хранилище задач, сессий, статистики и данных дашборда.
+
+Обработчики, дашборд, импорт и сторож сессий работают только через объект storage, поэтому
+движок можно заменить настройкой STORAGE_ENGINE:
+    sqlite - основной движок: шардированная SQLite из database.py, тяжелые чтения дашборда -
+             из аналитического снимка;
+    memory - все в памяти процесса (memory_storage.py): для тестов и бенчмарков, данные не сохраняются.
+Обслуживание SQLite (сжатие истории, снимки, VACUUM, /admin_report, persistence) остается в database.py
+и к интерфейсу не относится. Оба движка должны проходить storage_conformance.py.
+
+Строки (задачи, сессии) возвращаются объектами с доступом по имени колонки: task['name'], session['id'].
+Время - строки UTC 'YYYY-MM-DD HH:MM:SS', как CURRENT_TIMESTAMP в SQLite.
+"""
+import sqlite3
+from abc import ABC, abstractmethod
+import database
+from analytics_snapshot import get_snapshot_time, connect_snapshot
+from config import STORAGE_ENGINE, TASK_UNDO_MINUTES, TASK_PURGE_CHUNK_ROWS
+
+
+class Storage(ABC):
+    """
+    Интерфейс хранилища. Семантика каждого метода - как у одноименной функции database.py.
+    Движок, в котором не хватает метода, не создается (TypeError) - это ловит storage_conformance.py.
+    """
+
+    # --- Задачи ---
+    @abstractmethod
+    def add_task(self, user_id: int, task_name: str):
+        raise NotImplementedError
+
+    #Удаляет задачу: она сразу пропадает из списков и статистики, активная сессия задачи удаляется,
+    #показатели регулярности пересчитываются. True - если задача была и удалена
+    @abstractmethod
+    def delete_task(self, user_id: int, task_id: int):
+        raise NotImplementedError
+
+    #Возвращает удаленную задачу со всей историей, если с удаления прошло меньше undo_minutes: True/False
+    @abstractmethod
+    def restore_task(self, user_id: int, task_id: int, undo_minutes: int = TASK_UNDO_MINUTES):
+        raise NotImplementedError
+
+    #Окончательно удаляет задачи, удаленные не меньше undo_minutes назад (фоновая задача): (задач, строк)
+    @abstractmethod
+    def purge_deleted_tasks(self, undo_minutes: int = TASK_UNDO_MINUTES, chunk_rows: int = TASK_PURGE_CHUNK_ROWS):
+        raise NotImplementedError
+
+    #Задачи пользователя (id, name) в порядке создания
+    @abstractmethod
+    def get_tasks(self, user_id: int):
+        raise NotImplementedError
+
+    #Задача (id, name) или None, если это чужая или несуществующая задача
+    @abstractmethod
+    def get_task(self, user_id: int, task_id: int):
+        raise NotImplementedError
+
+    #Страница задач (id, name, last_used_at) по (last_used_at, id) от новых к старым: (задачи, есть ли еще)
+    @abstractmethod
+    def get_tasks_page(self, user_id: int, limit: int, cursor_key=None, backward: bool = False, prefix: str = None):
+        raise NotImplementedError
+
+    # --- Сессии ---
+    #Запуск сессии: True, False - у пользователя уже есть активная, None - задачи нет или она удалена
+    @abstractmethod
+    def start_session(self, user_id: int, task_id: int):
+        raise NotImplementedError
+
+    #Остановка сессии: {'name', 'time_diff'} или False, если активной сессии нет
+    @abstractmethod
+    def stop_session(self, user_id: int, session_id: int = None, end_time: str = None):
+        raise NotImplementedError
+
+    #Активная сессия (id, name, start_time) или None
+    @abstractmethod
+    def get_active_session(self, user_id: int):
+        raise NotImplementedError
+
+    #Все активные сессии (id, user_id, start_time, max_session_hours) - для восстановления таймеров
+    @abstractmethod
+    def get_active_sessions_with_limits(self):
+        raise NotImplementedError
+
+    #Импорт истории: rows - поток (task_name, start_time, end_time), возвращает {'imported', 'created_tasks'}
+    @abstractmethod
+    def import_sessions(self, user_id: int, rows):
+        raise NotImplementedError
+
+    #Пользователи с сессиями за последние days дней
+    @abstractmethod
+    def get_recently_active_users(self, days: int):
+        raise NotImplementedError
+
+    # --- Статистика ---
+    @abstractmethod
+    def get_total_stat_last_7_days(self, user_id: int):
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_stat_daily_day(self, user_id: int):
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_task_stat_last_7_days(self, user_id: int, task_id: int):
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_stat_task_daily_day(self, user_id: int, task_id: int):
+        raise NotImplementedError
+
+    #Активное время по дням начиная с start_day: {'YYYY-MM-DD': секунды} (только дни с сессиями)
+    @abstractmethod
+    def get_daily_seconds(self, user_id: int, start_day: str, task_id: int = None, from_snapshot: bool = False):
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_consistency_metrics(self, user_id: int, task_id: int = None):
+        raise NotImplementedError
+
+    @abstractmethod
+    def set_weekly_goal(self, user_id: int, hours: float, task_id: int = None):
+        raise NotImplementedError
+
+    # --- Дашборд ---
+    #Данные дашборда: (дни [('YYYY-MM-DD', секунды)] за 7 дней UTC, задачи [(название, секунды)] по убыванию,
+    #часы [('HH', секунды)] по возрастанию) - задачи с одинаковым названием складываются
+    @abstractmethod
+    def get_dashboard_data(self, user_id: int, from_snapshot: bool = False):
+        raise NotImplementedError
+
+    #"Версия" данных пользователя для кеша картинок: меняется при любом изменении сессий и при смене дня
+    @abstractmethod
+    def get_dashboard_version(self, user_id: int):
+        raise NotImplementedError
+
+    #Время копии, из которой читаются тяжелые данные (UTC), или None - данные читаются напрямую
+    def get_snapshot_time(self, user_id: int):
+        return None
+
+    # --- Настройки пользователя ---
+    @abstractmethod
+    def get_max_session_hours(self, user_id: int):
+        raise NotImplementedError
+
+    @abstractmethod
+    def set_max_session_hours(self, user_id: int, hours: float):
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_dashboard_profile(self, user_id: int):
+        raise NotImplementedError
+
+    @abstractmethod
+    def set_dashboard_profile(self, user_id: int, profile: str):
+        raise NotImplementedError
+
+
+#Данные дашборда из SQLite: 7 дней (по сессиям), задачи и часы (сессии после сжатия + готовые итоги).
+#Сессии и итоги удаленных, но еще не очищенных задач не учитываются (database.LIVE_TASK_FILTER)
+DASHBOARD_DAILY_QUERY = f"""
+    WITH RECURSIVE date_range AS (
+        SELECT date('now', '-6 days') AS date
+        UNION ALL
+        SELECT date(date, '+1 day')
+        FROM date_range
+        WHERE date < date('now')
+    )
+    SELECT
+        date_range.date,
+        COALESCE(SUM(strftime('%s', sessions.end_time) - strftime('%s', sessions.start_time)), 0) AS seconds
+    FROM date_range
+    LEFT JOIN sessions ON date_range.date = date(sessions.start_time)
+                      AND sessions.user_id = ?
+                      AND sessions.end_time IS NOT NULL
+                      AND sessions.{database.LIVE_TASK_FILTER}
+    GROUP BY date_range.date
+    ORDER BY date_range.date
+"""
+
+# Граница сжатой истории: более старые сессии перенесены в архив, их время - в daily_totals/hourly_totals
+COMPACTED_UNTIL = """
+    (SELECT COALESCE(MAX(value), '') FROM aggregates_meta WHERE name = 'compacted_until')
+"""
+
+DASHBOARD_TASK_QUERY = f"""
+    SELECT
+        tasks.name AS task_name,
+        SUM(totals.seconds) AS seconds
+    FROM (
+        SELECT task_id, strftime('%s', end_time) - strftime('%s', start_time) AS seconds
+        FROM sessions
+        WHERE user_id = :user_id AND end_time IS NOT NULL AND start_time >= {COMPACTED_UNTIL}
+
+        UNION ALL
+
+        SELECT task_id, seconds
+        FROM daily_totals
+        WHERE user_id = :user_id AND day < {COMPACTED_UNTIL}
+    ) AS totals
+    JOIN tasks ON totals.task_id = tasks.id
+    WHERE tasks.deleted_at IS NULL
+    GROUP BY tasks.name
+    ORDER BY seconds DESC
+"""
+
+# Точный расчет активности по часам: сессии режутся на куски по границам часов
+DASHBOARD_HOUR_QUERY = f"""
+    WITH RECURSIVE hour_intervals AS (
+        SELECT
+            sessions.rowid,
+            sessions.start_time,
+            sessions.end_time,
+            sessions.start_time AS interval_start,
+            MIN(strftime('%Y-%m-%d %H:00:00', sessions.start_time, '+1 hour'), sessions.end_time) AS interval_end
+        FROM sessions
+        WHERE sessions.user_id = :user_id AND sessions.end_time IS NOT NULL
+          AND sessions.start_time >= {COMPACTED_UNTIL} AND {database.LIVE_TASK_FILTER}
+
+        UNION ALL
+
+        SELECT
+            h.rowid,
+            h.start_time,
+            h.end_time,
+            h.interval_end AS interval_start,
+            MIN(strftime('%Y-%m-%d %H:00:00', h.interval_end, '+1 hour'), h.end_time) AS interval_end
+        FROM hour_intervals h
+        WHERE h.interval_end < h.end_time
+    )
+    SELECT hour, SUM(seconds) AS seconds
+    FROM (
+        SELECT
+            strftime('%H', interval_start) AS hour,
+            strftime('%s', interval_end) - strftime('%s', interval_start) AS seconds
+        FROM hour_intervals
+
+        UNION ALL
+
+        SELECT hour, seconds
+        FROM hourly_totals
+        WHERE user_id = :user_id AND {database.LIVE_TASK_FILTER}
+    )
+    GROUP BY hour
+    ORDER BY hour
+"""
+
+
+class SQLiteStorage(Storage):
+    """Основной движок: функции database.py, тяжелые чтения - из аналитического снимка, если он свежий"""
+
+    add_task = staticmethod(database.add_task)
+    delete_task = staticmethod(database.delete_task)
+    restore_task = staticmethod(database.restore_task)
+    purge_deleted_tasks = staticmethod(database.purge_deleted_tasks)
+    get_tasks = staticmethod(database.get_tasks)
+    get_task = staticmethod(database.get_task)
+    get_tasks_page = staticmethod(database.get_tasks_page)
+    start_session = staticmethod(database.start_session)
+    stop_session = staticmethod(database.stop_session)
+    get_active_session = staticmethod(database.get_active_session)
+    get_active_sessions_with_limits = staticmethod(database.get_active_sessions_with_limits)
+    import_sessions = staticmethod(database.import_sessions)
+    get_recently_active_users = staticmethod(database.get_recently_active_users)
+    get_total_stat_last_7_days = staticmethod(database.get_total_stat_last_7_days)
+    get_stat_daily_day = staticmethod(database.get_stat_daily_day)
+    get_task_stat_last_7_days = staticmethod(database.get_task_stat_last_7_days)
+    get_stat_task_daily_day = staticmethod(database.get_stat_task_daily_day)
+    get_consistency_metrics = staticmethod(database.get_consistency_metrics)
+    set_weekly_goal = staticmethod(database.set_weekly_goal)
+    get_dashboard_version = staticmethod(database.get_dashboard_version)
+    get_snapshot_time = staticmethod(get_snapshot_time)
+    get_max_session_hours = staticmethod(database.get_max_session_hours)
+    set_max_session_hours = staticmethod(database.set_max_session_hours)
+    get_dashboard_profile = staticmethod(database.get_dashboard_profile)
+    set_dashboard_profile = staticmethod(database.set_dashboard_profile)
+
+    #Соединение для тяжелого чтения: снимок (запись сессий не мешает) или шард пользователя
+    @staticmethod
+    def _connect(user_id: int, from_snapshot: bool):
+        if not from_snapshot:
+            return database.get_db_connections(user_id)
+        conn = connect_snapshot(user_id)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def get_daily_seconds(self, user_id: int, start_day: str, task_id: int = None, from_snapshot: bool = False):
+        conn = self._connect(user_id, from_snapshot)
+        try:
+            return database._get_daily_seconds(conn.cursor(), user_id, start_day, task_id)
+        finally:
+            conn.close()
+
+    def get_dashboard_data(self, user_id: int, from_snapshot: bool = False):
+        conn = self._connect(user_id, from_snapshot)
+        try:
+            cursor = conn.cursor()
+            daily = [tuple(row) for row in cursor.execute(DASHBOARD_DAILY_QUERY, (user_id,))]
+            tasks = [tuple(row) for row in cursor.execute(DASHBOARD_TASK_QUERY, {'user_id': user_id})]
+            hours = [tuple(row) for row in cursor.execute(DASHBOARD_HOUR_QUERY, {'user_id': user_id})]
+            return daily, tasks, hours
+        finally:
+            conn.close()
+
+
+#Функция создания хранилища по названию движка
+def create_storage(engine: str = STORAGE_ENGINE):
+    if engine == 'sqlite':
+        return SQLiteStorage()
+    if engine == 'memory':
+        from memory_storage import MemoryStorage
+        return MemoryStorage()
+    raise ValueError(f"Неизвестный STORAGE_ENGINE: {engine!r} (ожидается sqlite или memory)")
+
+
+storage = create_storage()
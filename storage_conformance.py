@@ -0,0 +1,263 @@
+"""
+Проверка совместимости движков хранилища (storage.py).
+
+Каждая проверка выполняет одни и те же действия на всех движках (SQLite во временной папке и
+память) и сравнивает все, что видит бот: ответы методов, статистику, данные дашборда, показатели
+регулярности. Проверка не проходит, если движок нарушает ожидания (assert) или его ответы
+расходятся с другими движками. Новый движок добавляется в ENGINES и должен проходить все проверки.
+
+    python storage_conformance.py
+"""
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import traceback
+from datetime import datetime, timedelta
+
+USER = 1000  # У каждой проверки свои пользователи: USER, USER + 1, ...
+
+
+#Функция приведения ответа движка к простым типам (sqlite3.Row -> dict) для сравнения
+def _plain(value):
+    if isinstance(value, sqlite3.Row):
+        return {key: value[key] for key in value.keys()}
+    if isinstance(value, dict):
+        return {key: _plain(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_plain(item) for item in value]
+    return value
+
+
+#Функция времени в формате хранилища: days дней назад (UTC), в час hour
+def _at(days: int, hour: int, minute: int = 0):
+    day = datetime.utcnow().date() - timedelta(days=days)
+    return datetime(day.year, day.month, day.day, hour, minute).strftime('%Y-%m-%d %H:%M:%S')
+
+
+#История для импорта: несколько задач за 40 дней, сессии через границу часа и полночь, нулевая сессия.
+#Дни около границы "последних 7 дней" пропущены: ее время зависит от секунды запуска
+HISTORY = [
+    *((('Чтение', _at(days, 10), _at(days, 11, 30)) for days in range(0, 40, 3) if days not in (6, 7, 8))),
+    *((('Writing', _at(days, 21, 45), _at(days, 22, 15)) for days in range(1, 30, 4) if days not in (6, 7, 8))),
+    ('Writing', _at(2, 23, 30), _at(1, 0, 40)),
+    ('Спорт', _at(9, 7), _at(9, 7)),
+    ('Спорт', _at(12, 6, 15), _at(12, 8, 5)),
+]
+
+
+def check_tasks(storage):
+    for name in ('Чтение', 'Writing', 'work', 'Чай'):
+        storage.add_task(USER, name)
+    storage.add_task(USER + 1, 'Чужая')
+    tasks = _plain(storage.get_tasks(USER))
+    assert [task['name'] for task in tasks] == ['Чтение', 'Writing', 'work', 'Чай'], tasks
+    other = _plain(storage.get_tasks(USER + 1))[0]
+    assert storage.get_task(USER, other['id']) is None, 'чужая задача видна'
+
+    first, has_more = storage.get_tasks_page(USER, 2)
+    assert has_more and len(first) == 2
+    last = _plain(first)[-1]
+    second, has_more_second = storage.get_tasks_page(USER, 2, (last['last_used_at'], last['id']))
+    back, has_more_back = storage.get_tasks_page(USER, 2, (_plain(second)[0]['last_used_at'], _plain(second)[0]['id']), backward=True)
+    assert _plain(back) == _plain(first), (back, first)
+    return {
+        'tasks': [task['name'] for task in tasks],
+        'pages': [[task['name'] for task in _plain(page)] for page in (first, second, back)],
+        'has_more': [has_more, has_more_second, has_more_back],
+        # LIKE: латиница без учета регистра, кириллица - с учетом
+        'prefix_w': [task['name'] for task in _plain(storage.get_tasks_page(USER, 10, prefix='W')[0])],
+        'prefix_ч': [task['name'] for task in _plain(storage.get_tasks_page(USER, 10, prefix='ч')[0])],
+        'prefix_escape': _plain(storage.get_tasks_page(USER, 10, prefix='%')[0]),
+    }
+
+
+def check_sessions(storage):
+    storage.add_task(USER, 'Задача')
+    task_id = _plain(storage.get_tasks(USER))[0]['id']
+    assert storage.stop_session(USER) is False
+    assert storage.get_active_session(USER) is None
+    assert storage.start_session(USER, task_id) is True
+    assert storage.start_session(USER, task_id) is False, 'вторая активная сессия'
+    active = _plain(storage.get_active_session(USER))
+    assert active['name'] == 'Задача'
+    assert storage.stop_session(USER, session_id=active['id'] + 1000) is False, 'остановлена чужая сессия'
+
+    end_time = (datetime.fromisoformat(active['start_time']) + timedelta(hours=1, minutes=2, seconds=3)).strftime('%Y-%m-%d %H:%M:%S')
+    stopped = _plain(storage.stop_session(USER, active['id'], end_time))
+    assert stopped == {'name': 'Задача', 'time_diff': '01:02:03'}, stopped
+    assert storage.get_active_session(USER) is None
+    assert storage.stop_session(USER) is False
+
+    storage.set_max_session_hours(USER + 1, 2.5)
+    for user_id in (USER + 1, USER + 2):
+        storage.add_task(user_id, 'Задача')
+        storage.start_session(user_id, _plain(storage.get_tasks(user_id))[0]['id'])
+    limits = {
+        session['user_id']: session['max_session_hours']
+        for session in _plain(storage.get_active_sessions_with_limits()) if session['user_id'] >= USER
+    }
+    assert limits[USER + 1] == 2.5
+    return {'stopped': stopped, 'limits': limits, 'stat': storage.get_total_stat_last_7_days(USER)}
+
+
+def check_import_and_stats(storage):
+    result = storage.import_sessions(USER, iter(HISTORY))
+    assert result == {'imported': len(HISTORY), 'created_tasks': 3}, result
+    tasks = {task['name']: task['id'] for task in _plain(storage.get_tasks(USER))}
+    daily, by_task, hours = storage.get_dashboard_data(USER)
+    return {
+        'result': result,
+        'daily_seconds': storage.get_daily_seconds(USER, _at(45, 0)[:10]),
+        'daily_seconds_task': storage.get_daily_seconds(USER, _at(45, 0)[:10], tasks['Writing']),
+        'total_7': storage.get_total_stat_last_7_days(USER),
+        'daily_7': storage.get_stat_daily_day(USER),
+        'task_7': storage.get_task_stat_last_7_days(USER, tasks['Чтение']),
+        'task_daily_7': storage.get_stat_task_daily_day(USER, tasks['Чтение']),
+        # Порядок задач с одинаковым временем не определен
+        'dashboard': [_plain(daily), sorted(_plain(by_task), key=lambda row: (-row[1], row[0])), _plain(hours)],
+        'metrics': storage.get_consistency_metrics(USER),
+        'metrics_task': storage.get_consistency_metrics(USER, tasks['Спорт']),
+        'recent': USER in storage.get_recently_active_users(3),
+    }
+
+
+def check_delete_task(storage):
+    storage.import_sessions(USER, iter(HISTORY))
+    tasks = {task['name']: task['id'] for task in _plain(storage.get_tasks(USER))}
+    version = storage.get_dashboard_version(USER)
+    storage.delete_task(USER + 1, tasks['Writing'])  # Чужой пользователь - ничего не удаляется
+    assert storage.get_dashboard_version(USER) == version
+    storage.start_session(USER, tasks['Writing'])
+    storage.delete_task(USER, tasks['Writing'])
+    assert storage.get_active_session(USER) is None, 'активная сессия удаленной задачи осталась'
+    assert storage.get_dashboard_version(USER) != version
+    daily, by_task, hours = storage.get_dashboard_data(USER)
+    return {
+        'tasks': [task['name'] for task in _plain(storage.get_tasks(USER))],
+        'daily_seconds': storage.get_daily_seconds(USER, _at(45, 0)[:10]),
+        'dashboard': [_plain(daily), sorted(_plain(by_task), key=lambda row: (-row[1], row[0])), _plain(hours)],
+        'metrics': storage.get_consistency_metrics(USER),
+    }
+
+
+def check_restore_task(storage):
+    storage.import_sessions(USER, iter(HISTORY))
+    tasks = {task['name']: task['id'] for task in _plain(storage.get_tasks(USER))}
+
+    def view():
+        daily, by_task, hours = storage.get_dashboard_data(USER)
+        return _plain({
+            'tasks': [task['name'] for task in _plain(storage.get_tasks(USER))],
+            'page': [task['name'] for task in _plain(storage.get_tasks_page(USER, 10)[0])],
+            'daily_seconds': storage.get_daily_seconds(USER, _at(45, 0)[:10]),
+            'total_7': storage.get_total_stat_last_7_days(USER),
+            'daily_7': storage.get_stat_daily_day(USER),
+            'dashboard': [_plain(daily), sorted(_plain(by_task), key=lambda row: (-row[1], row[0])), _plain(hours)],
+            'metrics': storage.get_consistency_metrics(USER),
+        })
+
+    before = view()
+    assert storage.delete_task(USER, tasks['Writing']) is True
+    assert storage.delete_task(USER, tasks['Writing']) is False, 'задача удалена дважды'
+    deleted = view()
+    assert 'Writing' not in deleted['tasks'] + deleted['page'], 'удаленная задача видна'
+    assert storage.get_task(USER, tasks['Writing']) is None
+    assert storage.start_session(USER, tasks['Writing']) is None, 'сессия запущена для удаленной задачи'
+    assert storage.start_session(USER + 1, tasks['Чтение']) is None, 'сессия запущена для чужой задачи'
+    assert deleted['daily_seconds'] != before['daily_seconds'], 'время удаленной задачи в статистике'
+
+    assert storage.restore_task(USER + 1, tasks['Writing']) is False, 'восстановлена чужая задача'
+    assert storage.restore_task(USER, tasks['Writing']) is True
+    assert view() == before, 'после восстановления данные другие'
+
+    # Время отмены не прошло - ничего не удаляется; undo_minutes=0 - удаляется сразу
+    storage.delete_task(USER, tasks['Writing'])
+    assert storage.purge_deleted_tasks(undo_minutes=60) == (0, 0)
+    # Удаляются задачи всех пользователей: в SQLite остались и задачи прошлых проверок
+    purged_tasks, purged_rows = storage.purge_deleted_tasks(undo_minutes=0, chunk_rows=3)
+    assert purged_tasks >= 1 and purged_rows > 0, (purged_tasks, purged_rows)
+    assert storage.restore_task(USER, tasks['Writing']) is False, 'восстановлена окончательно удаленная задача'
+    assert view() == deleted, 'окончательное удаление изменило статистику'
+    return {'before': before, 'deleted': deleted}
+
+
+def check_settings(storage):
+    from config import MAX_SESSION_HOURS
+    assert storage.get_max_session_hours(USER) == MAX_SESSION_HOURS
+    storage.set_max_session_hours(USER, 0)
+    assert storage.get_max_session_hours(USER) == 0
+    assert storage.get_dashboard_profile(USER) is None
+    storage.set_dashboard_profile(USER, 'webp')
+    assert storage.get_dashboard_profile(USER) == 'webp'
+
+    storage.import_sessions(USER, iter(HISTORY[:3]))
+    task_id = _plain(storage.get_tasks(USER))[0]['id']
+    storage.set_weekly_goal(USER, 5)
+    storage.set_weekly_goal(USER, 2, task_id)
+    storage.set_weekly_goal(USER + 1, 9, task_id)  # Чужая задача - цель не меняется
+    goals = (storage.get_consistency_metrics(USER)['goal_hours'], storage.get_consistency_metrics(USER, task_id)['goal_hours'])
+    assert goals == (5, 2), goals
+    storage.set_weekly_goal(USER, 0)
+    assert storage.get_consistency_metrics(USER)['goal_hours'] is None
+    return {'goals': goals}
+
+
+def check_dashboard_version(storage):
+    storage.add_task(USER, 'Задача')
+    task_id = _plain(storage.get_tasks(USER))[0]['id']
+    versions = [storage.get_dashboard_version(USER)]
+    storage.get_dashboard_data(USER)
+    storage.get_stat_daily_day(USER)
+    assert storage.get_dashboard_version(USER) == versions[0], 'версия изменилась от чтения'
+    storage.start_session(USER, task_id)
+    versions.append(storage.get_dashboard_version(USER))
+    storage.stop_session(USER)
+    versions.append(storage.get_dashboard_version(USER))
+    storage.import_sessions(USER, iter(HISTORY[:1]))
+    versions.append(storage.get_dashboard_version(USER))
+    assert len(set(versions)) == len(versions), 'версия не меняется при изменении сессий'
+    return {}
+
+
+CHECKS = [check_tasks, check_sessions, check_import_and_stats, check_delete_task, check_restore_task,
+          check_settings, check_dashboard_version]
+
+
+if __name__ == '__main__':
+    # Настройки читаются при импорте config: SQLite - в новой временной папке
+    tmp_dir = tempfile.mkdtemp(prefix='storage_conformance_')
+    os.environ['DB_PATH'] = os.path.join(tmp_dir, 'time_tracker.db')
+    from database import init_db
+    from storage import SQLiteStorage
+    from memory_storage import MemoryStorage
+
+    ENGINES = {'sqlite': SQLiteStorage, 'memory': MemoryStorage}
+    failed = 0
+    try:
+        init_db()
+        for number, check in enumerate(CHECKS):
+            results = {}
+            for name, engine in ENGINES.items():
+                try:
+                    results[name] = _plain(check(engine()))
+                except Exception:
+                    results[name] = None
+                    failed += 1
+                    print(f"FAIL {check.__name__} [{name}]\n{traceback.format_exc()}")
+            reference = next(iter(results.values()))
+            mismatched = [name for name, result in results.items() if result is not None and result != reference]
+            if mismatched:
+                failed += 1
+                print(f"FAIL {check.__name__}: ответы расходятся")
+                for name, result in results.items():
+                    print(f"  {name}: {result}")
+            elif None not in results.values():
+                print(f"ok   {check.__name__}")
+            USER += 100  # Следующая проверка - с новыми пользователями (в SQLite остаются данные прошлых)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    print(f"\nПроверок: {len(CHECKS)}, движков: {len(ENGINES)}, ошибок: {failed}")
+    sys.exit(1 if failed else 0)
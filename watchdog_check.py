@@ -0,0 +1,113 @@
+"""
+Проверка автоостановки забытых сессий (session_watchdog.py) против локального Bot API.
+
+Watchdog запускается так же, как в main.py: до старта JobQueue, с уже просроченной сессией в БД.
+Проверяется, что такая сессия останавливается сразу после старта бота и что сессия, начатая
+позже, тоже останавливается в свой срок - опоздавший таймер не должен ломать следующие.
+
+    python watchdog_check.py [--port 8092]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+import traceback
+
+BOT_TOKEN = '123456:watchdog-check'
+USER = 3000
+WAIT = 10  # Сколько ждать сообщения об автоостановке, с
+
+
+#Функция ожидания сообщения бота об автоостановке в чате
+async def _wait_stopped(api, chat_id: int):
+    queue = api.listen(chat_id)
+    deadline = time.monotonic() + WAIT
+    while (left := deadline - time.monotonic()) > 0:
+        try:
+            method, message = await asyncio.wait_for(queue.get(), left)
+        except asyncio.TimeoutError:
+            break
+        if method == 'sendMessage' and 'остановлена автоматически' in message['text']:
+            return message['text']
+    raise AssertionError(f"Сессия пользователя {chat_id} не остановлена за {WAIT} с")
+
+
+async def check(port: int):
+    from telegram.ext import ApplicationBuilder
+    from database import get_db_connections
+    from fake_bot_api import FakeBotApi
+    from outbound import OutboundScheduler
+    from session_watchdog import session_watchdog
+    from storage import storage
+
+    # Сессия идет 3 часа при лимите 2 часа - срок прошел, пока бот не работал
+    storage.add_task(USER, 'Чтение')
+    task_id = storage.get_tasks(USER)[0]['id']
+    assert storage.start_session(USER, task_id)
+    storage.set_max_session_hours(USER, 2)
+    conn = get_db_connections(USER)
+    conn.execute("UPDATE sessions SET start_time = datetime('now', '-3 hours') WHERE user_id = ?", (USER,))
+    conn.commit()
+    conn.close()
+
+    api = FakeBotApi(port=port)
+    await api.start()
+    for chat_id in (USER, USER + 1):
+        api.listen(chat_id)
+    application = (ApplicationBuilder().token(BOT_TOKEN).base_url(f"{api.url}/bot")
+                   .rate_limiter(OutboundScheduler()).build())
+    # Как в build_application: таймеры восстанавливаются до старта JobQueue
+    session_watchdog.start(application)
+    try:
+        async with application:
+            await application.start()
+            try:
+                text = await _wait_stopped(api, USER)
+                assert storage.get_active_session(USER) is None, 'просроченная сессия не остановлена'
+                assert 'активное время: 02:00:00' in text, text
+                print("ok   просроченная сессия остановлена после старта")
+
+                # Сессия, начатая после этого, останавливается в свой срок (лимит 3 с)
+                storage.add_task(USER + 1, 'Спорт')
+                task_id = storage.get_tasks(USER + 1)[0]['id']
+                storage.set_max_session_hours(USER + 1, 3 / 3600)
+                assert storage.start_session(USER + 1, task_id)
+                session_watchdog.track(USER + 1)
+                await _wait_stopped(api, USER + 1)
+                assert storage.get_active_session(USER + 1) is None, 'новая сессия не остановлена'
+                print("ok   сессия, начатая позже, остановлена в срок")
+            finally:
+                await application.stop()
+    finally:
+        await api.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Проверка автоостановки забытых сессий')
+    parser.add_argument('--port', type=int, default=8092, help='порт фейкового Bot API')
+    parser.add_argument('--verbose', action='store_true', help='показывать журнал бота')
+    args = parser.parse_args()
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+                        level=logging.INFO if args.verbose else logging.CRITICAL)
+
+    # Настройки читаются при импорте config: SQLite - в новой временной папке
+    tmp_dir = tempfile.mkdtemp(prefix='watchdog_check_')
+    os.environ['DB_PATH'] = os.path.join(tmp_dir, 'time_tracker.db')
+    os.environ['BOT_TOKEN'] = BOT_TOKEN
+    os.environ['STORAGE_ENGINE'] = 'sqlite'
+    from database import init_db
+
+    failed = False
+    try:
+        init_db()
+        asyncio.run(check(args.port))
+    except Exception:
+        failed = True
+        print(f"FAIL\n{traceback.format_exc()}")
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    sys.exit(1 if failed else 0)